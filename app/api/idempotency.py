@@ -0,0 +1,52 @@
+from functools import lru_cache
+from typing import Any, Callable
+
+from fastapi import Header, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+
+from app.services.idempotency_service import (
+    IdempotencyConflict,
+    IdempotencyKeyReused,
+    IdempotencyService,
+)
+
+
+@lru_cache(maxsize=1)
+def get_idempotency_service() -> IdempotencyService:
+    #jeden klient redisa (i jedna pula polaczen) na proces
+    return IdempotencyService()
+
+
+def idempotency_key_header(
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+) -> str | None:
+    return idempotency_key
+
+
+def run_idempotent(
+    response: Response,
+    key: str | None,
+    scope: str,
+    payload: Any,
+    fn: Callable[[], Any],
+) -> Any:
+    #bez naglowka zachowanie jak wczesniej
+    if not key:
+        return fn()
+
+    try:
+        result, replayed = get_idempotency_service().run(
+            scope=scope,
+            key=key,
+            payload=payload,
+            fn=fn,
+            encode=jsonable_encoder,
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
@@ -0,0 +1,243 @@
+#middleware ASGI (bez BaseHTTPMiddleware, zeby nie dokladac narzutu na kazdy request)
+import json
+import math
+import time
+import uuid
+from urllib.parse import parse_qs
+
+import anyio
+
+from app.api.security import is_admin_token
+from app.services.profiling_service import ProfilingService
+from app.services.rate_limiter import RateLimiter, client_ip, route_key
+from app.utils.load import load_monitor, request_started_at
+from app.utils.logging import get_logger, get_request_id, set_request_id
+from app.utils.profiler import ProfilerBusy, SamplingProfiler
+from app.utils.settings import (
+    ADMIN_TOKEN,
+    LOAD_SHED_DB_WAIT_SECONDS,
+    LOAD_SHED_RETRY_AFTER_SECONDS,
+    LOAD_SHED_THREADPOOL_WAIT_SECONDS,
+)
+from app.utils.tracing import parse_traceparent, tracer
+
+logger = get_logger(__name__)
+
+#te sciezki nie sa limitowane ani odrzucane: healthchecki z dockera/LB i diagnostyka admina
+#(potrzebna wlasnie wtedy gdy serwis jest przeciazony, chroniona X-Admin-Token)
+EXEMPT_PATHS = ("/health", "/admin/concurrency")
+EXEMPT_PREFIXES = ("/admin/profile",)
+
+
+def is_exempt(path: str) -> bool:
+    return path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES)
+
+
+async def send_error(send, status: int, detail: str, retry_after: float) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def queue_budget_exceeded(request, exc):
+    #exception handler dla QueueBudgetExceeded (get_db), szybkie 503 zamiast czekania do timeoutu
+    from fastapi.responses import JSONResponse
+
+    logger.warning("Queue budget exceeded: %s", exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Serwis przeciazony, sprobuj ponownie"},
+        headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)},
+    )
+
+
+class RequestIdMiddleware:
+    """
+    X-Request-ID z naglowka (albo nowy) do contextvara, trafia do kazdej linii logu,
+    do taskow celery (naglowek taska) i z powrotem do klienta w odpowiedzi.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        set_request_id(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
+
+
+class TracingMiddleware:
+    #span na request, rodzic z naglowka traceparent (jesli klient go przyslal)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        span = tracer.start(
+            f"{scope['method']} {route_key(scope['method'], scope['path']).split(' ', 1)[1]}",
+            parent=parse_traceparent(traceparent),
+        )
+        if span is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        span.end()
+
+
+class AdmissionControlMiddleware:
+    """
+    Load shedding: gdy requesty czekaja za dlugo na watek albo na polaczenie z puli db,
+    nowe dostaja od razu 503 + Retry-After zamiast stac w kolejce az do timeoutu.
+    Ustawia tez request_started_at (pomiar czekania na threadpool w get_db).
+    """
+
+    def __init__(
+        self,
+        app,
+        db_wait_threshold: float = LOAD_SHED_DB_WAIT_SECONDS,
+        threadpool_wait_threshold: float = LOAD_SHED_THREADPOOL_WAIT_SECONDS,
+        retry_after: int = LOAD_SHED_RETRY_AFTER_SECONDS,
+    ):
+        self.app = app
+        self.thresholds = {
+            "db_pool": db_wait_threshold,
+            "threadpool": threadpool_wait_threshold,
+        }
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_started_at.set(time.perf_counter())
+
+        if not is_exempt(scope["path"]):
+            for layer, threshold in self.thresholds.items():
+                wait = load_monitor.wait(layer)
+                if wait > threshold:
+                    logger.warning("Load shedding: %s wait %.3fs > %ss", layer, wait, threshold)
+                    return await send_error(send, 503, "Serwis przeciazony, sprobuj ponownie", self.retry_after)
+
+        await self.app(scope, receive, send)
+
+
+class RateLimitMiddleware:
+    """
+    Rate limit per IP klienta i per route, z query param user_id dodatkowo per user
+    (user_id nie jest uwierzytelniony, wiec tylko zaostrza limit, nie zastepuje IP).
+    Za proxy IP klienta z X-Forwarded-For, tylko od RATE_LIMIT_TRUSTED_PROXIES.
+    Przekroczenie -> 429 + Retry-After.
+    """
+
+    def __init__(self, app, limiter: RateLimiter | None = None):
+        self.app = app
+        self.limiter = limiter or RateLimiter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or is_exempt(scope["path"]):
+            return await self.app(scope, receive, send)
+
+        query = parse_qs(scope.get("query_string", b"").decode())
+        user_id = query.get("user_id", [None])[0]
+        client = scope.get("client")
+        forwarded_for = dict(scope["headers"]).get(b"x-forwarded-for")
+        ip = client_ip(
+            client[0] if client else "unknown",
+            forwarded_for.decode("latin-1") if forwarded_for else None,
+            self.limiter.trusted_proxies,
+        )
+
+        allowed, retry_after = await self.limiter.check(
+            ip, user_id, route_key(scope["method"], scope["path"])
+        )
+        if not allowed:
+            return await send_error(send, 429, "Za duzo zapytan", retry_after)
+
+        await self.app(scope, receive, send)
+
+
+class ProfilingMiddleware:
+    """
+    Profil pojedynczego requestu: naglowek X-Profile: 1 razem z poprawnym X-Admin-Token.
+    Probkuje caly proces na czas requestu (handler sync dziala w watku z puli, nie wiadomo w ktorym),
+    wynik (collapsed stacks) w redisie pod id = X-Request-ID, pobierany z /admin/profile/requests/{id}.
+    Bez naglowka koszt to jedno przejscie po naglowkach.
+    """
+
+    def __init__(self, app, service: ProfilingService | None = None):
+        self.app = app
+        self.service = service or ProfilingService()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMIN_TOKEN:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") != b"1" or not is_admin_token(headers.get(b"x-admin-token")):
+            return await self.app(scope, receive, send)
+
+        request_id = get_request_id() or uuid.uuid4().hex
+        profiler = SamplingProfiler()
+        try:
+            profiler.start()
+        except ProfilerBusy:
+            status = b"busy"
+            profiler = None
+        else:
+            status = b"ok"
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                extra = [(b"x-profile-status", status)]
+                if profiler is not None:
+                    extra.append((b"x-profile-id", request_id.encode()))
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                await anyio.to_thread.run_sync(self.service.save_request_profile, request_id, profiler)
+
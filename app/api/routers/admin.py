@@ -0,0 +1,136 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.api.security import require_admin
+from app.data.database import get_db
+from app.domain.schemas import OrderTransitionIn, OrderTransitionOut
+from app.services.export_service import ExportService
+from app.services.order_service import OrderService
+from app.services.profiling_service import ProfilingService
+from app.services.stats_service import StatsService
+from app.utils import concurrency
+from app.utils.profiler import ProfilerBusy, collapse, profile_for
+from app.utils.settings import PROFILE_INTERVAL_MS, PROFILE_MAX_SECONDS
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@router.get("/export/orders")
+def export_orders(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: str | None = Query(None),
+    created_from: datetime | None = Query(None, alias="from"),
+    created_to: datetime | None = Query(None, alias="to"),
+    include_items: bool = Query(False),
+):
+    #strumien zamowien (opcjonalnie z pozycjami koszyka), bez ladowania calosci do pamieci
+    body = ExportService().stream(
+        format,
+        include_items=include_items,
+        created_from=created_from,
+        created_to=created_to,
+        status=status,
+    )
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
+    )
+
+
+@router.get("/stats")
+def stats(minutes: int = Query(15, ge=1, le=120)):
+    #rezerwacje per produkt, koszyki per status, zamowienia per minuta (liczniki w redisie)
+    return StatsService().snapshot(minutes=minutes)
+
+
+@router.get("/stats/products/{product_id}")
+def product_stats(product_id: int):
+    return StatsService().product_reservation(product_id)
+
+
+@router.post("/orders/transition", response_model=OrderTransitionOut)
+def transition_orders(payload: OrderTransitionIn, db: Session = Depends(get_db)):
+    #jeden UPDATE dla wszystkich zamowien, pominiete = nie istnieja albo maja inny status
+    try:
+        updated = OrderService(db).transition_orders(
+            payload.order_ids, payload.from_status, payload.to_status
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    updated_ids = {o["id"] for o in updated}
+    return {
+        "updated": sorted(updated_ids),
+        "skipped": [i for i in payload.order_ids if i not in updated_ids],
+    }
+
+
+@router.get("/concurrency")
+async def concurrency_status():
+    #async: odpowiada z petli zdarzen nawet gdy wszystkie watki threadpoola sa zajete
+    return concurrency.snapshot()
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+def profile_process(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=100),
+):
+    """
+    Sampling profiler calego procesu api przez `seconds`, wynik w formacie collapsed stacks
+    (flamegraph.pl, speedscope). Przy kilku procesach uvicorna profiluje ten, ktory obsluzyl request.
+    """
+    try:
+        profiler = profile_for(seconds, interval=interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        collapse(profiler.samples),
+        headers={
+            "X-Profile-Samples": str(sum(profiler.samples.values())),
+            "X-Profile-Ticks": str(profiler.ticks),
+            "X-Profile-Seconds": f"{profiler.duration:.3f}",
+        },
+    )
+
+
+@router.get("/profile/requests/{request_id}", response_class=PlainTextResponse)
+def request_profile(request_id: str):
+    #profil requestu wyslanego z naglowkiem X-Profile: 1 (id z X-Profile-Id)
+    body = ProfilingService().get_request_profile(request_id)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Brak profilu dla tego requestu")
+    return body
+
+
+@router.post("/profile/workers")
+def profile_workers(
+    seconds: int = Query(60, gt=0, le=10 * PROFILE_MAX_SECONDS),
+    task: str = Query("app.tasks.expire.", description="prefiks nazwy taska"),
+    interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=100),
+):
+    #wlacza profilowanie taskow celery na `seconds`, probki ze wszystkich procesow sumowane w redisie
+    return ProfilingService().start_worker_session(seconds, task, interval_ms)
+
+
+@router.get("/profile/workers/{profile_id}", response_class=PlainTextResponse)
+def worker_profile(profile_id: str):
+    meta, body = ProfilingService().get_worker_profile(profile_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="Brak probek dla tej sesji profilowania")
+    return PlainTextResponse(
+        body,
+        headers={
+            "X-Profile-Tasks": meta.get("tasks", "0"),
+            "X-Profile-Samples": meta.get("samples", "0"),
+            "X-Profile-Task-Seconds": meta.get("task_seconds", "0"),
+        },
+    )
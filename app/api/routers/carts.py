@@ -1,14 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.data.database import get_db
+
+from app.api.idempotency import idempotency_key_header, run_idempotent
+from app.api.security import require_admin
+from app.data.database import SessionLocal, get_db
 from app.domain.schemas import (
+    CartBatchGetIn,
+    CartBatchGetOut,
+    CartOut,
     CreateCartIn,
     ItemIn,
-    CartOut,
 )
+from app.repos.cart_repo import make_cart_repo
+from app.services.cart_events import RESYNC, CartEventPublisher, broker, cart_event
 from app.services.cart_service import CartService
-from app.services.product_client import ProductClient
 from app.services.lock_service import LockService
+from app.services.product_client import ProductClient, ProductServiceUnavailable
+from app.services.stats_service import StatsService
+from app.utils.concurrency import QueueBudgetExceeded
 
 router = APIRouter(prefix="/carts", tags=["carts"])
 
@@ -17,12 +31,31 @@ def get_service(db: Session):
         db=db,
         product_client=ProductClient(),
         lock_service=LockService(),
+        stats_service=StatsService(),
+        event_publisher=CartEventPublisher(),
     )
 
 @router.post("/", response_model=CartOut)
-def create_cart(payload: CreateCartIn, db: Session = Depends(get_db)):
+def create_cart(
+    payload: CreateCartIn,
+    response: Response,
+    idempotency_key: str | None = Depends(idempotency_key_header),
+    db: Session = Depends(get_db),
+):
     svc = get_service(db)
-    return svc.create_cart(payload.user_id)
+    return run_idempotent(
+        response,
+        idempotency_key,
+        scope=f"carts:create:{payload.user_id}",
+        payload=payload.model_dump(),
+        fn=lambda: svc.create_cart(payload.user_id),
+    )
+
+@router.post(":batchGet", response_model=CartBatchGetOut, dependencies=[Depends(require_admin)])
+def batch_get_carts(payload: CartBatchGetIn, db: Session = Depends(get_db)):
+    #back-office: do 500 koszykow dwoma zapytaniami IN, wyniki w kolejnosci cart_ids
+    return {"results": get_service(db).get_carts(payload.cart_ids)}
+
 
 @router.get("/{cart_id}", response_model=CartOut)
 def get_cart(
@@ -36,51 +69,187 @@ def get_cart(
         raise HTTPException(status_code=404, detail="Koszyk nie znaleziony")
     return cart
 
+#SSE: co ile wysylac komentarz keep-alive i po jakich statusach zamknac strumien
+SSE_HEARTBEAT_SECONDS = 15
+SSE_TERMINAL_STATUSES = {"FINALIZED", "EXPIRED", "ORDERED"}
+#ile czekac na potwierdzenie subskrypcji pub/sub zanim strumien zostanie odrzucony (503)
+SSE_SUBSCRIBE_TIMEOUT_SECONDS = 5
+
+
+def _load_cart_snapshot(cart_id: int) -> dict | None:
+    #krotka wlasna sesja, strumien SSE nie trzyma polaczenia z puli db
+    db = SessionLocal()
+    try:
+        return make_cart_repo(db).get_cart_view(cart_id)
+    finally:
+        db.close()
+
+
+def _sse(event: dict) -> str:
+    return f"id: {event['version']}\nevent: cart\ndata: {json.dumps(event)}\n\n"
+
+
+@router.get("/{cart_id}/events")
+async def cart_events(
+    cart_id: int,
+    user_id: int = Query(...),
+    last_event_id: int | None = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Server-sent events: zdarzenie przy kazdej zmianie wersji koszyka (add/remove/finalize/expire)
+    zamiast pollingu GET /carts/{id}. id zdarzenia = wersja koszyka, wiec po reconneccie
+    z Last-Event-ID klient dostaje od razu aktualny stan, jesli cos go ominelo.
+    """
+    #najpierw subskrypcja (potwierdzona przez redisa) potem snapshot, zeby nie zgubic zmiany pomiedzy nimi
+    queue = broker.subscribe(cart_id)
+    try:
+        try:
+            await broker.wait_subscribed(SSE_SUBSCRIBE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Zdarzenia koszyka chwilowo niedostepne")
+        view = await run_in_threadpool(_load_cart_snapshot, cart_id)
+        if not view:
+            raise HTTPException(status_code=404, detail="Koszyk nie znaleziony")
+        if view["user_id"] != user_id:
+            raise HTTPException(status_code=403, detail="Brak dostepu do koszyka")
+    except BaseException:
+        broker.unsubscribe(cart_id, queue)
+        raise
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            current = view
+            last_version = last_event_id or 0
+            status = current["status"]
+            if current["version"] > last_version:
+                snapshot = cart_event(cart_id, current["version"], "snapshot", status, current["expires_at"])
+                last_version = current["version"]
+                yield _sse(snapshot)
+
+            while status not in SSE_TERMINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is RESYNC:
+                    #pub/sub byl zerwany, zmiany z przerwy tylko w bazie
+                    current = await run_in_threadpool(_load_cart_snapshot, cart_id)
+                    if current is None:
+                        break
+                    if current["version"] > last_version:
+                        last_version = current["version"]
+                        status = current["status"]
+                        yield _sse(cart_event(cart_id, last_version, "snapshot", status, current["expires_at"]))
+                    continue
+                if event["version"] <= last_version:
+                    continue
+                last_version = event["version"]
+                status = event["status"]
+                yield _sse(event)
+        finally:
+            broker.unsubscribe(cart_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/{cart_id}/items", response_model=CartOut)
 def add_item(
     cart_id: int,
     payload: ItemIn,
+    response: Response,
     user_id: int = Query(...),
+    idempotency_key: str | None = Depends(idempotency_key_header),
     db: Session = Depends(get_db),
 ):
     svc = get_service(db)
-    try:
-        return svc.add_product(
-            user_id=user_id,
-            cart_id=cart_id,
-            product_id=payload.product_id,
-            quantity=payload.quantity,
-        )
-    except PermissionError as e:
-        raise HTTPException(status_code=403, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def action():
+        try:
+            return svc.add_product(
+                user_id=user_id,
+                cart_id=cart_id,
+                product_id=payload.product_id,
+                quantity=payload.quantity,
+            )
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except QueueBudgetExceeded:
+            #przeciazenie (pula db/redisa) -> 503 z handlera w main, nie 400
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return run_idempotent(
+        response,
+        idempotency_key,
+        scope=f"carts:{cart_id}:items:add:{user_id}",
+        payload=payload.model_dump(),
+        fn=action,
+    )
 
 @router.delete("/{cart_id}/items/{product_id}", response_model=CartOut)
 def remove_item(
     cart_id: int,
     product_id: int,
+    response: Response,
     user_id: int = Query(...),
+    idempotency_key: str | None = Depends(idempotency_key_header),
     db: Session = Depends(get_db),
 ):
     svc = get_service(db)
-    try:
-        return svc.remove_product(user_id, cart_id, product_id)
-    except PermissionError as e:
-        raise HTTPException(status_code=403, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def action():
+        try:
+            return svc.remove_product(user_id, cart_id, product_id)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except QueueBudgetExceeded:
+            #przeciazenie (pula db/redisa) -> 503 z handlera w main, nie 400
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return run_idempotent(
+        response,
+        idempotency_key,
+        scope=f"carts:{cart_id}:items:remove:{user_id}",
+        payload={"product_id": product_id},
+        fn=action,
+    )
 
 @router.post("/{cart_id}/finalize", response_model=CartOut)
 def finalize_cart(
     cart_id: int,
+    response: Response,
     user_id: int = Query(...),
+    idempotency_key: str | None = Depends(idempotency_key_header),
     db: Session = Depends(get_db),
 ):
     svc = get_service(db)
-    try:
-        return svc.finalize_cart(user_id, cart_id)
-    except PermissionError as e:
-        raise HTTPException(status_code=403, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def action():
+        try:
+            return svc.finalize_cart(user_id, cart_id)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except QueueBudgetExceeded:
+            #przeciazenie (pula db/redisa) -> 503 z handlera w main, nie 400
+            raise
+        except ProductServiceUnavailable as e:
+            #ceny nie sprawdzone przed deadline (product-service wolny albo pula zajeta), finalize nie przechodzi
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return run_idempotent(
+        response,
+        idempotency_key,
+        scope=f"carts:{cart_id}:finalize:{user_id}",
+        payload={},
+        fn=action,
+    )
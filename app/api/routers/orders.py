@@ -1,27 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
+
+from app.api.idempotency import idempotency_key_header, run_idempotent
 from app.data.database import get_db
 from app.domain.schemas import OrderCreate, OrderOut
+from app.services.cart_events import CartEventPublisher
 from app.services.order_service import OrderService
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
 def get_service(db: Session):
-    return OrderService(db)
+    return OrderService(db, event_publisher=CartEventPublisher())
 
 @router.post("/", response_model=OrderOut, status_code=201)
 def create_order(
     payload: OrderCreate,
+    response: Response,
+    idempotency_key: str | None = Depends(idempotency_key_header),
     db: Session = Depends(get_db),
 ):
     #tworzy order ze sfinalizowanego koszyka i wysyla async notification
+    #z Idempotency-Key powtorka zwraca to samo zamowienie (bez drugiego powiadomienia)
     svc = get_service(db)
-    try:
-        return svc.create_order_from_cart(payload.cart_id, payload.user_id)
-    except PermissionError as e:
-        raise HTTPException(status_code=403, detail=str(e))
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+
+    def action():
+        try:
+            return svc.create_order_from_cart(payload.cart_id, payload.user_id)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return run_idempotent(
+        response,
+        idempotency_key,
+        scope=f"orders:create:{payload.user_id}",
+        payload=payload.model_dump(),
+        fn=action,
+    )
 
 
 @router.get("/{order_id}", response_model=OrderOut)
@@ -0,0 +1,31 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.domain.schemas import ProductAvailabilityOut
+from app.services.lock_service import LockService
+
+router = APIRouter(prefix="/products", tags=["products"])
+
+#listing produktow pyta o ~50 naraz, limit chroni przed jednym gigantycznym pipeline
+MAX_AVAILABILITY_IDS = 200
+
+
+def parse_ids(raw: str) -> list[int]:
+    #"1,2,3" -> [1, 2, 3], bez duplikatow, w kolejnosci z zapytania
+    try:
+        ids = [int(part) for part in raw.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids musi byc lista liczb oddzielonych przecinkami")
+    if not ids:
+        raise HTTPException(status_code=400, detail="Brak ids")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_AVAILABILITY_IDS:
+        raise HTTPException(status_code=400, detail=f"Maksymalnie {MAX_AVAILABILITY_IDS} produktow naraz")
+    return ids
+
+
+@router.get("/availability", response_model=List[ProductAvailabilityOut])
+def availability(ids: str = Query(..., description="ID produktow oddzielone przecinkami, np. 1,2,3")):
+    #czy produkty sa zarezerwowane przez jakis koszyk, jeden round trip do redisa
+    return LockService().product_availability(parse_ids(ids))
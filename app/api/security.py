@@ -0,0 +1,24 @@
+import secrets
+
+from fastapi import Header, HTTPException
+
+from app.utils.settings import ADMIN_TOKEN
+
+
+def is_admin_token(token: str | bytes | None) -> bool:
+    #porownanie na bajtach: compare_digest na str z nie-ASCII rzuca TypeError (500 zamiast 401)
+    #naglowki http to latin-1 (starlette tak je dekoduje), wiec str -> surowe bajty naglowka
+    if not token or not ADMIN_TOKEN:
+        return False
+    if isinstance(token, str):
+        token = token.encode("latin-1", errors="replace")
+    return secrets.compare_digest(token, ADMIN_TOKEN.encode())
+
+
+async def require_admin(x_admin_token: str | None = Header(None, alias="X-Admin-Token")) -> None:
+    #prosty token w naglowku dla endpointow administracyjnych
+    #async: bez blokujacego IO, nie zajmuje watku z threadpoola (np. /admin/concurrency przy saturacji)
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpointy administracyjne sa wylaczone")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=401, detail="Brak uprawnien administratora")
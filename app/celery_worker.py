@@ -1,6 +1,26 @@
 # app/celery_worker.py
-from celery import Celery
 import os
+import threading
+
+from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+)
+
+from app.services.profiling_service import ProfilingService
+from app.utils.logging import get_request_id, set_request_id
+from app.utils.resources import per_process, reset_process_resources
+from app.utils.settings import (
+    CART_FLUSH_INTERVAL_SECONDS,
+    STATS_REBUILD_INTERVAL_SECONDS,
+    WORKER_DB_MAX_OVERFLOW,
+    WORKER_DB_POOL_SIZE,
+)
+from app.utils.tracing import TRACEPARENT_HEADER, inject, parse_traceparent, tracer
 
 BROKER = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/1")
 RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/2")
@@ -14,6 +34,9 @@ celery_app = Celery(
 #jawny import zeby celery je zarejestrowal
 celery_app.conf.imports = (
     "app.tasks.expire",
+    "app.tasks.fulfillment",
+    "app.tasks.cart_flush",
+    "app.tasks.stats",
     "app.services.notification_service",
 )
 
@@ -22,7 +45,109 @@ celery_app.conf.beat_schedule = {
     "expire-carts-every-minute": {
         "task": "app.tasks.expire.expire_carts_task",
         "schedule": 60.0,  # co 60 sekund
+        #nieodebrane wywolanie nie ma sensu po kolejnym ticku, nakladanie blokuje lease w tasku
+        "options": {"expires": 55},
+    },
+    "advance-orders-every-30-seconds": {
+        "task": "app.tasks.fulfillment.advance_orders_task",
+        "schedule": 30.0,
+        "options": {"expires": 25},
     },
+    #write-behind koszykow z redisa (CART_STORAGE=redis), w trybie postgres task konczy sie od razu
+    "flush-carts": {
+        "task": "app.tasks.cart_flush.flush_carts_task",
+        "schedule": CART_FLUSH_INTERVAL_SECONDS,
+        "options": {"expires": CART_FLUSH_INTERVAL_SECONDS},
+    },
+    #korekta licznikow rezerwacji (FINALIZED bez zamowienia), przyrostowo nie da sie ich zwolnic
+    "rebuild-stats": {
+        "task": "app.tasks.stats.rebuild_stats_task",
+        "schedule": float(STATS_REBUILD_INTERVAL_SECONDS),
+        "options": {"expires": STATS_REBUILD_INTERVAL_SECONDS},
+    },
+}
+
+celery_app.conf.timezone = "UTC"
+
+#kolejki: notyfikacje sa IO-bound (worker z pula threads i duza concurrency),
+#expiry zostaje na prefork (osobne procesy, SQL + batch)
+celery_app.conf.task_default_queue = "celery"
+celery_app.conf.task_routes = {
+    "app.services.notification_service.*": {"queue": "notifications"},
+    "app.tasks.expire.*": {"queue": "expiry"},
+    "app.tasks.cart_flush.*": {"queue": "expiry"},
+    "app.tasks.stats.*": {"queue": "expiry"},
 }
 
-celery_app.conf.timezone = "UTC"
\ No newline at end of file
+#nie pozwol celery przejac root loggera, logi idą przez kolejke z app.utils.logging (json)
+celery_app.conf.worker_hijack_root_logger = False
+
+
+def _task_header(request, name: str):
+    return getattr(request, name, None) or (getattr(request, "headers", None) or {}).get(name)
+
+
+#request id i traceparent z api -> naglowki taska -> contextvary w workerze
+@before_task_publish.connect
+def propagate_context(headers=None, **kwargs):
+    if headers is None:
+        return
+    request_id = get_request_id()
+    if request_id:
+        headers.setdefault("request_id", request_id)
+    inject(headers)
+
+
+#span per wykonanie taska, task_id -> span (prerun i postrun sa w tym samym watku)
+_task_spans = {}
+#task_id -> (id sesji profilowania, profiler), sesja wlaczana z POST /admin/profile/workers
+_task_profiles = {}
+get_profiling_service = per_process(ProfilingService)
+
+
+@task_prerun.connect
+def bind_task_context(task_id=None, task=None, **kwargs):
+    request = task.request
+    set_request_id(_task_header(request, "request_id"))
+    span = tracer.start(
+        f"celery.task {task.name}",
+        parent=parse_traceparent(_task_header(request, TRACEPARENT_HEADER)),
+    )
+    if span is not None:
+        _task_spans[task_id] = span
+    profile = get_profiling_service().start_task_profiler(task.name, threading.get_ident())
+    if profile is not None:
+        _task_profiles[task_id] = profile
+
+
+@task_postrun.connect
+def unbind_task_context(task_id=None, state=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        get_profiling_service().save_task_profile(*profile)
+    span = _task_spans.pop(task_id, None)
+    if span is not None:
+        span.set_attribute("celery.state", state)
+        span.end()
+    set_request_id(None)
+
+
+#zasoby tworzone po forku: engine/pula db i pule redisa per proces
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    #dziecko prefork, jeden task naraz, mala pula
+    from app.data.database import init_engine
+    init_engine(pool_size=WORKER_DB_POOL_SIZE, max_overflow=WORKER_DB_MAX_OVERFLOW)
+    reset_process_resources()
+
+
+@worker_init.connect
+def init_worker(sender=None, **kwargs):
+    #pule threads/gevent nie forkuja, tu pula db musi obsluzyc `concurrency` taskow naraz
+    pool_cls = getattr(sender, "pool_cls", None)
+    pool_name = getattr(pool_cls, "__module__", str(pool_cls))
+    if pool_cls is None or "prefork" in pool_name:
+        return
+    from app.data.database import init_engine
+    init_engine(pool_size=sender.concurrency, max_overflow=0)
+    reset_process_resources()
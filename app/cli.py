@@ -0,0 +1,66 @@
+# app/cli.py
+#narzedzia administracyjne z linii komend, np:
+#   python -m app.cli export-orders --format csv --from 2026-01-01 --to 2026-02-01 > orders.csv
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from app.data.database import SessionLocal
+from app.services.export_service import EXPORT_FORMATS, ExportService
+from app.services.stats_service import StatsService
+
+
+def export_orders(args: argparse.Namespace) -> None:
+    out = sys.stdout.buffer
+    for chunk in ExportService().stream(
+        args.format,
+        include_items=args.include_items,
+        created_from=args.created_from,
+        created_to=args.created_to,
+        status=args.status,
+    ):
+        out.write(chunk)
+    out.flush()
+
+
+def rebuild_stats(args: argparse.Namespace) -> None:
+    db = SessionLocal()
+    try:
+        snapshot = StatsService().rebuild(db)
+    finally:
+        db.close()
+    print(json.dumps(snapshot, indent=2))
+
+
+def flush_carts(args: argparse.Namespace) -> None:
+    #replay zaleglych zmian koszykow z redisa (carts:dirty) do bazy
+    from app.tasks.cart_flush import flush_dirty_carts
+    print(json.dumps({"flushed": flush_dirty_carts(batch_size=args.batch_size)}))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export-orders", help="eksport zamowien do NDJSON/CSV na stdout")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    export.add_argument("--status")
+    export.add_argument("--from", dest="created_from", type=datetime.fromisoformat)
+    export.add_argument("--to", dest="created_to", type=datetime.fromisoformat)
+    export.add_argument("--include-items", action="store_true")
+    export.set_defaults(func=export_orders)
+
+    rebuild = sub.add_parser("rebuild-stats", help="przelicz liczniki statystyk z bazy")
+    rebuild.set_defaults(func=rebuild_stats)
+
+    flush = sub.add_parser("flush-carts", help="zapisz koszyki z redisa (CART_STORAGE=redis) do bazy")
+    flush.add_argument("--batch-size", type=int, default=500)
+    flush.set_defaults(func=flush_carts)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
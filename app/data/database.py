@@ -1,14 +1,71 @@
+import time
+
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+#rejestruje eventy sqlalchemy dla spanow SQL
+import app.utils.tracing
+from app.utils.concurrency import QueueBudgetExceeded, budget, check_queue_budget
+from app.utils.load import load_monitor, observe_threadpool_wait
 from app.utils.settings import DATABASE_URL
 
-engine = create_engine(DATABASE_URL, future=True)
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool ktory mierzy ile trwalo pobranie polaczenia z puli (czekanie w kolejce).
+    Przekroczony pool_timeout -> QueueBudgetExceeded (503 + Retry-After) w miejscu pierwszego
+    uzycia sesji, sesja zostaje leniwa (replay idempotentny nie bierze polaczenia wcale).
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout as e:
+            raise QueueBudgetExceeded("db_pool", time.perf_counter() - started) from e
+        finally:
+            load_monitor.observe("db_pool", time.perf_counter() - started)
+
+
+def make_engine(**pool_options):
+    #pool_pre_ping: polaczenie zerwane (restart postgresa, idle timeout) wykryte przed uzyciem
+    return create_engine(
+        DATABASE_URL,
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_pre_ping=True,
+        **pool_options,
+    )
+
+
+#api: rozmiar puli i pool_timeout z budzetu wspolbieznosci (app/utils/concurrency.py),
+#workery celery przebudowuja engine po starcie (init_engine)
+engine = make_engine(**budget.engine_options())
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
 
+
+def init_engine(**pool_options):
+    """
+    Nowy engine (i pula) dla biezacego procesu, SessionLocal przepiety na niego.
+    Wolane po forku w workerze celery: stara pula jest porzucana bez zamykania
+    socketow (dispose(close=False)), bo naleza do procesu rodzica.
+    """
+    global engine
+    engine.dispose(close=False)
+    engine = make_engine(**pool_options)
+    SessionLocal.configure(bind=engine)
+    return engine
+
 def get_db():
+    #pierwsza rzecz wykonywana w watku z threadpoola, wiec tu mierzymy czekanie na watek
+    check_queue_budget("threadpool", observe_threadpool_wait())
+    #sesja leniwa: polaczenie z puli (i pre-ping) dopiero przy pierwszym zapytaniu,
+    #czekanie na pule ograniczone pool_timeout w TimedQueuePool
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
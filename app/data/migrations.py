@@ -0,0 +1,145 @@
+#proste migracje schematu odpalane przy starcie razem z create_all
+#create_all tworzy tylko brakujace tabele, wiec zmiany w istniejacych tabelach idą tutaj
+#zastosowane migracje zapisywane w schema_migrations (kazda wykonuje sie raz), calosc pod
+#pg_advisory_lock, wiec kilka procesow/kontenerow startujacych naraz sie nie scigaja.
+#instrukcje nadal idempotentne (IF NOT EXISTS itd): baza sprzed schema_migrations przejdzie je raz jeszcze
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Engine
+
+from app.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+MIGRATIONS: list[tuple[str, list[str]]] = [
+    (
+        "cart_items unique (cart_id, product_id)",
+        [
+            #scal ewentualne duplikaty z czasow read-modify-write zanim zalozymy indeks
+            """
+            UPDATE cart_items ci SET quantity = d.qty
+            FROM (
+                SELECT min(id) AS id, sum(quantity) AS qty
+                FROM cart_items
+                GROUP BY cart_id, product_id
+                HAVING count(*) > 1
+            ) d
+            WHERE ci.id = d.id
+            """,
+            """
+            DELETE FROM cart_items a
+            USING cart_items b
+            WHERE a.cart_id = b.cart_id
+              AND a.product_id = b.product_id
+              AND a.id > b.id
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_product
+            ON cart_items (cart_id, product_id)
+            """,
+        ],
+    ),
+    (
+        "orders unique cart_id",
+        [
+            #starsze duplikaty zamowien z wyscigu przy tworzeniu: zostaje najstarsze,
+            #reszta oznaczona jako FAILED (nie kasujemy zamowien), indeks ich nie obejmuje
+            """
+            UPDATE orders o SET status = 'FAILED'
+            FROM orders first
+            WHERE o.cart_id = first.cart_id
+              AND o.id > first.id
+              AND o.status <> 'FAILED'
+              AND first.status <> 'FAILED'
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_cart_id
+            ON orders (cart_id) WHERE status <> 'FAILED'
+            """,
+            #koszyki z zamowieniem przechodza do statusu ORDERED
+            """
+            UPDATE carts c SET status = 'ORDERED', version = c.version + 1
+            FROM orders o
+            WHERE o.cart_id = c.id AND c.status = 'FINALIZED'
+            """,
+        ],
+    ),
+    (
+        "money as integer minor units",
+        [
+            #Numeric(10,2) -> BIGINT w groszach + waluta; stare kolumny usuwane po przepisaniu,
+            #blok DO, bo przy kolejnym starcie kolumn price/total juz nie ma
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'cart_items' AND column_name = 'price'
+                ) THEN
+                    ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS price_minor BIGINT;
+                    ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS currency VARCHAR(3) NOT NULL DEFAULT 'PLN';
+                    UPDATE cart_items SET price_minor = round(price * 100) WHERE price_minor IS NULL;
+                    ALTER TABLE cart_items ALTER COLUMN price_minor SET NOT NULL;
+                    ALTER TABLE cart_items DROP COLUMN price;
+                END IF;
+                IF EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'orders' AND column_name = 'total'
+                ) THEN
+                    ALTER TABLE orders ADD COLUMN IF NOT EXISTS total_minor BIGINT;
+                    ALTER TABLE orders ADD COLUMN IF NOT EXISTS currency VARCHAR(3) NOT NULL DEFAULT 'PLN';
+                    UPDATE orders SET total_minor = round(total * 100) WHERE total_minor IS NULL;
+                    ALTER TABLE orders ALTER COLUMN total_minor SET NOT NULL;
+                    ALTER TABLE orders DROP COLUMN total;
+                END IF;
+            END
+            $$
+            """,
+        ],
+    ),
+]
+
+
+#stala dla pg_advisory_lock (dowolna, byle ta sama we wszystkich procesach)
+MIGRATIONS_LOCK_KEY = 7_204_113
+
+_CREATE_SCHEMA_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+
+def run_migrations(engine: Engine, metadata: MetaData | None = None) -> None:
+    """
+    create_all (jesli podano metadata) i brakujace migracje, kazda we wlasnej transakcji
+    razem z wpisem w schema_migrations. Drugi proces czeka na locku, potem widzi wszystko
+    zastosowane i nic nie robi.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        conn.commit()
+        try:
+            if metadata is not None:
+                metadata.create_all(bind=conn)
+            conn.execute(text(_CREATE_SCHEMA_MIGRATIONS))
+            conn.commit()
+            applied = set(conn.execute(text("SELECT name FROM schema_migrations")).scalars())
+            conn.commit()
+
+            for name, statements in MIGRATIONS:
+                if name in applied:
+                    continue
+                try:
+                    for stmt in statements:
+                        conn.execute(text(stmt))
+                    conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.error("Migracja '%s' nie powiodla sie: %s", name, e)
+                    raise
+                logger.info("Migracja '%s' OK", name)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            conn.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
 from sqlalchemy.orm import relationship
 
 from app.data.database import Base
@@ -10,7 +10,7 @@ class CartModel(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
-    status = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # ACTIVE -> FINALIZED -> ORDERED, ACTIVE -> EXPIRED
     version = Column(Integer, nullable=False, default=1)
     expires_at = Column(DateTime(timezone=True), nullable=False)
 
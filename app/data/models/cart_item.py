@@ -1,17 +1,24 @@
-from sqlalchemy import Column, Integer, ForeignKey, Numeric
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, String, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from app.data.database import Base
+from app.domain.money import DEFAULT_CURRENCY
 
 
 class CartItemModel(Base):
     __tablename__ = "cart_items"
+    #jeden wiersz na produkt w koszyku, cel dla INSERT ... ON CONFLICT (cart_id, product_id)
+    __table_args__ = (
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_items_cart_product"),
+    )
 
     id = Column(Integer, primary_key=True)
     cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"), nullable=False)
     product_id = Column(Integer, nullable=False)
 
     quantity = Column(Integer, nullable=False)
-    price = Column(Numeric(10, 2), nullable=False)
+    #cena jednostkowa w groszach/centach (app/domain/money.py)
+    price_minor = Column(BigInteger, nullable=False)
+    currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)
 
     cart = relationship("CartModel", back_populates="items")
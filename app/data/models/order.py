@@ -1,15 +1,37 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Numeric
 from datetime import datetime, timezone
 
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    text,
+)
+
 from app.data.database import Base
+from app.domain.money import DEFAULT_CURRENCY
+
 
 class OrderModel(Base):
     __tablename__ = "orders"
+    #jedno zamowienie na koszyk (nieudane FAILED nie blokuja), cel ON CONFLICT w OrderRepo.create_order_from_cart
+    __table_args__ = (
+        Index(
+            "uq_orders_cart_id",
+            "cart_id",
+            unique=True,
+            postgresql_where=text("status <> 'FAILED'"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
-    status = Column(String, nullable=False, default="PENDING")  # PENDING, PROCESSING, COMPLETED
-    total = Column(Numeric(10, 2), nullable=False)
+    status = Column(String, nullable=False, default="PENDING")  # PENDING, PROCESSING, COMPLETED, FAILED (app/domain/order_state.py)
+    total_minor = Column(BigInteger, nullable=False)
+    currency = Column(String(3), nullable=False, default=DEFAULT_CURRENCY)
     created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
\ No newline at end of file
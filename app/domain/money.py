@@ -0,0 +1,46 @@
+#kwoty jako int w jednostkach podrzednych (grosze/centy) + kod waluty ISO 4217
+#baza, redis i serwisy licza na intach; Decimal tylko przy wejsciu (cena z product-service)
+#i na wyjsciu z api (CartOut/OrderOut)
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+DEFAULT_CURRENCY = "PLN"
+
+#liczba miejsc po przecinku, waluty spoza listy maja 2
+_EXPONENTS = {
+    "JPY": 0,
+    "KRW": 0,
+    "HUF": 2,
+    "KWD": 3,
+    "BHD": 3,
+}
+
+
+class CurrencyMismatch(ValueError):
+    #koszyk/zamowienie ma jedna walute, pozycje w innej walucie sa odrzucane (sumy liczone na intach)
+    pass
+
+
+def exponent(currency: str) -> int:
+    return _EXPONENTS.get(currency, 2)
+
+
+def to_minor(amount, currency: str = DEFAULT_CURRENCY) -> int:
+    """
+    Kwota (str, int, Decimal albo float z JSONa) -> int w jednostkach podrzednych.
+    float przez str(), wiec 199.99 to 19999, a nie 19998.99999.
+    Wiecej miejsc po przecinku niz ma waluta -> ValueError (nie zaokraglamy cen po cichu).
+    """
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError(f"Niepoprawna kwota: {amount!r}")
+    scaled = value.scaleb(exponent(currency))
+    minor = scaled.to_integral_value(rounding=ROUND_HALF_UP)
+    if minor != scaled:
+        raise ValueError(f"Kwota {amount!r} ma wiecej miejsc po przecinku niz waluta {currency}")
+    return int(minor)
+
+
+def from_minor(minor: int, currency: str = DEFAULT_CURRENCY) -> Decimal:
+    #int -> Decimal z dokladnie tyloma miejscami ile ma waluta (np. 19999 -> Decimal("199.99"))
+    return Decimal(minor).scaleb(-exponent(currency))
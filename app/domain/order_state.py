@@ -0,0 +1,26 @@
+#maszyna stanow zamowienia
+#PENDING -> PROCESSING -> COMPLETED
+#PENDING -> FAILED, PROCESSING -> FAILED
+PENDING = "PENDING"
+PROCESSING = "PROCESSING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+TRANSITIONS: dict[str, frozenset[str]] = {
+    PENDING: frozenset({PROCESSING, FAILED}),
+    PROCESSING: frozenset({COMPLETED, FAILED}),
+    COMPLETED: frozenset(),
+    FAILED: frozenset(),
+}
+
+
+def can_transition(from_status: str, to_status: str) -> bool:
+    return to_status in TRANSITIONS.get(from_status, frozenset())
+
+
+def validate_transition(from_status: str, to_status: str) -> None:
+    if from_status not in TRANSITIONS or to_status not in TRANSITIONS:
+        raise ValueError(f"Nieznany status zamowienia: {from_status} -> {to_status}")
+    if not can_transition(from_status, to_status):
+        raise ValueError(f"Niedozwolona zmiana statusu zamowienia: {from_status} -> {to_status}")
+
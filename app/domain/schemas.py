@@ -1,7 +1,10 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List
-from decimal import Decimal
 from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+
+from app.domain.money import DEFAULT_CURRENCY, from_minor
 
 
 class ItemIn(BaseModel):
@@ -15,11 +18,36 @@ class CreateCartIn(BaseModel):
     user_id: int = Field(..., gt=0, description="ID użytkownika (musi być > 0)")
 
 
+#kwoty w serwisach to int w groszach (*_minor), na Decimal zamieniane dopiero tutaj, przy serializacji
 class CartItemOut(BaseModel):
     #produkt w koszyku (response)
     product_id: int
     quantity: int
-    price: Decimal
+    price_minor: int = Field(exclude=True)
+    currency: str = DEFAULT_CURRENCY
+
+    @computed_field
+    @property
+    def price(self) -> Decimal:
+        return from_minor(self.price_minor, self.currency)
+
+
+class PriceChangeOut(BaseModel):
+    #cena pozycji zmieniona przy finalize (aktualna cena z product-service)
+    product_id: int
+    old_price_minor: int = Field(exclude=True)
+    new_price_minor: int = Field(exclude=True)
+    currency: str = DEFAULT_CURRENCY
+
+    @computed_field
+    @property
+    def old_price(self) -> Decimal:
+        return from_minor(self.old_price_minor, self.currency)
+
+    @computed_field
+    @property
+    def new_price(self) -> Decimal:
+        return from_minor(self.new_price_minor, self.currency)
 
 
 class CartOut(BaseModel):
@@ -28,11 +56,34 @@ class CartOut(BaseModel):
     user_id: int
     status: str
     items: List[CartItemOut]
-    total: Decimal
+    total_minor: int = Field(exclude=True)
+    currency: str = DEFAULT_CURRENCY
     expires_at: datetime | None = None
+    #tylko w odpowiedzi finalize
+    price_changes: List[PriceChangeOut] | None = None
 
     model_config = ConfigDict(from_attributes=True)
 
+    @computed_field
+    @property
+    def total(self) -> Decimal:
+        return from_minor(self.total_minor, self.currency)
+
+
+class CartBatchGetIn(BaseModel):
+    #odczyt wielu koszykow naraz (back-office)
+    cart_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+
+class CartBatchResult(BaseModel):
+    cart_id: int
+    found: bool
+    cart: CartOut | None = None
+
+
+class CartBatchGetOut(BaseModel):
+    results: List[CartBatchResult]
+
 
 class UserCreate(BaseModel):
     id: int = Field(..., gt=0, description="ID użytkownika (musi być > 0)")
@@ -59,7 +110,32 @@ class OrderOut(BaseModel):
     cart_id: int
     user_id: int
     status: str
-    total: Decimal
+    total_minor: int = Field(exclude=True)
+    currency: str = DEFAULT_CURRENCY
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+    @computed_field
+    @property
+    def total(self) -> Decimal:
+        return from_minor(self.total_minor, self.currency)
+
+
+class ProductAvailabilityOut(BaseModel):
+    #rezerwacja produktu (lock w redisie), ttl_ms = za ile rezerwacja wygasnie
+    product_id: int
+    reserved: bool
+    ttl_ms: int | None = None
+
+
+class OrderTransitionIn(BaseModel):
+    #masowa zmiana statusu zamowien (admin)
+    order_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    from_status: str
+    to_status: str
+
+
+class OrderTransitionOut(BaseModel):
+    updated: List[int]
+    skipped: List[int]
@@ -1,17 +1,31 @@
 # app/main.py
+import uvicorn
 from fastapi import FastAPI
+
+from app.api.middleware import (
+    AdmissionControlMiddleware,
+    ProfilingMiddleware,
+    RateLimitMiddleware,
+    RequestIdMiddleware,
+    TracingMiddleware,
+    queue_budget_exceeded,
+)
+from app.api.routers import admin, carts, health, orders, products, users
 from app.data.database import Base, engine
-from app.api.routers import users, carts, orders, health
+from app.data.migrations import run_migrations
+from app.services.cart_events import broker
+from app.services.rate_limiter import validate_limits
+from app.utils.concurrency import QueueBudgetExceeded, configure_threadpool
 from app.utils.logging import get_logger
-import uvicorn
+from app.utils.settings import LOAD_SHEDDING_ENABLED, RATE_LIMIT_ENABLED
 
 logger = get_logger(__name__)
 
 # IMPORT WSZYSTKICH MODELI NA POCZATKU (PRZED JAKIMKOLWIEK CREATE_ALL)
-from app.data.models.user import UserModel
 from app.data.models.cart import CartModel
 from app.data.models.cart_item import CartItemModel
 from app.data.models.order import OrderModel
+from app.data.models.user import UserModel
 
 print("=" * 80)
 print("INICJUJE BAZE DANYCH...")
@@ -19,7 +33,8 @@ print(f"Models registered in Base.metadata: {list(Base.metadata.tables.keys())}"
 print("=" * 80)
 
 try:
-    Base.metadata.create_all(bind=engine)
+    #create_all i migracje pod jednym advisory lockiem (kilka workerow/kontenerow naraz)
+    run_migrations(engine, Base.metadata)
     print("POMYSLNIE UTWORZONO TABELE:")
     print("=" * 80)
 except Exception as e:
@@ -39,6 +54,28 @@ def create_app() -> FastAPI:
     app.include_router(users.router)
     app.include_router(carts.router)
     app.include_router(orders.router)
+    app.include_router(products.router)
+    app.include_router(admin.router)
+
+    #threadpool, pula db i pula redisa z jednego budzetu (app/utils/concurrency.py)
+    app.add_event_handler("startup", configure_threadpool)
+    app.add_exception_handler(QueueBudgetExceeded, queue_budget_exceeded)
+    #jedno polaczenie pub/sub dla SSE koszykow, subskrybowane zanim przyjdzie pierwszy klient
+    app.add_event_handler("startup", broker.start)
+    app.add_event_handler("shutdown", broker.stop)
+
+    #ostatnio dodany middleware jest zewnetrzny: najpierw admission control (bez redisa),
+    #potem rate limit (jeden round trip do redisa)
+    if RATE_LIMIT_ENABLED:
+        validate_limits()
+        app.add_middleware(RateLimitMiddleware)
+    if LOAD_SHEDDING_ENABLED:
+        app.add_middleware(AdmissionControlMiddleware)
+    #tracing i request id najbardziej na zewnatrz, zeby 429/503 tez je mialy
+    app.add_middleware(TracingMiddleware)
+    #profil requestu (X-Profile, tylko admin) potrzebuje juz ustawionego request id
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(RequestIdMiddleware)
 
     return app
 
@@ -8,6 +8,12 @@ PRODUCTS = {
     3: {"id": 3, "name": "Monitor", "price": 899.00},
 }
 
+@app.get("/products")
+def get_products(ids: str):
+    #batch: GET /products?ids=1,2,3, brakujacych produktow nie ma w odpowiedzi
+    wanted = [int(i) for i in ids.split(",") if i.strip()]
+    return {"products": [PRODUCTS[i] for i in wanted if i in PRODUCTS]}
+
 @app.get("/products/{product_id}")
 def get_product(product_id: int):
     product = PRODUCTS.get(product_id)
@@ -1,7 +1,65 @@
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from sqlalchemy import select, update, delete
+
 from app.data.models.cart import CartModel
 from app.data.models.cart_item import CartItemModel
+from app.domain.money import DEFAULT_CURRENCY, CurrencyMismatch
+from app.utils.settings import CART_STORAGE
+
+_carts = CartModel.__table__
+_items = CartItemModel.__table__
+
+#read path na Core: jeden SELECT koszyk + pozycje (LEFT JOIN), bez encji ORM i identity map
+#statement budowany raz, z bindparam, wiec kompilacja idzie z cache sqlalchemy
+_CART_VIEW = (
+    select(
+        _carts.c.id,
+        _carts.c.user_id,
+        _carts.c.status,
+        _carts.c.version,
+        _carts.c.expires_at,
+        _items.c.product_id,
+        _items.c.quantity,
+        _items.c.price_minor,
+        _items.c.currency,
+    )
+    .select_from(_carts.outerjoin(_items, _items.c.cart_id == _carts.c.id))
+    .where(_carts.c.id == bindparam("cart_id"))
+    .order_by(_items.c.id)
+)
+
+#odczyt wielu koszykow: dwa zapytania IN (koszyki, pozycje) niezaleznie od liczby id
+_CARTS_BY_IDS = select(
+    _carts.c.id,
+    _carts.c.user_id,
+    _carts.c.status,
+    _carts.c.version,
+    _carts.c.expires_at,
+).where(_carts.c.id.in_(bindparam("cart_ids", expanding=True)))
+
+_ITEMS_BY_CART_IDS = (
+    select(
+        _items.c.cart_id,
+        _items.c.product_id,
+        _items.c.quantity,
+        _items.c.price_minor,
+        _items.c.currency,
+    )
+    .where(_items.c.cart_id.in_(bindparam("cart_ids", expanding=True)))
+    .order_by(_items.c.cart_id, _items.c.id)
+)
+
+#nowe ceny pozycji przy finalize, executemany (jeden statement, wiele zestawow parametrow)
+_UPDATE_ITEM_PRICE = (
+    update(_items)
+    .where(
+        _items.c.cart_id == bindparam("b_cart_id"),
+        _items.c.product_id == bindparam("b_product_id"),
+    )
+    .values(price_minor=bindparam("b_price_minor"), currency=bindparam("b_currency"))
+)
+
 
 class CartRepo:
 
@@ -13,6 +71,61 @@ class CartRepo:
             select(CartModel).where(CartModel.id == cart_id)
         ).scalar_one_or_none()
 
+    def get_cart_view(self, cart_id: int) -> dict | None:
+        """
+        Koszyk razem z pozycjami jako zwykly dict (bez obiektow ORM), jedno zapytanie.
+        {"cart_id", "user_id", "status", "version", "expires_at",
+         "items": [{product_id, quantity, price_minor, currency}]}
+        """
+        rows = self.db.execute(_CART_VIEW, {"cart_id": cart_id}).all()
+        if not rows:
+            return None
+
+        first = rows[0]
+        return {
+            "cart_id": first.id,
+            "user_id": first.user_id,
+            "status": first.status,
+            "version": first.version,
+            "expires_at": first.expires_at,
+            "items": [
+                {
+                    "product_id": r.product_id,
+                    "quantity": r.quantity,
+                    "price_minor": r.price_minor,
+                    "currency": r.currency,
+                }
+                for r in rows
+                if r.product_id is not None
+            ],
+        }
+
+    def get_cart_views(self, cart_ids: list[int]) -> dict[int, dict]:
+        #cart_id -> widok jak w get_cart_view, brakujace id po prostu nie wystepuja
+        if not cart_ids:
+            return {}
+        params = {"cart_ids": list(cart_ids)}
+        views = {
+            r.id: {
+                "cart_id": r.id,
+                "user_id": r.user_id,
+                "status": r.status,
+                "version": r.version,
+                "expires_at": r.expires_at,
+                "items": [],
+            }
+            for r in self.db.execute(_CARTS_BY_IDS, params)
+        }
+        if views:
+            for r in self.db.execute(_ITEMS_BY_CART_IDS, {"cart_ids": list(views)}):
+                views[r.cart_id]["items"].append({
+                    "product_id": r.product_id,
+                    "quantity": r.quantity,
+                    "price_minor": r.price_minor,
+                    "currency": r.currency,
+                })
+        return views
+
     def get_cart_items(self, cart_id: int) -> list[CartItemModel]:
         return self.db.execute(
             select(CartItemModel).where(CartItemModel.cart_id == cart_id)
@@ -54,6 +167,92 @@ class CartRepo:
             )
         )
 
+    def bump_cart_version(self, cart_id: int, new_data: dict | None = None) -> int | None:
+        """
+        version = version + 1 bez porownania wersji (zmiany przemienne, np. dodanie produktu)
+        UPDATE blokuje wiersz koszyka do konca transakcji, wiec rownolegle zmiany sie kolejkuja
+        zamiast konczyc konfliktem. Dziala tylko dla koszyka ACTIVE.
+        Zwraca nowa wersje albo None gdy koszyk nie jest aktywny.
+        """
+        stmt = (
+            update(CartModel)
+            .where(
+                CartModel.id == cart_id,
+                CartModel.status == "ACTIVE",
+            )
+            .values(version=CartModel.version + 1, **(new_data or {}))
+            .returning(CartModel.version)
+        )
+        return self.db.execute(stmt).scalar_one_or_none()
+
+    def add_item_atomic(
+        self,
+        cart_id: int,
+        product_id: int,
+        quantity: int,
+        price_minor: int,
+        expires_at,
+        currency: str = DEFAULT_CURRENCY,
+    ) -> int | None:
+        """
+        Dodanie produktu bez read-modify-write:
+        UPDATE carts SET version = version + 1 ... RETURNING version
+        INSERT ... ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = quantity + :q
+        Najpierw koszyk potem item (ta sama kolejnosc blokad co remove/finalize).
+        Pozycja w innej walucie niz reszta koszyka -> CurrencyMismatch (sprawdzane pod blokada
+        wiersza koszyka, wiec dwa rownolegle add w roznych walutach tez sie nie przepchna).
+        Bez commita, commit robi serwis.
+        """
+        new_version = self.bump_cart_version(cart_id, {"expires_at": expires_at})
+        if new_version is None:
+            return None
+
+        other = self.db.execute(
+            select(CartItemModel.currency)
+            .where(
+                CartItemModel.cart_id == cart_id,
+                CartItemModel.product_id != product_id,
+                CartItemModel.currency != currency,
+            )
+            .limit(1)
+        ).scalar_one_or_none()
+        if other is not None:
+            raise CurrencyMismatch(f"Koszyk jest w walucie {other}, produkt w {currency}")
+
+        stmt = pg_insert(CartItemModel).values(
+            cart_id=cart_id,
+            product_id=product_id,
+            quantity=quantity,
+            price_minor=price_minor,
+            currency=currency,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItemModel.cart_id, CartItemModel.product_id],
+            set_={
+                "quantity": CartItemModel.quantity + stmt.excluded.quantity,
+                "price_minor": stmt.excluded.price_minor,
+                "currency": stmt.excluded.currency,
+            },
+        )
+        self.db.execute(stmt)
+        return new_version
+
+    def remove_item_atomic(self, cart_id: int, product_id: int) -> tuple[int | None, int]:
+        #usun produkt i podbij wersje, zwraca (nowa wersja albo None, usunieta ilosc)
+        new_version = self.bump_cart_version(cart_id)
+        if new_version is None:
+            return None, 0
+
+        removed = self.db.execute(
+            delete(CartItemModel)
+            .where(
+                CartItemModel.cart_id == cart_id,
+                CartItemModel.product_id == product_id,
+            )
+            .returning(CartItemModel.quantity)
+        ).scalar_one_or_none()
+        return new_version, removed or 0
+
     def update_cart_version(self, cart_id: int, old_version: int, new_data: dict) -> int:
         """
         Optimistic locking
@@ -71,8 +270,30 @@ class CartRepo:
         res = self.db.execute(stmt)
         return res.rowcount
 
+    def update_item_prices(self, cart_id: int, changes: list[dict]) -> None:
+        #changes: [{"product_id", "new_price_minor", "currency"}], bez commita (ta sama transakcja co finalize)
+        if not changes:
+            return
+        self.db.execute(_UPDATE_ITEM_PRICE, [
+            {
+                "b_cart_id": cart_id,
+                "b_product_id": c["product_id"],
+                "b_price_minor": c["new_price_minor"],
+                "b_currency": c["currency"],
+            }
+            for c in changes
+        ])
+
     def commit(self) -> None:
         self.db.commit()
 
     def rollback(self) -> None:
         self.db.rollback()
+
+
+def make_cart_repo(db: Session) -> CartRepo:
+    #CART_STORAGE=redis: aktywne koszyki w redisie, zapis do bazy write-behind (redis_cart_repo.py)
+    if CART_STORAGE == "redis":
+        from app.repos.redis_cart_repo import RedisCartRepo
+        return RedisCartRepo(db)
+    return CartRepo(db)
@@ -1,24 +1,139 @@
+from sqlalchemy import bindparam, distinct, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
+
+from app.data.models.cart import CartModel
+from app.data.models.cart_item import CartItemModel
 from app.data.models.order import OrderModel
+from app.domain.order_state import FAILED
+
+_orders = OrderModel.__table__
+_carts = CartModel.__table__
+_items = CartItemModel.__table__
 
+#read path na Core, statement budowany raz (cache kompilacji)
+_ORDER_VIEW = select(
+    _orders.c.id,
+    _orders.c.cart_id,
+    _orders.c.user_id,
+    _orders.c.status,
+    _orders.c.total_minor,
+    _orders.c.currency,
+    _orders.c.created_at,
+).where(_orders.c.id == bindparam("order_id"))
 
 class OrderRepo:
     def __init__(self, db: Session):
         self.db = db
 
-    def create_order(self, order: OrderModel) -> OrderModel:
-        self.db.add(order)
-        self.db.commit()
-        self.db.refresh(order)
-        return order
+    def create_order_from_cart(self, cart_id: int, user_id: int, status: str) -> dict | None:
+        """
+        Zamowienie z koszyka jednym statementem (bez commita, commit po stronie serwisu):
+        WITH moved AS (UPDATE carts SET status = 'ORDERED' ... WHERE status = 'FINALIZED' RETURNING ...),
+             ins AS (INSERT INTO orders SELECT ..., (SELECT sum(price_minor * quantity) ...) FROM moved
+                     ON CONFLICT (cart_id) DO NOTHING RETURNING ...)
+        SELECT ins.*, moved.version FROM ins JOIN moved
+        Rownolegly duplikat czeka na blokadzie wiersza koszyka, potem nie przechodzi warunku statusu.
+        None gdy nic nie utworzono (brak koszyka, cudzy, nie FINALIZED, pusty albo juz zamowiony),
+        wtedy transakcje trzeba wycofac, bo UPDATE koszyka mogl sie wykonac.
+        """
+        moved = (
+            update(_carts)
+            .where(_carts.c.id == cart_id, _carts.c.user_id == user_id, _carts.c.status == "FINALIZED")
+            .values(status="ORDERED", version=_carts.c.version + 1)
+            .returning(_carts.c.id, _carts.c.user_id, _carts.c.version)
+            .cte("moved")
+        )
+        #suma w groszach liczona w bazie (BIGINT), waluta z pozycji koszyka
+        #tylko koszyk z jedna waluta (suma groszy z roznych walut nie ma sensu), mieszany -> None
+        total = (
+            select(func.sum(_items.c.price_minor * _items.c.quantity))
+            .where(_items.c.cart_id == moved.c.id)
+            .scalar_subquery()
+        )
+        currency = (
+            select(func.max(_items.c.currency))
+            .where(_items.c.cart_id == moved.c.id)
+            .having(func.count(distinct(_items.c.currency)) == 1)
+            .scalar_subquery()
+        )
+        ins = (
+            pg_insert(_orders)
+            .from_select(
+                ["cart_id", "user_id", "status", "total_minor", "currency", "created_at"],
+                select(moved.c.id, moved.c.user_id, literal(status), total, currency, func.now())
+                .where(total > 0, currency.is_not(None)),
+            )
+            .on_conflict_do_nothing(index_elements=["cart_id"], index_where=_orders.c.status != FAILED)
+            .returning(*_ORDER_VIEW.selected_columns)
+            .cte("ins")
+        )
+        row = self.db.execute(
+            select(ins, moved.c.version.label("cart_version")).join_from(ins, moved, ins.c.cart_id == moved.c.id)
+        ).first()
+        return dict(row._mapping) if row else None
+
+    def get_cart_quantities(self, cart_id: int) -> list[tuple[int, int]]:
+        #(product_id, quantity) pozycji zamowionego koszyka, dla licznikow rezerwacji
+        rows = self.db.execute(
+            select(_items.c.product_id, _items.c.quantity).where(_items.c.cart_id == cart_id)
+        ).all()
+        return [(r.product_id, r.quantity) for r in rows]
+
+    def get_cart_currencies(self, cart_id: int) -> list[str]:
+        return list(self.db.execute(
+            select(distinct(_items.c.currency)).where(_items.c.cart_id == cart_id)
+        ).scalars())
+
+    def get_order_by_cart(self, cart_id: int) -> dict | None:
+        row = self.db.execute(
+            select(*_ORDER_VIEW.selected_columns)
+            .where(_orders.c.cart_id == cart_id, _orders.c.status != FAILED)
+        ).first()
+        return dict(row._mapping) if row else None
 
     def get_order(self, order_id: int) -> OrderModel | None:
         return self.db.get(OrderModel, order_id)
 
-    def update_order_status(self, order_id: int, status: str) -> OrderModel | None:
-        order = self.get_order(order_id)
-        if order:
-            order.status = status
-            self.db.commit()
-            self.db.refresh(order)
-        return order
\ No newline at end of file
+    def get_order_view(self, order_id: int) -> dict | None:
+        #zamowienie jako dict, bez encji ORM
+        row = self.db.execute(_ORDER_VIEW, {"order_id": order_id}).first()
+        return dict(row._mapping) if row else None
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def rollback(self) -> None:
+        self.db.rollback()
+
+    def bulk_transition(
+        self,
+        from_status: str,
+        to_status: str,
+        order_ids: list[int] | None = None,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """
+        Set-based zmiana statusu wielu zamowien jednym statementem:
+        UPDATE orders SET status = :to WHERE status = :from [AND id IN (...)] RETURNING id, user_id
+        Z limit: batch przez podzapytanie FOR UPDATE SKIP LOCKED (rownolegle workery sie nie blokuja).
+        Walidacja przejscia po stronie serwisu.
+        """
+        stmt = update(_orders).where(_orders.c.status == from_status)
+        if order_ids is not None:
+            stmt = stmt.where(_orders.c.id.in_(order_ids))
+        if limit is not None:
+            batch = (
+                select(_orders.c.id)
+                .where(_orders.c.status == from_status)
+                .order_by(_orders.c.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            stmt = stmt.where(_orders.c.id.in_(batch.scalar_subquery()))
+
+        rows = self.db.execute(
+            stmt.values(status=to_status).returning(_orders.c.id, _orders.c.user_id)
+        ).all()
+        self.db.commit()
+        return [{"id": r.id, "user_id": r.user_id} for r in rows]
@@ -0,0 +1,425 @@
+"""
+Aktywne koszyki w redisie (CART_STORAGE=redis), Postgres jako trwaly zapis (write-behind).
+
+Stan koszyka: hash cart:{id} -> user_id, status, version, expires_at (epoch),
+i:{product_id} -> "ilosc:cena_w_groszach:waluta".
+Zmiany (add/remove/finalize) to jeden skrypt lua: sprawdzenie statusu, waznosci i rezerwacji
+produktu (product:{id}:lock nalezy do koszyka) + zmiana pozycji + version + 1 + wpis do carts:dirty.
+
+carts:dirty (zset cart_id -> czas pierwszej niezapisanej zmiany) to jednoczesnie dziennik do replay:
+flush (app/tasks/cart_flush.py) zapisuje pelny stan koszyka do carts/cart_items i dopiero potem
+zdejmuje wpis, o ile wersja sie nie zmienila. Crash workera w trakcie = wpis zostaje i kolejny
+przebieg zapisuje koszyk jeszcze raz (zapis idempotentny, UPDATE ... WHERE version <= :version).
+Brak koszyka w redisie (nowy proces redisa, eviction) = ponowne zaladowanie z ostatniego zapisu w bazie.
+"""
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from app.data.models.cart import CartModel
+from app.data.models.cart_item import CartItemModel
+from app.domain.money import DEFAULT_CURRENCY, CurrencyMismatch
+from app.repos.cart_repo import CartRepo, _carts, _items
+from app.utils.logging import get_logger
+from app.utils.redis_client import redis_client
+from app.utils.resources import per_process
+from app.utils.settings import CART_TTL_SECONDS
+
+logger = get_logger(__name__)
+
+DIRTY_KEY = "carts:dirty"
+#klucz koszyka zyje dluzej niz sam koszyk, zeby flush zdazyl zapisac porzucony koszyk
+KEY_TTL_SECONDS = CART_TTL_SECONDS + 3600
+
+#wynik skryptu gdy koszyka nie ma w redisie, repo laduje go z bazy i ponawia
+_MISSING = -1
+
+#KEYS: cart, product lock, dirty; ARGV: product_id, quantity, "price_minor:currency", expires_at, now, cart_id, key ttl
+#>0 nowa wersja, 0 koszyk nieaktywny/wygasly, -1 brak w redisie, -2 rezerwacja nie nalezy do koszyka,
+#-3 inne pozycje koszyka maja inna walute
+_ADD_LUA = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then return -1 end
+if status ~= 'ACTIVE' or tonumber(redis.call('HGET', KEYS[1], 'expires_at')) < tonumber(ARGV[5]) then
+    return 0
+end
+if redis.call('GET', KEYS[2]) ~= ARGV[6] then return -2 end
+local field = 'i:' .. ARGV[1]
+local currency = string.match(ARGV[3], ':(%w+)$')
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    local f = fields[i]
+    if f ~= field and string.sub(f, 1, 2) == 'i:' and string.match(fields[i + 1], ':(%w+)$') ~= currency then
+        return -3
+    end
+end
+local qty = tonumber(ARGV[2])
+local current = redis.call('HGET', KEYS[1], field)
+if current then qty = qty + tonumber(string.match(current, '^(%d+)')) end
+redis.call('HSET', KEYS[1], field, qty .. ':' .. ARGV[3], 'expires_at', ARGV[4])
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[5], ARGV[6])
+return version
+"""
+
+#KEYS: cart, dirty; ARGV: product_id, now, cart_id -> {wersja albo 0/-1, usunieta ilosc}
+_REMOVE_LUA = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then return {-1, 0} end
+if status ~= 'ACTIVE' or tonumber(redis.call('HGET', KEYS[1], 'expires_at')) < tonumber(ARGV[2]) then
+    return {0, 0}
+end
+local field = 'i:' .. ARGV[1]
+local current = redis.call('HGET', KEYS[1], field)
+local removed = 0
+if current then
+    removed = tonumber(string.match(current, '^(%d+)'))
+    redis.call('HDEL', KEYS[1], field)
+end
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[3])
+return {version, removed}
+"""
+
+#optimistic locking w redisie; KEYS: cart, dirty; ARGV: old version, now, cart_id, pola...
+#1 ok, 0 inna wersja, -1 brak w redisie
+_CAS_LUA = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if not version then return -1 end
+if tonumber(version) ~= tonumber(ARGV[1]) then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[3])
+return 1
+"""
+
+#zaladowanie koszyka z bazy, tylko jesli nikt go w miedzyczasie nie zaladowal; ARGV: ttl, pola...
+_SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+#po zapisie do bazy: zdejmij z carts:dirty jesli wersja ta sama, koszyk nieaktywny usun z redisa
+#KEYS: cart, dirty; ARGV: cart_id, zapisana wersja
+_CLEAN_LUA = """
+local version = redis.call('HGET', KEYS[1], 'version')
+if version and tonumber(version) ~= tonumber(ARGV[2]) then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+if version and redis.call('HGET', KEYS[1], 'status') ~= 'ACTIVE' then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+
+def cart_key(cart_id: int) -> str:
+    return f"cart:{cart_id}"
+
+
+def _epoch(value: datetime) -> str:
+    return repr(value.timestamp())
+
+
+def _decode(cart_id: int, raw: dict) -> dict:
+    #hash z redisa -> ten sam ksztalt co CartRepo.get_cart_view
+    items = []
+    for field, value in raw.items():
+        if field.startswith("i:"):
+            quantity, price_minor, currency = value.split(":", 2)
+            items.append({
+                "product_id": int(field[2:]),
+                "quantity": int(quantity),
+                "price_minor": int(price_minor),
+                "currency": currency,
+            })
+    items.sort(key=lambda i: i["product_id"])
+    return {
+        "cart_id": cart_id,
+        "user_id": int(raw["user_id"]),
+        "status": raw["status"],
+        "version": int(raw["version"]),
+        "expires_at": datetime.fromtimestamp(float(raw["expires_at"]), timezone.utc),
+        "items": items,
+    }
+
+
+def _encode(view: dict) -> list[str]:
+    fields = [
+        "user_id", str(view["user_id"]),
+        "status", view["status"],
+        "version", str(view["version"]),
+        "expires_at", _epoch(view["expires_at"]),
+    ]
+    for i in view["items"]:
+        fields += [f"i:{i['product_id']}", f"{i['quantity']}:{i['price_minor']}:{i['currency']}"]
+    return fields
+
+
+class RedisCartStore:
+    #klient redisa i skrypty, jeden na proces (get_cart_store)
+
+    def __init__(self, url: str | None = None):
+        self.redis = redis_client(url)
+        self._add = self.redis.register_script(_ADD_LUA)
+        self._remove = self.redis.register_script(_REMOVE_LUA)
+        self._cas = self.redis.register_script(_CAS_LUA)
+        self._seed = self.redis.register_script(_SEED_LUA)
+        self._clean = self.redis.register_script(_CLEAN_LUA)
+
+    def load(self, cart_id: int) -> dict | None:
+        raw = self.redis.hgetall(cart_key(cart_id))
+        return _decode(cart_id, raw) if raw else None
+
+    def load_many(self, cart_ids: list[int]) -> dict[int, dict]:
+        pipe = self.redis.pipeline(transaction=False)
+        for cart_id in cart_ids:
+            pipe.hgetall(cart_key(cart_id))
+        return {cart_id: _decode(cart_id, raw) for cart_id, raw in zip(cart_ids, pipe.execute()) if raw}
+
+    def seed(self, view: dict) -> None:
+        self._seed(keys=[cart_key(view["cart_id"])], args=[KEY_TTL_SECONDS, *_encode(view)])
+
+    def add_item(
+        self,
+        cart_id: int,
+        product_id: int,
+        quantity: int,
+        price_minor: int,
+        currency: str,
+        expires_at: datetime,
+    ) -> int:
+        return int(self._add(
+            keys=[cart_key(cart_id), f"product:{product_id}:lock", DIRTY_KEY],
+            args=[
+                product_id, quantity, f"{price_minor}:{currency}",
+                _epoch(expires_at), repr(time.time()), cart_id, KEY_TTL_SECONDS,
+            ],
+        ))
+
+    def remove_item(self, cart_id: int, product_id: int) -> tuple[int, int]:
+        version, removed = self._remove(
+            keys=[cart_key(cart_id), DIRTY_KEY],
+            args=[product_id, repr(time.time()), cart_id],
+        )
+        return int(version), int(removed)
+
+    def compare_and_set(self, cart_id: int, old_version: int, fields: dict) -> int:
+        flat = []
+        for name, value in fields.items():
+            flat += [name, _epoch(value) if isinstance(value, datetime) else str(value)]
+        return int(self._cas(
+            keys=[cart_key(cart_id), DIRTY_KEY],
+            args=[old_version, repr(time.time()), cart_id, *flat],
+        ))
+
+    def set_prices(self, cart_id: int, view: dict, changes: list[dict]) -> None:
+        #tylko koszyk juz zamkniety (CAS), add/remove sa wtedy odrzucane, wiec ilosc z view aktualna
+        quantities = {i["product_id"]: i["quantity"] for i in view["items"]}
+        fields = {
+            f"i:{c['product_id']}": f"{quantities[c['product_id']]}:{c['new_price_minor']}:{c['currency']}"
+            for c in changes
+            if c["product_id"] in quantities
+        }
+        if fields:
+            self.redis.hset(cart_key(cart_id), mapping=fields)
+
+    def dirty_ids(self, limit: int | None = None) -> list[int]:
+        #najstarsze niezapisane zmiany pierwsze
+        end = -1 if limit is None else limit - 1
+        return [int(i) for i in self.redis.zrange(DIRTY_KEY, 0, end)]
+
+    def dirty_among(self, cart_ids: list[int]) -> set[int]:
+        #ktore z podanych koszykow maja niezapisane zmiany, jeden ZMSCORE (redis >= 6.2)
+        if not cart_ids:
+            return set()
+        scores = self.redis.zmscore(DIRTY_KEY, cart_ids)
+        return {cart_id for cart_id, score in zip(cart_ids, scores) if score is not None}
+
+    def mark_clean(self, flushed: dict[int, int]) -> None:
+        #cart_id -> zapisana wersja, jeden pipeline
+        if not flushed:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for cart_id, version in flushed.items():
+            self._clean(keys=[cart_key(cart_id), DIRTY_KEY], args=[cart_id, version], client=pipe)
+        pipe.execute()
+
+    def evict(self, cart_ids: list[int]) -> None:
+        #koszyki zamkniete w bazie (expiry), ich stan w redisie jest juz nieaktualny
+        if cart_ids:
+            self.redis.delete(*(cart_key(i) for i in cart_ids))
+
+
+get_cart_store = per_process(RedisCartStore)
+
+
+def write_back(db: Session, view: dict) -> bool:
+    """
+    Pelny stan koszyka z redisa do carts/cart_items (bez commita).
+    Tylko nad koszykiem ACTIVE w bazie i nie starszym niz zapisywany stan, wiec powtorny
+    albo spozniony zapis nic nie psuje. False gdy koszyk w bazie jest juz zamkniety/nowszy.
+    """
+    cart_id = view["cart_id"]
+    updated = db.execute(
+        update(_carts)
+        .where(_carts.c.id == cart_id, _carts.c.status == "ACTIVE", _carts.c.version <= view["version"])
+        .values(status=view["status"], version=view["version"], expires_at=view["expires_at"])
+        .returning(_carts.c.id)
+    ).first()
+    if updated is None:
+        return False
+
+    db.execute(delete(_items).where(_items.c.cart_id == cart_id))
+    if view["items"]:
+        db.execute(
+            insert(_items),
+            [
+                {"cart_id": cart_id, **i}
+                for i in view["items"]
+            ],
+        )
+    return True
+
+
+class RedisCartRepo(CartRepo):
+    """
+    Ten sam interfejs co CartRepo, CartService nie wie gdzie jest koszyk.
+    Odczyty i zmiany aktywnego koszyka ida do redisa, koszyki zamkniete (FINALIZED, ORDERED,
+    EXPIRED) i tworzenie koszyka nadal do Postgresa.
+    """
+
+    def __init__(self, db: Session, store: RedisCartStore | None = None):
+        super().__init__(db)
+        self.store = store or get_cart_store()
+        #koszyki zamkniete w tej transakcji: po commicie usuwane z redisa, po rollbacku otwierane z powrotem
+        self._closed: dict[int, int] = {}
+
+    def _load(self, cart_id: int) -> dict | None:
+        #redis, a jak nie ma to ostatni zapis z bazy (tylko aktywny koszyk wraca do redisa)
+        view = self.store.load(cart_id)
+        if view is not None:
+            return view
+        view = super().get_cart_view(cart_id)
+        if view is not None and view["status"] == "ACTIVE":
+            self.store.seed(view)
+        return view
+
+    def get_cart(self, cart_id: int) -> CartModel | None:
+        view = self.store.load(cart_id)
+        if view is None:
+            return super().get_cart(cart_id)
+        #encja tylko do odczytu, nie dodawana do sesji
+        return CartModel(
+            id=view["cart_id"],
+            user_id=view["user_id"],
+            status=view["status"],
+            version=view["version"],
+            expires_at=view["expires_at"],
+        )
+
+    def get_cart_view(self, cart_id: int) -> dict | None:
+        return self._load(cart_id)
+
+    def get_cart_views(self, cart_ids: list[int]) -> dict[int, dict]:
+        #aktywne z redisa (jeden pipeline), reszta z bazy; bez ladowania do redisa
+        views = self.store.load_many(list(cart_ids)) if cart_ids else {}
+        missing = [i for i in cart_ids if i not in views]
+        if missing:
+            views.update(super().get_cart_views(missing))
+        return views
+
+    def get_cart_items(self, cart_id: int) -> list[CartItemModel]:
+        view = self.store.load(cart_id)
+        if view is None:
+            return super().get_cart_items(cart_id)
+        return [CartItemModel(cart_id=cart_id, **i) for i in view["items"]]
+
+    def create_cart(self, cart: CartModel) -> CartModel:
+        created = super().create_cart(cart)
+        self.store.seed({
+            "cart_id": created.id,
+            "user_id": created.user_id,
+            "status": created.status,
+            "version": created.version,
+            "expires_at": created.expires_at,
+            "items": [],
+        })
+        return created
+
+    def add_item_atomic(
+        self,
+        cart_id: int,
+        product_id: int,
+        quantity: int,
+        price_minor: int,
+        expires_at,
+        currency: str = DEFAULT_CURRENCY,
+    ) -> int | None:
+        args = (cart_id, product_id, quantity, price_minor, currency, expires_at)
+        result = self.store.add_item(*args)
+        if result == _MISSING and self._load(cart_id) is not None:
+            result = self.store.add_item(*args)
+        if result == -2:
+            raise RuntimeError("Produkt jest już zarezerwowany przez inny koszyk")
+        if result == -3:
+            raise CurrencyMismatch(f"Koszyk jest w innej walucie niz produkt ({currency})")
+        return result if result > 0 else None
+
+    def remove_item_atomic(self, cart_id: int, product_id: int) -> tuple[int | None, int]:
+        version, removed = self.store.remove_item(cart_id, product_id)
+        if version == _MISSING and self._load(cart_id) is not None:
+            version, removed = self.store.remove_item(cart_id, product_id)
+        return (version, removed) if version > 0 else (None, 0)
+
+    def update_cart_version(self, cart_id: int, old_version: int, new_data: dict) -> int:
+        result = self.store.compare_and_set(cart_id, old_version, new_data)
+        if result == _MISSING:
+            return super().update_cart_version(cart_id, old_version, new_data)
+        if result == 0:
+            return 0
+
+        view = self.store.load(cart_id)
+        if view is not None and view["status"] != "ACTIVE":
+            #zamkniecie koszyka (finalize) zapisywane od razu, w transakcji serwisu.
+            #CAS w redisie zostaje punktem serializacji (nowe add/remove odrzucane od tej chwili),
+            #ale do commita jest tymczasowe: rollback albo nieudany commit otwiera koszyk z powrotem
+            self._closed[cart_id] = view["version"]
+            if not write_back(self.db, view):
+                #w bazie koszyk zamkniety wczesniej (expiry), baza wygrywa, stan z redisa do usuniecia
+                del self._closed[cart_id]
+                self.store.mark_clean({cart_id: view["version"]})
+                return 0
+        return 1
+
+    def update_item_prices(self, cart_id: int, changes: list[dict]) -> None:
+        super().update_item_prices(cart_id, changes)
+        #te same ceny w hashu: koszyk zamkniety w redisie ma stan zgodny z tym co idzie do bazy
+        view = self.store.load(cart_id) if changes else None
+        if view is not None:
+            self.store.set_prices(cart_id, view, changes)
+
+    def _reopen(self) -> None:
+        #transakcja nie doszla do skutku: koszyki zamkniete CAS-em wracaja do ACTIVE (z nowa wersja,
+        #wersje nie cofaja sie), inaczej flush zapisalby do bazy zamkniecie ktorego nie bylo
+        closed, self._closed = self._closed, {}
+        for cart_id, version in closed.items():
+            if self.store.compare_and_set(cart_id, version, {"status": "ACTIVE", "version": version + 1}) != 1:
+                logger.warning("Cart %s: nie udalo sie otworzyc koszyka w redisie po rollbacku", cart_id)
+
+    def commit(self) -> None:
+        try:
+            super().commit()
+        except Exception:
+            self._reopen()
+            raise
+        #po commicie: zamkniete koszyki znikaja z redisa i z carts:dirty
+        closed, self._closed = self._closed, {}
+        self.store.mark_clean(closed)
+
+    def rollback(self) -> None:
+        super().rollback()
+        self._reopen()
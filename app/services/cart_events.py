@@ -0,0 +1,147 @@
+#zdarzenia zmian koszyka (nowa wersja) przez redis pub/sub, konsumowane przez SSE (GET /carts/{id}/events)
+import asyncio
+import json
+from datetime import datetime
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.utils.logging import get_logger
+from app.utils.redis_client import redis_client
+from app.utils.settings import REDIS_URL
+
+logger = get_logger(__name__)
+
+CHANNEL = "cart:{cart_id}:events"
+CHANNEL_PATTERN = "cart:*:events"
+#znacznik w kolejce subskrybenta: polaczenie pub/sub bylo zerwane, zdarzenia mogly przepasc,
+#strumien ma ponownie przeczytac koszyk z bazy
+RESYNC = {"type": "resync"}
+
+
+def cart_event(
+    cart_id: int,
+    version: int,
+    type: str,
+    status: str,
+    expires_at: datetime | None = None,
+) -> dict:
+    #kompaktowe zdarzenie, klient dociaga pelny koszyk tylko jesli go potrzebuje
+    event = {"cart_id": cart_id, "version": version, "type": type, "status": status}
+    if expires_at is not None:
+        event["expires_at"] = expires_at.isoformat()
+    return event
+
+
+class CartEventPublisher:
+    #publikacja po commicie (CartService, expiry), best-effort jak statystyki
+    def __init__(self, url: str | None = None):
+        self.redis = redis_client(url)
+
+    def publish(self, event: dict) -> None:
+        self.publish_many([event])
+
+    def publish_many(self, events: list[dict]) -> None:
+        if not events:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for event in events:
+                pipe.publish(CHANNEL.format(cart_id=event["cart_id"]), json.dumps(event))
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("Cart event publish failed: %s", e)
+
+
+class CartEventBroker:
+    """
+    Jedno polaczenie pub/sub (PSUBSCRIBE cart:*:events) na proces api,
+    rozsylka do lokalnych subskrybentow (asyncio.Queue per polaczenie SSE).
+    Tysiace bezczynnych polaczen SSE kosztuja tylko kolejke i wpis w slowniku,
+    zaden watek ani polaczenie z redisem per klient.
+    Start przy starcie api (start/stop), `subscribed` ustawione dopiero po potwierdzeniu PSUBSCRIBE
+    przez redisa; po ponownym polaczeniu kazdy subskrybent dostaje RESYNC.
+    """
+
+    def __init__(self, url: str | None = None):
+        self.url = url or REDIS_URL
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._task: asyncio.Task | None = None
+        self.subscribed = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait_subscribed(self, timeout: float) -> None:
+        #zdarzenia opublikowane przed potwierdzeniem PSUBSCRIBE nie dotra, wiec snapshot dopiero po nim
+        #asyncio.TimeoutError gdy redis niedostepny
+        await self.start()
+        await asyncio.wait_for(self.subscribed.wait(), timeout)
+
+    def subscribe(self, cart_id: int) -> asyncio.Queue:
+        #kolejka o rozmiarze 1: liczy sie tylko najnowszy stan koszyka
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(cart_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, cart_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(cart_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[cart_id]
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: dict) -> None:
+        if queue.full():
+            #RESYNC nie jest wypierany: ponowny odczyt koszyka i tak obejmie nowsze zdarzenie
+            if queue.get_nowait() is RESYNC:
+                event = RESYNC
+        queue.put_nowait(event)
+
+    def _dispatch(self, event: dict) -> None:
+        for queue in self._subscribers.get(event["cart_id"], ()):
+            self._put(queue, event)
+
+    def _resync(self) -> None:
+        for queues in self._subscribers.values():
+            for queue in queues:
+                self._put(queue, RESYNC)
+
+    async def _listen(self) -> None:
+        reconnect = False
+        while True:
+            client = aioredis.Redis.from_url(self.url, decode_responses=True)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(CHANNEL_PATTERN)
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self._dispatch(json.loads(message["data"]))
+                    elif message["type"] == "psubscribe":
+                        self.subscribed.set()
+                        if reconnect:
+                            self._resync()
+                        reconnect = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cart event listener error, reconnecting: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                self.subscribed.clear()
+                await pubsub.aclose()
+                await client.aclose()
+
+
+broker = CartEventBroker()
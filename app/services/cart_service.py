@@ -1,17 +1,36 @@
-from datetime import datetime, timezone, timedelta
-from decimal import Decimal
-from typing import Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
 from sqlalchemy.orm import Session
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random
+
 from app.data.models.cart import CartModel
-from app.data.models.cart_item import CartItemModel
-from app.repos.cart_repo import CartRepo
+from app.domain.money import DEFAULT_CURRENCY, CurrencyMismatch, to_minor
+from app.repos.cart_repo import make_cart_repo
+from app.services.cart_events import CartEventPublisher, cart_event
+from app.services.lock_service import LOCK_ACQUIRED, LockService
 from app.services.product_client import ProductClient
-from app.services.lock_service import LockService
-from app.utils.settings import CART_TTL_SECONDS
+from app.services.stats_service import StatsService
 from app.utils.logging import get_logger
+from app.utils.settings import CART_CONFLICT_RETRIES, CART_TTL_SECONDS
 
 logger = get_logger(__name__)
 
+
+class ConcurrencyConflict(RuntimeError):
+    #optimistic locking, wersja koszyka zmienila sie w trakcie operacji
+    pass
+
+
+#tenacity retry dla konfliktow wersji, krotki losowy backoff zeby rozjechac rownolegle zadania
+def conflict_retry():
+    return retry(
+        reraise=True,
+        stop=stop_after_attempt(CART_CONFLICT_RETRIES),
+        wait=wait_random(min=0.005, max=0.05),
+        retry=retry_if_exception_type(ConcurrencyConflict),
+    )
+
 class CartService:
     """
     Prosta implementacja cqrs i proste use case dla domeny cart
@@ -24,68 +43,72 @@ class CartService:
         db: Session,
         product_client: ProductClient,
         lock_service: LockService,
+        stats_service: StatsService | None = None,
+        event_publisher: CartEventPublisher | None = None,
     ):
-        self.repo = CartRepo(db)
+        self.repo = make_cart_repo(db)
         self.product_client = product_client
         self.lock_service = lock_service
+        self.stats = stats_service or StatsService()
+        #bez publishera (np. skrypty/benchmarki) zdarzenia SSE nie sa wysylane
+        self.events = event_publisher
 
     #query - odczyt
     def get_cart(self, cart_id: int, user_id: int) -> Dict[str, Any] | None:
-        cart = self.repo.get_cart(cart_id)
+        #lean read path (Core, jedno zapytanie), bez materializacji encji ORM
+        view = self.repo.get_cart_view(cart_id)
 
-        if not cart:
+        if not view:
             return None
 
-        if cart.user_id != user_id:
+        if view["user_id"] != user_id:
             raise PermissionError("Brak dostepu do koszyka")
 
-        #pobierz produkty z repo i oblicz total
-        items = self.repo.get_cart_items(cart_id)
-        total = sum((i.price * i.quantity for i in items), Decimal("0.00"))
+        return self._to_response(view)
 
-        #dict przyksztalcany w jsona
+    def get_carts(self, cart_ids: list[int]) -> list[Dict[str, Any]]:
+        """
+        Odczyt wielu koszykow naraz (back-office), bez sprawdzania wlasciciela (endpoint admina).
+        Wyniki w kolejnosci zapytania, brakujace id jako {"cart_id", "found": False}.
+        """
+        views = self.repo.get_cart_views(cart_ids)
+        return [
+            {"cart_id": cart_id, "found": True, "cart": self._to_response(views[cart_id])}
+            if cart_id in views
+            else {"cart_id": cart_id, "found": False, "cart": None}
+            for cart_id in cart_ids
+        ]
+
+    @staticmethod
+    def _to_response(view: Dict[str, Any]) -> Dict[str, Any]:
+        #dict przyksztalcany w jsona, total liczony z pozycji na intach (grosze)
+        #wszystkie pozycje w jednej walucie (pilnuje add_item_atomic i finalize), wiec waluta z pierwszej
+        items = view["items"]
+        total_minor = sum(i["price_minor"] * i["quantity"] for i in items)
         return {
-            "cart_id": cart.id,
-            "user_id": cart.user_id,
-            "status": cart.status,
-            "items": [
-                {
-                    "product_id": i.product_id,
-                    "quantity": i.quantity,
-                    "price": i.price,
-                }
-                for i in items
-            ],
-            "total": total,
-            "expires_at": cart.expires_at,
+            "cart_id": view["cart_id"],
+            "user_id": view["user_id"],
+            "status": view["status"],
+            "items": items,
+            "total_minor": total_minor,
+            "currency": items[0]["currency"] if items else DEFAULT_CURRENCY,
+            "expires_at": view["expires_at"],
         }
 
+    def _publish(self, event: Dict[str, Any]) -> None:
+        #zdarzenie dopiero po commicie, subskrybent nigdy nie zobaczy wersji ktorej nie ma w bazie
+        if self.events is not None:
+            self.events.publish(event)
+
     #commands
     def create_cart(self, user_id: int) -> Dict[str, Any]:
         #check czy user ma aktywny koszyk
         existing = self.repo.get_active_cart_by_user(user_id)
 
         if existing:
-            items = self.repo.get_cart_items(existing.id)
-            total = sum((i.price * i.quantity for i in items), Decimal("0.00"))
-
-            logger.info(f"Uzytkownik o ID {user_id} ma juz aktywny koszyk {existing.id}")
+            logger.info("Uzytkownik o ID %s ma juz aktywny koszyk %s", user_id, existing.id)
             #return dicta z danymi koszyka
-            return {
-                "cart_id": existing.id,
-                "user_id": existing.user_id,
-                "status": existing.status,
-                "items": [
-                    {
-                        "product_id": i.product_id,
-                        "quantity": i.quantity,
-                        "price": i.price,
-                    }
-                    for i in items
-                ],
-                "total": total,
-                "expires_at": existing.expires_at,
-            }
+            return self._to_response(self.repo.get_cart_view(existing.id))
 
         #tworzymy nowy koszyk
         expires = datetime.now(timezone.utc) + timedelta(seconds=CART_TTL_SECONDS)
@@ -99,15 +122,17 @@ class CartService:
         )
 
         created = self.repo.create_cart(new_cart)
+        self.stats.cart_created()
 
-        logger.info(f"Utworzono nowy koszyk {created.id} dla użytkownika {user_id}")
+        logger.info("Utworzono nowy koszyk %s dla użytkownika %s", created.id, user_id)
 
         return {
             "cart_id": created.id,
             "user_id": created.user_id,
             "status": created.status,
             "items": [],
-            "total": Decimal("0.00"),
+            "total_minor": 0,
+            "currency": DEFAULT_CURRENCY,
             "expires_at": created.expires_at,
         }
 
@@ -139,12 +164,13 @@ class CartService:
         # Redis lock dla produktu
         # HTTP do product-service (walidacja + cena)
         """
-        logger.info(f"Pobieranie danych produktu {product_id} z product-service")
+        logger.info("Pobieranie danych produktu %s z product-service", product_id)
         pdata = self.product_client.fetch_product(product_id)
-        price = Decimal(str(pdata["price"]))
+        currency = pdata.get("currency", DEFAULT_CURRENCY)
+        price_minor = to_minor(pdata["price"], currency)
 
         # Redis lock (blokada produktu zeby nikt inny ich nie kupil)
-        logger.info(f"Proba zablokowania produktu {product_id} dla koszyka {cart_id}")
+        logger.info("Proba zablokowania produktu %s dla koszyka %s", product_id, cart_id)
 
         locked = self.lock_service.acquire_product_lock(
             product_id=product_id,
@@ -156,66 +182,46 @@ class CartService:
             raise RuntimeError("Produkt jest już zarezerwowany przez inny koszyk")
 
         try:
-            # Sprawdz czy produkt juz jest w koszyku
-            existing_item = self.repo.get_cart_item(cart_id, product_id)
-
-            if existing_item:
-                logger.info(
-                    f"Produkt {product_id} już jest w koszyku, zwiekszam ilosc "
-                    f"z {existing_item.quantity} do {existing_item.quantity + quantity}"
-                )
-                existing_item.quantity += quantity
-                existing_item.price = price  # update ceny
-                self.repo.add_cart_item(existing_item)
-            else:
-                logger.info(f"Dodaje nowy produkt {product_id} do koszyka {cart_id}")
-                self.repo.add_cart_item(
-                    CartItemModel(
-                        cart_id=cart_id,
-                        product_id=product_id,
-                        quantity=quantity,
-                        price=price,
-                    )
-                )
-
             # Przedluz waznosc koszyka
             # user JEST aktywny, dodaje produkty do koszyka i nie chcemy wygasic koszyka podczas zakupow
             # kazda akcja TTL + 15 min
-            new_expires = datetime.now(timezone.utc) + timedelta(seconds=CART_TTL_SECONDS
-            )
-
-            # Optimistic locking
-            rowcount = self.repo.update_cart_version(
-                cart_id=cart.id,
-                old_version=cart.version,
-                new_data={
-                    "version": cart.version + 1,
-                    "expires_at": new_expires,
-                },
+            new_expires = datetime.now(timezone.utc) + timedelta(seconds=CART_TTL_SECONDS)
+
+            # Zmiana przemienna, bez read-modify-write i bez porownania wersji:
+            # version = version + 1 RETURNING oraz INSERT ... ON CONFLICT DO UPDATE quantity = quantity + q
+            # dwie karty dodajace rozne produkty do jednego koszyka kolejkuja sie na blokadzie wiersza
+            new_version = self.repo.add_item_atomic(
+                cart_id=cart_id,
+                product_id=product_id,
+                quantity=quantity,
+                price_minor=price_minor,
+                expires_at=new_expires,
+                currency=currency,
             )
 
-            # Optimistic locking warunek na wersje
-            # np w bazie update set version 2 where id 1 and version 1
-            if rowcount == 0:
+            if new_version is None:
+                # koszyk zmienil status w miedzyczasie (finalize/expire)
                 self.repo.rollback()
-                self.lock_service.release_product_lock(product_id, cart_id)
-                raise RuntimeError(
-                    "Konflikt wspolbieznosci - koszyk zostal zmodyfikowany przez inna operacje"
-                )
+                raise ValueError("Koszyk nie może byc modyfikowany")
 
             self.repo.commit()
+            self.stats.item_added(product_id, quantity, new_reservation=locked == LOCK_ACQUIRED)
+            self._publish(cart_event(cart_id, new_version, "item_added", "ACTIVE", new_expires))
 
             logger.info(
-                f"Produkt {product_id} dodany do koszyka {cart_id}, "
-                f"nowa wersja: {cart.version + 1}"
+                "Produkt %s dodany do koszyka %s, nowa wersja: %s",
+                product_id, cart_id, new_version,
             )
 
             return self.get_cart(cart_id, user_id)
 
         except Exception as e:
-            # W przypadku bledu zwolnij lock
-            logger.error(f"Blad podczas dodawania produktu: {e}")
-            self.lock_service.release_product_lock(product_id, cart_id)
+            # W przypadku bledu zwolnij lock (tylko jesli to my go wlasnie zalozylismy,
+            # przedluzony lock nalezy do produktu ktory juz jest w koszyku)
+            logger.error("Blad podczas dodawania produktu: %s", e)
+            self.repo.rollback()
+            if locked == LOCK_ACQUIRED:
+                self.lock_service.release_product_lock(product_id, cart_id)
             raise
 
     def remove_product(
@@ -233,34 +239,34 @@ class CartService:
         if cart.user_id != user_id:
             raise PermissionError("Brak dostępu do koszyka")
 
-        logger.info(f"Usuwanie produktu {product_id} z koszyka {cart_id}")
+        logger.info("Usuwanie produktu %s z koszyka %s", product_id, cart_id)
 
-        #usun item i zwolnij locka
-        self.repo.delete_cart_item(cart_id, product_id)
-        self.lock_service.release_product_lock(product_id, cart_id)
+        #usun item i podbij wersje atomowo (bez porownania wersji, nie ma konfliktu)
+        new_version, removed = self.repo.remove_item_atomic(cart_id, product_id)
 
-        rowcount = self.repo.update_cart_version(
-            cart_id=cart.id,
-            old_version=cart.version,
-            new_data={"version": cart.version + 1},
-        )
-
-        if rowcount == 0: #jesli tj 0 rows affected
+        if new_version is None:
             self.repo.rollback()
-            raise RuntimeError(
-                "Konflikt współbieżności - koszyk został zmodyfikowany przez inną operację"
-            )
+            raise ValueError("Koszyk nie może byc modyfikowany")
 
         self.repo.commit()
 
+        #zwolnij locka dopiero po commicie
+        self.lock_service.release_product_lock(product_id, cart_id)
+        if removed:
+            self.stats.reservations_released([(product_id, removed)])
+        self._publish(cart_event(cart_id, new_version, "item_removed", "ACTIVE"))
+
         logger.info(
-            f"Produkt {product_id} usunięty z koszyka {cart_id}, "
-            f"nowa wersja: {cart.version + 1}"
+            "Produkt %s usunięty z koszyka %s, nowa wersja: %s",
+            product_id, cart_id, new_version,
         )
 
         return self.get_cart(cart_id, user_id)
 
+    @conflict_retry()
     def finalize_cart(self, user_id: int, cart_id: int) -> Dict[str, Any]:
+        #finalize nadal porownuje wersje (nie moze zamrozic koszyka zmienianego w trakcie),
+        #przy konflikcie cala operacja jest ponawiana od odczytu koszyka (conflict_retry)
 
         cart = self.repo.get_cart(cart_id)
 
@@ -278,7 +284,10 @@ class CartService:
         if not items:
             raise ValueError("Nie można finalizować pustego koszyka")
 
-        logger.info(f"Finalizowanie koszyka {cart_id}")
+        logger.info("Finalizowanie koszyka %s", cart_id)
+
+        #aktualne ceny wszystkich pozycji rownolegle, czas ~ jedno zapytanie do product-service
+        price_changes = self._check_prices(items)
 
         # Optimistic locking
         rowcount = self.repo.update_cart_version(
@@ -292,14 +301,49 @@ class CartService:
 
         if rowcount == 0:
             self.repo.rollback()
-            raise RuntimeError(
+            raise ConcurrencyConflict(
                 "Konflikt wspolbieznosci - koszyk zostal zmodyfikowany przez inna operacje"
             )
 
+        #nowe ceny w tej samej transakcji co zmiana wersji, po udanym porownaniu wersji
+        self.repo.update_item_prices(cart_id, price_changes)
         self.repo.commit()
+        self.stats.cart_status_changed("ACTIVE", "FINALIZED")
+        self._publish(cart_event(cart_id, cart.version + 1, "finalized", "FINALIZED"))
 
         logger.info(
-            f"Koszyk {cart.id} sfinalizowany nowa wersja: {cart.version + 1}"
+            "Koszyk %s sfinalizowany nowa wersja: %s, zmienione ceny: %s",
+            cart.id, cart.version + 1, len(price_changes),
         )
 
-        return self.get_cart(cart_id, user_id)
+        response = self.get_cart(cart_id, user_id)
+        response["price_changes"] = price_changes
+        return response
+
+    def _check_prices(self, items) -> list[Dict[str, Any]]:
+        """
+        Ceny pozycji z product-service (fetch_products: ograniczona liczba watkow, wspolny deadline).
+        Brak odpowiedzi przed deadlinem -> ProductServiceUnavailable, finalize nie przechodzi
+        na starych cenach. Zwraca tylko pozycje z inna cena lub waluta.
+        Po zmianie cen koszyk nadal musi byc w jednej walucie, inaczej CurrencyMismatch.
+        """
+        products = self.product_client.fetch_products([i.product_id for i in items])
+        changes = []
+        currencies = set()
+        for item in items:
+            pdata = products[item.product_id]
+            currency = pdata.get("currency", DEFAULT_CURRENCY)
+            currencies.add(currency)
+            price_minor = to_minor(pdata["price"], currency)
+            if price_minor != item.price_minor or currency != item.currency:
+                changes.append({
+                    "product_id": item.product_id,
+                    "old_price_minor": item.price_minor,
+                    "new_price_minor": price_minor,
+                    "currency": currency,
+                })
+        if len(currencies) > 1:
+            raise CurrencyMismatch(
+                f"Produkty w koszyku maja rozne waluty: {', '.join(sorted(currencies))}"
+            )
+        return changes
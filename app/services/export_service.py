@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from app.data.database import SessionLocal
+from app.data.models.cart_item import CartItemModel
+from app.data.models.order import OrderModel
+from app.utils.logging import get_logger
+from app.utils.settings import EXPORT_CHUNK_ROWS
+
+logger = get_logger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+#kwoty jako int w groszach (dokladnie tak jak w bazie) + waluta
+ORDER_COLUMNS = ["id", "cart_id", "user_id", "status", "total_minor", "currency", "created_at"]
+ITEM_COLUMNS = ["product_id", "quantity", "price_minor", "item_currency"]
+#kolumny eksportu o innej nazwie niz w modelu (currency jest juz w ORDER_COLUMNS)
+_ITEM_SOURCES = {"item_currency": "currency"}
+
+
+def _cell(value):
+    #datetime -> iso, reszta jako str
+    if value is None or isinstance(value, (int, str)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class ExportService:
+    """
+    Strumieniowy eksport zamowien (opcjonalnie z pozycjami koszyka) do NDJSON/CSV.
+    Server-side cursor (yield_per/stream_results) i wiersze Core zamiast obiektow ORM,
+    pamiec stala niezaleznie od liczby wierszy. Wlasna sesja na czas calego strumienia.
+    """
+
+    def __init__(self, session_factory: sessionmaker = SessionLocal, chunk_rows: int = EXPORT_CHUNK_ROWS):
+        self.session_factory = session_factory
+        self.chunk_rows = chunk_rows
+
+    @staticmethod
+    def columns(include_items: bool) -> list[str]:
+        return ORDER_COLUMNS + ITEM_COLUMNS if include_items else list(ORDER_COLUMNS)
+
+    def _statement(
+        self,
+        created_from: datetime | None,
+        created_to: datetime | None,
+        status: str | None,
+        include_items: bool,
+    ):
+        cols = [getattr(OrderModel, c) for c in ORDER_COLUMNS]
+        if include_items:
+            cols += [getattr(CartItemModel, _ITEM_SOURCES.get(c, c)).label(c) for c in ITEM_COLUMNS]
+        stmt = select(*cols)
+        if include_items:
+            stmt = stmt.join(CartItemModel, CartItemModel.cart_id == OrderModel.cart_id)
+        if created_from is not None:
+            stmt = stmt.where(OrderModel.created_at >= created_from)
+        if created_to is not None:
+            stmt = stmt.where(OrderModel.created_at < created_to)
+        if status is not None:
+            stmt = stmt.where(OrderModel.status == status)
+        return stmt.order_by(OrderModel.id)
+
+    def iter_chunks(
+        self,
+        created_from: datetime | None = None,
+        created_to: datetime | None = None,
+        status: str | None = None,
+        include_items: bool = False,
+    ) -> Iterator[list[tuple]]:
+        stmt = self._statement(created_from, created_to, status, include_items)
+        db = self.session_factory()
+        try:
+            result = db.execute(
+                stmt.execution_options(stream_results=True, yield_per=self.chunk_rows)
+            )
+            for chunk in result.partitions():
+                yield chunk
+        finally:
+            db.close()
+
+    def stream(self, fmt: str, include_items: bool = False, **filters) -> Iterator[bytes]:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Nieznany format eksportu: {fmt}")
+
+        columns = self.columns(include_items)
+        rows = 0
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(columns)
+            for chunk in self.iter_chunks(include_items=include_items, **filters):
+                writer.writerows([_cell(v) for v in row] for row in chunk)
+                rows += len(chunk)
+                yield buf.getvalue().encode()
+                buf.seek(0)
+                buf.truncate()
+            if buf.tell():
+                yield buf.getvalue().encode()
+        else:
+            dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+            for chunk in self.iter_chunks(include_items=include_items, **filters):
+                lines = [dumps(dict(zip(columns, map(_cell, row)))) for row in chunk]
+                lines.append("")
+                rows += len(chunk)
+                yield "\n".join(lines).encode()
+
+        logger.info("Export %s finished: %s rows", fmt, rows)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Tuple
+
+from app.utils.logging import get_logger
+from app.utils.redis_client import redis_client
+from app.utils.settings import (
+    IDEMPOTENCY_LOCK_SECONDS,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+)
+
+logger = get_logger(__name__)
+
+#usun rekord tylko jesli to nadal nasz "pending" (porownanie tokenu), atomowo w lua
+_RELEASE_PENDING_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return 0
+end
+local rec = cjson.decode(raw)
+if rec['state'] == 'pending' and rec['token'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+#przedluz claim "pending" jesli nadal nasz; ARGV: token, ttl
+_RENEW_PENDING_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return 0
+end
+local rec = cjson.decode(raw)
+if rec['state'] == 'pending' and rec['token'] == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+#zapisz wynik tylko jesli klucz jest nadal naszym "pending" (albo zniknal i nikt go nie przejal),
+#nigdy nie nadpisuje claimu/wyniku innego zadania; ARGV: token, rekord, ttl
+_COMPLETE_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if raw then
+    local rec = cjson.decode(raw)
+    if rec['state'] ~= 'pending' or rec['token'] ~= ARGV[1] then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class IdempotencyConflict(RuntimeError):
+    #ten sam klucz jest wciaz przetwarzany przez inne zadanie
+    pass
+
+
+class IdempotencyKeyReused(ValueError):
+    #ten sam klucz uzyty z innym payloadem
+    pass
+
+
+def fingerprint(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyService:
+    """
+    Idempotency-Key dla mutacji (POST /carts/{id}/items, POST /orders/ ...)
+    -pierwsza odpowiedz zapisywana w redisie z TTL
+    -rownolegle duplikaty czekaja na wynik zamiast wykonywac operacje drugi raz
+    -powtorki serwowane z redisa, bez dotykania postgresa
+    -claim "pending" przedluzany co lock_ttl/3 dopoki fn() dziala (jeden watek na proces),
+     wiec dlugie zadanie nie traci klucza na rzecz ponowionego requestu
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        ttl: int = IDEMPOTENCY_TTL_SECONDS,
+        lock_ttl: int = IDEMPOTENCY_LOCK_SECONDS,
+        wait_timeout: float = IDEMPOTENCY_WAIT_SECONDS,
+    ):
+        self.redis = redis_client(url)
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self._release = self.redis.register_script(_RELEASE_PENDING_LUA)
+        self._renew = self.redis.register_script(_RENEW_PENDING_LUA)
+        self._complete = self.redis.register_script(_COMPLETE_LUA)
+        self._in_flight: dict[str, str] = {}
+        self._in_flight_lock = threading.Lock()
+        self._renewer: threading.Thread | None = None
+
+    @staticmethod
+    def _key(scope: str, key: str) -> str:
+        return f"idem:{scope}:{key}"
+
+    def _claim(self, rkey: str, fp: str, token: str) -> bool:
+        record = json.dumps({"state": "pending", "fp": fp, "token": token})
+        return bool(self.redis.set(rkey, record, nx=True, ex=self.lock_ttl))
+
+    def _hold(self, rkey: str, token: str) -> None:
+        with self._in_flight_lock:
+            self._in_flight[rkey] = token
+            #po forku (celery prefork) watek rodzica nie istnieje, startujemy wlasny
+            if self._renewer is None or not self._renewer.is_alive():
+                self._renewer = threading.Thread(target=self._renew_loop, name="idempotency-renewer", daemon=True)
+                self._renewer.start()
+
+    def _unhold(self, rkey: str) -> None:
+        with self._in_flight_lock:
+            self._in_flight.pop(rkey, None)
+
+    def _renew_loop(self) -> None:
+        interval = max(self.lock_ttl / 3, 0.1)
+        while True:
+            time.sleep(interval)
+            with self._in_flight_lock:
+                held = list(self._in_flight.items())
+            for rkey, token in held:
+                try:
+                    self._renew(keys=[rkey], args=[token, self.lock_ttl])
+                except Exception as e:
+                    logger.warning("Idempotency claim renew failed %s: %s", rkey, e)
+
+    def _wait_for_result(self, rkey: str, fp: str, token: str) -> Tuple[Any, bool] | None:
+        """
+        Czeka na wynik zadania ktore trzyma klucz.
+        Zwraca (body, True) gdy wynik jest gotowy albo None gdy klucz zniknal
+        (wlasciciel sie wywalil) i udalo sie go przejac.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.02
+        while True:
+            raw = self.redis.get(rkey)
+            if raw is None:
+                if self._claim(rkey, fp, token):
+                    return None
+                continue
+
+            rec = json.loads(raw)
+            if rec["fp"] != fp:
+                raise IdempotencyKeyReused("Idempotency-Key uzyty z innymi danymi zadania")
+            if rec["state"] == "done":
+                return rec["body"], True
+
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict("Zadanie z tym Idempotency-Key jest nadal przetwarzane")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    def run(
+        self,
+        scope: str,
+        key: str,
+        payload: Any,
+        fn: Callable[[], Any],
+        encode: Callable[[Any], Any],
+    ) -> Tuple[Any, bool]:
+        """
+        Wykonuje fn() co najwyzej raz dla (scope, key).
+        encode zamienia wynik fn() na cos co da sie zapisac jako json.
+        Zwraca (wynik, replayed).
+        """
+        rkey = self._key(scope, key)
+        fp = fingerprint(payload)
+        token = uuid.uuid4().hex
+
+        if not self._claim(rkey, fp, token):
+            replay = self._wait_for_result(rkey, fp, token)
+            if replay is not None:
+                logger.info("Idempotent replay %s", rkey)
+                return replay
+
+        self._hold(rkey, token)
+        try:
+            result = fn()
+        except Exception:
+            #blad nie jest zapamietywany, klient moze ponowic z tym samym kluczem
+            self._release(keys=[rkey], args=[token])
+            raise
+        finally:
+            self._unhold(rkey)
+
+        record = json.dumps({"state": "done", "fp": fp, "body": encode(result)})
+        if not self._complete(keys=[rkey], args=[token, record, self.ttl]):
+            logger.warning("Idempotency claim %s lost before completion, result not stored", rkey)
+        return result, False
@@ -1,8 +1,15 @@
-import redis
 from redis.exceptions import RedisError
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from app.utils.settings import REDIS_URL
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+from app.utils.concurrency import QueueBudgetExceeded
 from app.utils.logging import get_logger
+from app.utils.redis_client import redis_client
 
 logger = get_logger(__name__)
 
@@ -15,6 +22,31 @@ else
 end
 """
 
+#LUA zajmij albo przedluz wlasny lock (reentrant)
+#1 - nowy lock, 2 - lock juz nalezal do tego koszyka (przedluzony TTL), 0 - zajety przez inny koszyk
+_ACQUIRE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 2
+end
+return 0
+"""
+
+#LUA przedluz lease tylko jesli nadal nasz (porownanie tokenu)
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+else
+    return 0
+end
+"""
+
+LOCK_ACQUIRED = 1
+LOCK_REENTERED = 2
+
 #redis wykonuje atomowo przez lua,s krypt dziala jako jedna nieprzerywalna operacja
 #lua jest single threaded wiec tlko jedna operacja na raz
 #nie mozna wcisnac sie miedzy GET a DEL, wiec tu jest get + porownanie + del wszystko naraz
@@ -25,7 +57,8 @@ def redis_retry():
         reraise=True,
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=0.2, min=0.2, max=2),
-        retry=retry_if_exception_type(RedisError),
+        #wyczerpana pula (RedisPoolExhausted) to przeciazenie, od razu 503 zamiast ponawiania
+        retry=retry_if_exception_type(RedisError) & retry_if_not_exception_type(QueueBudgetExceeded),
     )
 
 class LockService:
@@ -36,26 +69,78 @@ class LockService:
     """
 
     def __init__(self, url: str | None = None):
-        self.redis = redis.Redis.from_url(
-            url or REDIS_URL,
-            decode_responses=True,
-        )
+        self.redis = redis_client(url)
+        self._release = self.redis.register_script(_RELEASE_LUA)
+        self._renew = self.redis.register_script(_RENEW_LUA)
 
     @redis_retry()
-    def acquire_product_lock(self, product_id: int, cart_id: int, ttl: int) -> bool:
+    def acquire_product_lock(self, product_id: int, cart_id: int, ttl: int) -> int:
+        """
+        Zwraca LOCK_ACQUIRED, LOCK_REENTERED albo 0 (produkt zarezerwowany przez inny koszyk).
+        Ponowne dodanie tego samego produktu do tego samego koszyka przedluza lock zamiast failowac.
+        """
         key = f"product:{product_id}:lock"
-        logger.info(f"Acquire lock {key} for cart {cart_id}")
-        #SET product:1:lock "123" NX EX 900
-        return self.redis.set(
-            name=key, #kllucz
-            value=str(cart_id),
-            nx=True, #not eXists, jesli nie istnieje to True, jak jest to nic nie rob i False
-            ex=ttl, #Expire (wygasa po uplywie ttl), nie trzeba recznie czyscic (!!!)
-        )
+        logger.info("Acquire lock %s for cart %s", key, cart_id)
+        #SET product:1:lock "123" NX EX 900, a jak juz jest nasz to EXPIRE
+        return int(self.redis.eval(_ACQUIRE_LUA, 1, key, str(cart_id), ttl))
 
     @redis_retry()
     def release_product_lock(self, product_id: int, cart_id: int) -> bool:
         key = f"product:{product_id}:lock"
-        logger.info(f"Release lock {key} for cart {cart_id}")
+        logger.info("Release lock %s for cart %s", key, cart_id)
         res = self.redis.eval(_RELEASE_LUA, 1, key, str(cart_id))
         return bool(res)
+
+    @redis_retry()
+    def release_product_locks(self, locks: list[tuple[int, int]]) -> int:
+        #wiele par (product_id, cart_id) naraz, jeden pipeline = jeden round trip
+        if not locks:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        for product_id, cart_id in locks:
+            self._release(keys=[f"product:{product_id}:lock"], args=[str(cart_id)], client=pipe)
+        released = sum(int(r) for r in pipe.execute())
+        logger.info("Released %s/%s product locks", released, len(locks))
+        return released
+
+    @redis_retry()
+    def product_availability(self, product_ids: list[int]) -> list[dict]:
+        """
+        Stan rezerwacji wielu produktow naraz: GET + PTTL per klucz w jednym pipeline,
+        jeden round trip niezaleznie od liczby produktow. Bez zakladania lockow,
+        koszyk trzymajacy rezerwacje nie jest ujawniany.
+        """
+        if not product_ids:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for product_id in product_ids:
+            key = f"product:{product_id}:lock"
+            pipe.get(key)
+            pipe.pttl(key)
+        results = pipe.execute()
+
+        availability = []
+        for i, product_id in enumerate(product_ids):
+            holder, pttl = results[2 * i], results[2 * i + 1]
+            reserved = holder is not None
+            availability.append({
+                "product_id": product_id,
+                "reserved": reserved,
+                #PTTL: -2 klucz zniknal miedzy GET a PTTL, -1 bez TTL
+                "ttl_ms": pttl if reserved and pttl >= 0 else None,
+            })
+        return availability
+
+    #lease: wzajemne wykluczanie zadan w tle (np. expiry), token pozwala zwolnic tylko wlasny lease
+    @redis_retry()
+    def acquire_lease(self, name: str, token: str, ttl: int) -> bool:
+        return bool(self.redis.set(f"lease:{name}", token, nx=True, ex=ttl))
+
+    @redis_retry()
+    def renew_lease(self, name: str, token: str, ttl: int) -> bool:
+        #False gdy lease wygasl albo nalezy juz do innego przebiegu
+        return bool(self._renew(keys=[f"lease:{name}"], args=[token, ttl]))
+
+    @redis_retry()
+    def release_lease(self, name: str, token: str) -> bool:
+        return bool(self._release(keys=[f"lease:{name}"], args=[token]))
@@ -10,8 +10,25 @@ class NotificationService:
         #wyslij powiadomienie o rozpoczeciu realizacji zamowienia
         send_order_notification_task.delay(user_id, order_id)
 
+    @staticmethod
+    def send_order_status_notifications(orders: list[dict], status: str):
+        #jeden task na caly batch zamiast taska per zamowienie
+        if orders:
+            send_order_status_notifications_task.delay(
+                [{"user_id": o["user_id"], "order_id": o["id"]} for o in orders],
+                status,
+            )
+
 @celery_app.task(name="app.services.notification_service.send_order_notification_task")
 def send_order_notification_task(user_id: int, order_id: int):
     #celery task, worker w tle
-    logger.info(f"[NOTIFICATION] User {user_id}: Order {order_id} is being processed")
-    return {"user_id": user_id, "order_id": order_id, "status": "sent"}
\ No newline at end of file
+    logger.info("[NOTIFICATION] User %s: Order %s is being processed", user_id, order_id)
+    return {"user_id": user_id, "order_id": order_id, "status": "sent"}
+
+
+@celery_app.task(name="app.services.notification_service.send_order_status_notifications_task")
+def send_order_status_notifications_task(orders: list[dict], status: str):
+    #batch powiadomien o zmianie statusu (fulfillment)
+    for o in orders:
+        logger.info("[NOTIFICATION] User %s: Order %s is now %s", o["user_id"], o["order_id"], status)
+    return {"count": len(orders), "status": status}
@@ -1,12 +1,13 @@
 # app/services/order_service.py
-from decimal import Decimal
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from app.data.models.order import OrderModel
+
 from app.data.models.cart import CartModel
-from app.data.models.cart_item import CartItemModel
+from app.domain.money import CurrencyMismatch
+from app.domain.order_state import PENDING, validate_transition
 from app.repos.order_repo import OrderRepo
+from app.services.cart_events import CartEventPublisher, cart_event
 from app.services.notification_service import NotificationService
+from app.services.stats_service import StatsService
 from app.utils.logging import get_logger
 
 logger = get_logger(__name__)
@@ -17,82 +18,105 @@ class OrderService:
     Separacja od CartService zgodnie z wymaganiami.
     """
 
-    def __init__(self, db: Session):
+    def __init__(
+        self,
+        db: Session,
+        stats_service: StatsService | None = None,
+        event_publisher: CartEventPublisher | None = None,
+    ):
         self.db = db
         self.repo = OrderRepo(db)
         self.notification_service = NotificationService()
+        self.stats = stats_service or StatsService()
+        self.events = event_publisher
 
     def create_order_from_cart(self, cart_id: int, user_id: int):
         """
         Use Case: Tworzenie zamowienia z koszyka
-        1 Weryfikuje czy koszyk jest sfinalizowany
-        2 Oblicza total
-        3 Tworzy zamowienie
-        4 Wysyla powiadomienie (async)
+        1 Jeden statement: koszyk FINALIZED -> ORDERED, INSERT zamowienia z SUM(price_minor * quantity)
+          liczonym w bazie, ON CONFLICT na unikalnym orders.cart_id
+        2 Duplikat (rownolegly albo powtorzony request) dostaje istniejace zamowienie,
+          bez drugiego powiadomienia i bez zmian licznikow
+        3 Wysyla powiadomienie (async)
         """
-        # Pobierz koszyk
-        cart = self.db.execute(
-            select(CartModel).where(CartModel.id == cart_id)
-        ).scalar_one_or_none()
+        created = self.repo.create_order_from_cart(cart_id, user_id, status=PENDING)
 
-        if not cart:
-            raise ValueError("Koszyk nie istnieje")
+        if created is None:
+            #nic nie utworzono, UPDATE koszyka (jesli byl) wycofany razem z transakcja
+            self.repo.rollback()
+            return self._existing_order_or_raise(cart_id, user_id)
 
-        if cart.user_id != user_id:
-            raise PermissionError("Brak dostepu do koszyka")
+        cart_version = created.pop("cart_version")
+        items = self.repo.get_cart_quantities(cart_id)
+        self.repo.commit()
 
-        if cart.status != "FINALIZED":
-            raise ValueError("Koszyk musi być sfinalizowany przed utworzeniem zamowienia")
+        logger.info("Order %s created from cart %s", created["id"], cart_id)
+
+        #rezerwacje z koszyka zamieniaja sie w zamowienie
+        self.stats.order_created()
+        self.stats.cart_status_changed("FINALIZED", "ORDERED")
+        self.stats.reservations_released(items)
+        if self.events is not None:
+            self.events.publish(cart_event(cart_id, cart_version, "ordered", "ORDERED"))
+
+        #Wyslij powiadomienie asynchronicznie
+        self.notification_service.send_order_notification(user_id, created["id"])
 
-        # Oblicz total
-        items = self.db.execute(
-            select(CartItemModel).where(CartItemModel.cart_id == cart_id)
-        ).scalars().all()
+        return created
 
-        total = sum((i.price * i.quantity for i in items), Decimal("0.00"))
+    def _existing_order_or_raise(self, cart_id: int, user_id: int):
+        #sciezka bledu/duplikatu, tylko odczyty
+        existing = self.repo.get_order_by_cart(cart_id)
+        if existing:
+            if existing["user_id"] != user_id:
+                raise PermissionError("Brak dostepu do koszyka")
+            logger.info("Order %s already exists for cart %s", existing["id"], cart_id)
+            return existing
 
-        if total == Decimal("0.00"):
-            raise ValueError("Koszyk jest pusty")
+        cart = self.db.get(CartModel, cart_id)
 
-        # Utworz zamowienie
-        order = OrderModel(
-            cart_id=cart_id,
-            user_id=user_id,
-            status="PROCESSING",
-            total=total,
-        )
+        if not cart:
+            raise ValueError("Koszyk nie istnieje")
 
-        created_order = self.repo.create_order(order)
+        if cart.user_id != user_id:
+            raise PermissionError("Brak dostepu do koszyka")
 
-        logger.info(f"Order {created_order.id} created from cart {cart_id}")
+        if cart.status != "FINALIZED":
+            raise ValueError("Koszyk musi być sfinalizowany przed utworzeniem zamowienia")
 
-        #Wyslij powiadomienie asynchronicznie
-        self.notification_service.send_order_notification(user_id, created_order.id)
+        currencies = self.repo.get_cart_currencies(cart_id)
+        if len(currencies) > 1:
+            raise CurrencyMismatch(f"Koszyk zawiera pozycje w roznych walutach: {', '.join(sorted(currencies))}")
 
-        return {
-            "id": created_order.id,
-            "cart_id": created_order.cart_id,
-            "user_id": created_order.user_id,
-            "status": created_order.status,
-            "total": created_order.total,
-            "created_at": created_order.created_at,
-        }
+        raise ValueError("Koszyk jest pusty")
 
     def get_order(self, order_id: int, user_id: int):
-        #pobieranie zamowienia (query)
-        order = self.repo.get_order(order_id)
+        #pobieranie zamowienia (query), lean read path na Core
+        order = self.repo.get_order_view(order_id)
 
         if not order:
             raise ValueError("Zamowienie nie istnieje")
 
-        if order.user_id != user_id:
+        if order["user_id"] != user_id:
             raise PermissionError("Brak dostepu do zamowienia")
 
-        return {
-            "id": order.id,
-            "cart_id": order.cart_id,
-            "user_id": order.user_id,
-            "status": order.status,
-            "total": order.total,
-            "created_at": order.created_at,
-        }
\ No newline at end of file
+        return order
+
+    #fulfillment, zmiany statusu (command)
+    def transition_orders(self, order_ids: list[int], from_status: str, to_status: str) -> list[dict]:
+        """
+        Masowa zmiana statusu wybranych zamowien jednym UPDATE,
+        zamowienia w innym statusie niz from_status sa pomijane.
+        """
+        validate_transition(from_status, to_status)
+        updated = self.repo.bulk_transition(from_status, to_status, order_ids=order_ids)
+        self.notification_service.send_order_status_notifications(updated, to_status)
+        logger.info("Orders %s -> %s: %s/%s updated", from_status, to_status, len(updated), len(order_ids))
+        return updated
+
+    def advance_batch(self, from_status: str, to_status: str, batch_size: int) -> list[dict]:
+        #kolejny batch zamowien from_status -> to_status (najstarsze pierwsze)
+        validate_transition(from_status, to_status)
+        updated = self.repo.bulk_transition(from_status, to_status, limit=batch_size)
+        self.notification_service.send_order_status_notifications(updated, to_status)
+        return updated
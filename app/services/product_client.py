@@ -1,14 +1,61 @@
 # app/services/product_client.py
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import requests
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from requests import RequestException
+from requests import HTTPError, RequestException
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
-from app.utils.settings import PRODUCT_SERVICE_URL
+from app.utils.concurrency import budget
 from app.utils.logging import get_logger
+from app.utils.resources import per_process
+from app.utils.settings import (
+    PRICE_CHECK_DEADLINE_SECONDS,
+    PRICE_CHECK_PER_REQUEST,
+    PRODUCT_BATCH_LOOKUP,
+    PRODUCT_BATCH_SIZE,
+    PRODUCT_SERVICE_URL,
+)
+from app.utils.tracing import inject, tracer
 
 logger = get_logger(__name__)
 
 
+class ProductServiceUnavailable(RuntimeError):
+    #product-service nie odpowiedzial przed deadlinem albo blad sieci/5xx (fetch_products) -> 503
+    pass
+
+
+class ProductNotAvailable(ValueError):
+    #4xx z product-service (np. produkt usuniety), blad klienta -> 400
+    pass
+
+
+def _make_session() -> requests.Session:
+    #keep-alive do product-service, pula polaczen = pula watkow price check
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=budget.price_check_threads)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _make_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=budget.price_check_threads, thread_name_prefix="product-client")
+
+
+get_http_session = per_process(_make_session)
+#jedna pula na proces zamiast puli per finalize (40 watkow api x N watkow = za duzo watkow)
+get_price_check_executor = per_process(_make_executor)
+
+
 def http_retry():
     return retry(
         reraise=True,
@@ -18,15 +65,134 @@ def http_retry():
     )
 
 class ProductClient:
+    #czy product-service ma GET /products?ids= (wykrywane przy pierwszym 404/405, per proces)
+    _batch_supported = PRODUCT_BATCH_LOOKUP
+
     def __init__(self, base_url: str | None = None, timeout: int = 2):
         self.base_url = (base_url or PRODUCT_SERVICE_URL).rstrip("/")
         self.timeout = timeout
 
     @http_retry()
     def fetch_product(self, product_id: int) -> dict:
-        url = f"{self.base_url}/products/{product_id}"
-        logger.info(f"ProductClient GET {url}")
+        return self._get(product_id, self.timeout)
 
-        resp = requests.get(url, timeout=self.timeout)
+    def _request(self, url: str, timeout: float, params: dict | None = None) -> requests.Response:
+        logger.info("ProductClient GET %s", url)
+
+        #span na kazda probe (retry tenacity jest na zewnatrz), traceparent do product-service
+        with tracer.span("http.GET product-service", attributes={"http.url": url}) as span:
+            resp = get_http_session().get(url, params=params, timeout=timeout, headers=inject({}))
+            if span is not None:
+                span.set_attribute("http.status_code", resp.status_code)
+            return resp
+
+    def _get(self, product_id: int, timeout: float) -> dict:
+        resp = self._request(f"{self.base_url}/products/{product_id}", timeout)
         resp.raise_for_status()
         return resp.json()
+
+    def _get_many(self, product_ids: list[int], timeout: float) -> dict[int, dict] | None:
+        #GET /products?ids=1,2,3 -> {"products": [...]}, brakujacych produktow nie ma w odpowiedzi
+        #None gdy product-service nie ma endpointu batch
+        resp = self._request(
+            f"{self.base_url}/products", timeout, params={"ids": ",".join(map(str, product_ids))}
+        )
+        if resp.status_code in (404, 405):
+            return None
+        resp.raise_for_status()
+        return {p["id"]: p for p in resp.json()["products"]}
+
+    def fetch_products(
+        self,
+        product_ids: list[int],
+        deadline: float = PRICE_CHECK_DEADLINE_SECONDS,
+    ) -> dict[int, dict]:
+        """
+        Wiele produktow ze wspolnym deadline dla calej paczki, bez retry (nie zmiescilby sie w deadline).
+        1 endpoint batch (GET /products?ids=, paczki po PRODUCT_BATCH_SIZE): koszyk do 100 pozycji
+          to jedno zapytanie, czas ~ jedno wywolanie product-service
+        2 bez endpointu batch: pojedyncze GET, max PRICE_CHECK_PER_REQUEST naraz na request,
+          na wspolnej puli procesu (budget.price_check_threads)
+        Pod obciazeniem zadania czekaja w kolejce puli, deadline obejmuje to czekanie: co nie skonczy
+        sie przed deadlinem -> ProductServiceUnavailable (503 + Retry-After), nigdy stare ceny.
+        Timeout/blad sieci/5xx -> ProductServiceUnavailable, 4xx albo brak produktu -> ProductNotAvailable.
+        """
+        if not product_ids:
+            return {}
+        deadline_at = time.monotonic() + deadline
+        ids = list(dict.fromkeys(product_ids))
+
+        def call(fn, *args):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise ProductServiceUnavailable("Przekroczony czas odpowiedzi product-service")
+            try:
+                return fn(*args, remaining)
+            except HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and 400 <= status < 500:
+                    raise ProductNotAvailable(f"Product-service odrzucil zapytanie o {args[0]} ({status})") from e
+                raise ProductServiceUnavailable(f"Blad product-service: {status}") from e
+            except RequestException as e:
+                raise ProductServiceUnavailable("Brak odpowiedzi product-service") from e
+
+        if ProductClient._batch_supported:
+            chunks = [ids[i:i + PRODUCT_BATCH_SIZE] for i in range(0, len(ids), PRODUCT_BATCH_SIZE)]
+            results = self._run_bounded(
+                [(call, self._get_many, chunk) for chunk in chunks], len(chunks), deadline_at
+            )
+            if all(r is not None for r in results):
+                products = {pid: p for r in results for pid, p in r.items()}
+                missing = [pid for pid in ids if pid not in products]
+                if missing:
+                    raise ProductNotAvailable(f"Produkty niedostepne: {', '.join(map(str, missing))}")
+                return products
+            logger.warning("Product-service bez GET /products?ids=, pojedyncze zapytania")
+            ProductClient._batch_supported = False
+
+        results = self._run_bounded(
+            [(call, self._get, pid) for pid in ids], PRICE_CHECK_PER_REQUEST, deadline_at
+        )
+        return dict(zip(ids, results))
+
+    @staticmethod
+    def _run_bounded(jobs: list[tuple], limit: int, deadline_at: float) -> list:
+        """
+        Zadania na wspolnej puli procesu, max `limit` w locie z jednego requestu (kolejne
+        wysylane gdy poprzednie sie skoncza), wiec jeden duzy koszyk nie zajmuje calej puli.
+        Wyniki w kolejnosci jobs; niedokonczone przed deadline -> anulowane + ProductServiceUnavailable.
+        """
+        executor = get_price_check_executor()
+        results: list = [None] * len(jobs)
+        queued = iter(enumerate(jobs))
+        in_flight: dict = {}
+
+        def submit_next() -> None:
+            job = next(queued, None)
+            if job is not None:
+                index, (fn, *args) = job
+                #kopia kontekstu per zadanie: request id w logach i rodzic spanu w watkach puli
+                in_flight[executor.submit(contextvars.copy_context().run, fn, *args)] = index
+
+        try:
+            for _ in range(limit):
+                submit_next()
+            while in_flight:
+                done, _ = wait(
+                    in_flight,
+                    timeout=max(0.0, deadline_at - time.monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    left = len(in_flight) + sum(1 for _ in queued)
+                    raise ProductServiceUnavailable(
+                        f"Product-service nie odpowiedzial przed deadline ({left}/{len(jobs)} zapytan)"
+                    )
+                for future in done:
+                    results[in_flight.pop(future)] = future.result()
+                    submit_next()
+        finally:
+            #jeszcze nie wystartowane nie zajma puli, wystartowane koncza sie na swoim timeoucie
+            for future in in_flight:
+                future.cancel()
+        return results
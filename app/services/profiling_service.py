@@ -0,0 +1,100 @@
+#wyniki profilowania w redisie (zbierane z wielu procesow api/workerow) i sterowanie profilowaniem workerow
+import json
+import time
+import uuid
+from collections import Counter
+
+from redis.exceptions import RedisError
+
+from app.utils.logging import get_logger
+from app.utils.profiler import ProfilerBusy, SamplingProfiler, collapse
+from app.utils.redis_client import redis_client
+from app.utils.settings import PROFILE_RESULT_TTL_SECONDS
+
+logger = get_logger(__name__)
+
+REQUEST_PROFILE_KEY = "profile:request:{request_id}"   # collapsed stacks pojedynczego requestu
+WORKER_SESSION_KEY = "profile:workers:active"         # json aktywnej sesji profilowania workerow
+WORKER_PROFILE_KEY = "profile:workers:{profile_id}"   # hash stos -> liczba probek (suma z procesow)
+WORKER_META_KEY = "profile:workers:{profile_id}:meta"  # hash taski/probki/czas
+
+#jak czesto worker sprawdza flage w redisie (nie przy kazdym tasku)
+SESSION_CHECK_SECONDS = 1.0
+
+
+class ProfilingService:
+
+    def __init__(self, url: str | None = None):
+        self.redis = redis_client(url)
+        self._session: dict | None = None
+        self._session_checked = 0.0
+
+    #requesty api
+    def save_request_profile(self, request_id: str, profiler: SamplingProfiler) -> None:
+        body = collapse(profiler.samples)
+        try:
+            self.redis.set(REQUEST_PROFILE_KEY.format(request_id=request_id), body, ex=PROFILE_RESULT_TTL_SECONDS)
+        except RedisError as e:
+            logger.warning("Saving request profile failed: %s", e)
+
+    def get_request_profile(self, request_id: str) -> str | None:
+        return self.redis.get(REQUEST_PROFILE_KEY.format(request_id=request_id))
+
+    #workery celery
+    def start_worker_session(self, seconds: int, task_prefix: str, interval_ms: float) -> dict:
+        session = {
+            "id": uuid.uuid4().hex,
+            "task_prefix": task_prefix,
+            "interval_ms": interval_ms,
+            "until": time.time() + seconds,
+        }
+        self.redis.set(WORKER_SESSION_KEY, json.dumps(session), ex=seconds)
+        return session
+
+    def active_worker_session(self) -> dict | None:
+        #odczyt cache'owany per proces, task bez profilowania placi najwyzej jeden GET na sekunde
+        now = time.monotonic()
+        if now - self._session_checked >= SESSION_CHECK_SECONDS:
+            self._session_checked = now
+            try:
+                raw = self.redis.get(WORKER_SESSION_KEY)
+            except RedisError:
+                raw = None
+            self._session = json.loads(raw) if raw else None
+        if self._session and self._session["until"] < time.time():
+            self._session = None
+        return self._session
+
+    def start_task_profiler(self, task_name: str, thread_id: int) -> tuple[str, SamplingProfiler] | None:
+        session = self.active_worker_session()
+        if not session or not task_name.startswith(session["task_prefix"]):
+            return None
+        profiler = SamplingProfiler(interval=session["interval_ms"] / 1000, thread_ids={thread_id})
+        try:
+            profiler.start()
+        except ProfilerBusy:
+            #pula threads, inny task w tym procesie jest juz profilowany
+            return None
+        return session["id"], profiler
+
+    def save_task_profile(self, profile_id: str, profiler: SamplingProfiler) -> None:
+        samples = profiler.stop()
+        key = WORKER_PROFILE_KEY.format(profile_id=profile_id)
+        meta = WORKER_META_KEY.format(profile_id=profile_id)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for stack, count in samples.items():
+                pipe.hincrby(key, stack, count)
+            pipe.hincrby(meta, "tasks", 1)
+            pipe.hincrby(meta, "samples", sum(samples.values()))
+            pipe.hincrbyfloat(meta, "task_seconds", round(profiler.duration, 6))
+            pipe.expire(key, PROFILE_RESULT_TTL_SECONDS)
+            pipe.expire(meta, PROFILE_RESULT_TTL_SECONDS)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("Saving task profile failed: %s", e)
+
+    def get_worker_profile(self, profile_id: str) -> tuple[dict, str]:
+        stacks = self.redis.hgetall(WORKER_PROFILE_KEY.format(profile_id=profile_id))
+        meta = self.redis.hgetall(WORKER_META_KEY.format(profile_id=profile_id))
+        return meta, collapse(Counter({s: int(c) for s, c in stacks.items()}))
@@ -0,0 +1,172 @@
+import ipaddress
+import re
+from dataclasses import dataclass
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.utils.logging import get_logger
+from app.utils.settings import (
+    RATE_LIMIT_IP,
+    RATE_LIMIT_ROUTE_DEFAULT,
+    RATE_LIMIT_ROUTES,
+    RATE_LIMIT_TRUSTED_PROXIES,
+    RATE_LIMIT_USER,
+    REDIS_URL,
+)
+
+logger = get_logger(__name__)
+
+#LUA token bucket dla kilku kubelkow naraz (per IP/user + per route), jeden round trip
+#KEYS[i] - kubelek, ARGV[2i-1] pojemnosc, ARGV[2i] tokeny/s
+#token jest zabierany tylko jesli WSZYSTKIE kubelki go maja
+#czas z redisa (TIME) a nie z api, zeby rozne procesy nie mialy rozjechanych zegarow
+_TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tokens = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local cur = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if cur == nil then
+        cur = capacity
+        ts = now
+    end
+    cur = math.min(capacity, cur + math.max(0, now - ts) * rate)
+    tokens[i] = cur
+    if cur < 1 then
+        retry_after = math.max(retry_after, (1 - cur) / rate)
+    end
+end
+local allowed = 0
+if retry_after == 0 then
+    allowed = 1
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local cur = tokens[i]
+    if allowed == 1 then
+        cur = cur - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(cur), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return {allowed, tostring(retry_after)}
+"""
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+@dataclass(frozen=True)
+class Limit:
+    capacity: float
+    rate: float
+
+
+def parse_limit(raw: str) -> Limit:
+    #rate 0 w lua to dzielenie przez zero (retry_after, PEXPIRE inf), pojemnosc < 1 nigdy nie przepusci
+    capacity, rate = raw.split(":")
+    limit = Limit(float(capacity), float(rate))
+    if limit.capacity < 1 or limit.rate <= 0:
+        raise ValueError(f"Niepoprawny limit {raw!r}: pojemnosc >= 1 i tokeny/s > 0")
+    return limit
+
+
+def parse_route_limits(raw: str) -> dict[str, Limit]:
+    #"POST /orders/=5:1;POST /carts/{id}/items=30:10"
+    limits = {}
+    for entry in filter(None, (e.strip() for e in raw.split(";"))):
+        route, limit = entry.rsplit("=", 1)
+        limits[route.strip()] = parse_limit(limit)
+    return limits
+
+
+def parse_networks(raw: str) -> list:
+    return [ipaddress.ip_network(n.strip(), strict=False) for n in raw.split(",") if n.strip()]
+
+
+def _in_networks(address: str, networks: list) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in net for net in networks)
+
+
+def client_ip(peer: str, forwarded_for: str | None, trusted: list) -> str:
+    """
+    IP klienta do rate limitu. X-Forwarded-For tylko gdy polaczenie przyszlo od zaufanego proxy,
+    wtedy pierwszy od prawej adres spoza zaufanych (lewej czesci naglowka klient moze dopisac co chce).
+    """
+    if not forwarded_for or not _in_networks(peer, trusted):
+        return peer
+    hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _in_networks(hop, trusted):
+            return hop
+    return hops[0] if hops else peer
+
+
+def route_key(method: str, path: str) -> str:
+    #/carts/12/items -> /carts/{id}/items, zeby limit byl per route a nie per zasob
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+def validate_limits() -> None:
+    #startup api: zly RATE_LIMIT_* wywala start zamiast bledu lua przy pierwszym requestcie
+    for raw in (RATE_LIMIT_IP, RATE_LIMIT_USER, RATE_LIMIT_ROUTE_DEFAULT):
+        parse_limit(raw)
+    parse_route_limits(RATE_LIMIT_ROUTES)
+    parse_networks(RATE_LIMIT_TRUSTED_PROXIES)
+
+
+class RateLimiter:
+    """
+    Token bucket per IP i per (route, IP), a z user_id dodatkowo per user i per (route, user),
+    atomowo w redisie przez lua. user_id z query nie jest uwierzytelniony, wiec nigdy nie zastepuje
+    kubelka IP (zmiana user_id nie daje nowego kubelka). Jedno EVALSHA na request.
+    Przy awarii redisa przepuszcza ruch (fail open).
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        ip_limit: str = RATE_LIMIT_IP,
+        user_limit: str = RATE_LIMIT_USER,
+        route_default: str = RATE_LIMIT_ROUTE_DEFAULT,
+        route_limits: str = RATE_LIMIT_ROUTES,
+        trusted_proxies: str = RATE_LIMIT_TRUSTED_PROXIES,
+    ):
+        self.redis = aioredis.Redis.from_url(url or REDIS_URL, decode_responses=True)
+        self.ip_limit = parse_limit(ip_limit)
+        self.user_limit = parse_limit(user_limit)
+        self.route_default = parse_limit(route_default)
+        self.route_limits = parse_route_limits(route_limits)
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self._script = self.redis.register_script(_TOKEN_BUCKET_LUA)
+
+    async def check(self, ip: str, user_id: str | None, route: str) -> tuple[bool, float]:
+        #zwraca (czy przepuscic, po ilu sekundach sprobowac ponownie)
+        route_limit = self.route_limits.get(route, self.route_default)
+        buckets = [
+            (f"rl:ip:{ip}", self.ip_limit),
+            (f"rl:route:{route}:ip:{ip}", route_limit),
+        ]
+        if user_id:
+            buckets += [
+                (f"rl:user:u:{user_id}", self.user_limit),
+                (f"rl:route:{route}:u:{user_id}", route_limit),
+            ]
+        keys = [key for key, _ in buckets]
+        args = [v for _, limit in buckets for v in (limit.capacity, limit.rate)]
+        try:
+            allowed, retry_after = await self._script(keys=keys, args=args)
+        except RedisError as e:
+            logger.warning("Rate limiter niedostepny, przepuszczam ruch: %s", e)
+            return True, 0.0
+        return bool(int(allowed)), float(retry_after)
@@ -0,0 +1,146 @@
+import time
+from datetime import datetime, timezone
+
+from redis.exceptions import RedisError
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.data.models.cart import CartModel
+from app.data.models.cart_item import CartItemModel
+from app.data.models.order import OrderModel
+from app.utils.logging import get_logger
+from app.utils.redis_client import redis_client
+
+logger = get_logger(__name__)
+
+RESERVED_CARTS_KEY = "stats:reservations:carts"      # product_id -> ile koszykow trzyma rezerwacje
+RESERVED_QTY_KEY = "stats:reservations:quantity"     # product_id -> zarezerwowana ilosc
+CARTS_BY_STATUS_KEY = "stats:carts_by_status"        # status -> liczba koszykow
+ORDERS_MINUTE_KEY = "stats:orders:{minute}"          # licznik zamowien w danej minucie (epoch // 60)
+ORDERS_MINUTE_TTL = 2 * 60 * 60
+
+
+class StatsService:
+    """
+    Liczniki utrzymywane przyrostowo przez CartService, OrderService i expiry,
+    zamiast skanowania product:*:lock albo agregatow SQL po cart_items.
+    Kazda aktualizacja to jeden pipeline, odczyt metryki to HGET/HGETALL/MGET.
+    Liczniki sa best-effort: blad redisa nie psuje operacji biznesowej (tylko warning),
+    w razie rozjazdu mozna je przeliczyc z bazy (rebuild, python -m app.cli rebuild-stats).
+    Koszyk FINALIZED bez zamowienia nie ma przejscia ktore by zwolnilo rezerwacje (locki produktow
+    wygasaja same po TTL), liczniki dla takich koszykow koryguje rebuild z beat (rebuild_stats_task).
+    """
+
+    def __init__(self, url: str | None = None):
+        self.redis = redis_client(url)
+
+    def _apply(self, ops) -> None:
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            ops(pipe)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("Stats update failed: %s", e)
+
+    #aktualizacje
+    def cart_created(self) -> None:
+        self._apply(lambda p: p.hincrby(CARTS_BY_STATUS_KEY, "ACTIVE", 1))
+
+    def cart_status_changed(self, old: str, new: str, count: int = 1) -> None:
+        def ops(p):
+            p.hincrby(CARTS_BY_STATUS_KEY, old, -count)
+            p.hincrby(CARTS_BY_STATUS_KEY, new, count)
+        self._apply(ops)
+
+    def item_added(self, product_id: int, quantity: int, new_reservation: bool) -> None:
+        def ops(p):
+            p.hincrby(RESERVED_QTY_KEY, str(product_id), quantity)
+            if new_reservation:
+                p.hincrby(RESERVED_CARTS_KEY, str(product_id), 1)
+        self._apply(ops)
+
+    def reservations_released(self, items: list[tuple[int, int]]) -> None:
+        #items: (product_id, quantity), po jednym wpisie na koszyk
+        if not items:
+            return
+
+        def ops(p):
+            for product_id, quantity in items:
+                p.hincrby(RESERVED_QTY_KEY, str(product_id), -quantity)
+                p.hincrby(RESERVED_CARTS_KEY, str(product_id), -1)
+        self._apply(ops)
+
+    def order_created(self) -> None:
+        key = ORDERS_MINUTE_KEY.format(minute=int(time.time()) // 60)
+
+        def ops(p):
+            p.incr(key)
+            p.expire(key, ORDERS_MINUTE_TTL)
+        self._apply(ops)
+
+    #odczyt
+    def product_reservation(self, product_id: int) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(RESERVED_CARTS_KEY, str(product_id))
+        pipe.hget(RESERVED_QTY_KEY, str(product_id))
+        carts, quantity = pipe.execute()
+        return {"product_id": product_id, "carts": int(carts or 0), "quantity": int(quantity or 0)}
+
+    def snapshot(self, minutes: int = 15) -> dict:
+        now_minute = int(time.time()) // 60
+        minute_keys = [ORDERS_MINUTE_KEY.format(minute=m) for m in range(now_minute - minutes + 1, now_minute + 1)]
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(RESERVED_CARTS_KEY)
+        pipe.hgetall(RESERVED_QTY_KEY)
+        pipe.hgetall(CARTS_BY_STATUS_KEY)
+        pipe.mget(minute_keys)
+        carts, quantity, by_status, orders = pipe.execute()
+
+        reservations = {
+            int(pid): {"carts": int(n), "quantity": int(quantity.get(pid, 0))}
+            for pid, n in carts.items()
+            if int(n) > 0
+        }
+        orders_per_minute = [int(v or 0) for v in orders]
+        return {
+            "reservations": reservations,
+            "carts_by_status": {s: int(n) for s, n in by_status.items() if int(n) > 0},
+            "orders_per_minute": orders_per_minute,
+            "orders_last_minute": orders_per_minute[-1],
+        }
+
+    def rebuild(self, db: Session) -> dict:
+        """
+        Przelicza liczniki z bazy (po wdrozeniu, awarii redisa i okresowo z beat).
+        Jedyne miejsce ze skanem tabel, nie jest uzywane w sciezce requestu.
+        Rezerwacje: koszyki ACTIVE (te po terminie zwolni expiry) i FINALIZED bez zamowienia,
+        ale tylko do expires_at, potem locki produktow juz wygasly.
+        """
+        now = datetime.now(timezone.utc)
+        by_status = dict(db.execute(
+            select(CartModel.status, func.count()).group_by(CartModel.status)
+        ).all())
+        reserved = db.execute(
+            select(CartItemModel.product_id, func.count(), func.sum(CartItemModel.quantity))
+            .join(CartModel, CartModel.id == CartItemModel.cart_id)
+            .outerjoin(OrderModel, OrderModel.cart_id == CartModel.id)
+            .where(
+                or_(
+                    CartModel.status == "ACTIVE",
+                    and_(CartModel.status == "FINALIZED", CartModel.expires_at > now),
+                ),
+                OrderModel.id.is_(None),
+            )
+            .group_by(CartItemModel.product_id)
+        ).all()
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(CARTS_BY_STATUS_KEY, RESERVED_CARTS_KEY, RESERVED_QTY_KEY)
+        if by_status:
+            pipe.hset(CARTS_BY_STATUS_KEY, mapping={s: n for s, n in by_status.items()})
+        if reserved:
+            pipe.hset(RESERVED_CARTS_KEY, mapping={str(pid): n for pid, n, _ in reserved})
+            pipe.hset(RESERVED_QTY_KEY, mapping={str(pid): int(q) for pid, _, q in reserved})
+        pipe.execute()
+        return self.snapshot()
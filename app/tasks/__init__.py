@@ -1,4 +1,20 @@
 #Import wszystkich tasków Celery
-from app.tasks.expire import expire_carts_task
+from app.tasks.cart_flush import flush_carts_task
+from app.tasks.expire import (
+    expire_carts_done_task,
+    expire_carts_failed_task,
+    expire_carts_shard_task,
+    expire_carts_task,
+)
+from app.tasks.fulfillment import advance_orders_task
+from app.tasks.stats import rebuild_stats_task
 
-__all__ = ["expire_carts_task"]
\ No newline at end of file
+__all__ = [
+    "expire_carts_task",
+    "expire_carts_shard_task",
+    "expire_carts_done_task",
+    "expire_carts_failed_task",
+    "advance_orders_task",
+    "flush_carts_task",
+    "rebuild_stats_task",
+]
\ No newline at end of file
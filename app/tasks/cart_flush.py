@@ -0,0 +1,70 @@
+# app/tasks/cart_flush.py
+#write-behind koszykow z redisa do postgresa (CART_STORAGE=redis), patrz app/repos/redis_cart_repo.py
+from app.celery_worker import celery_app
+from app.data.database import SessionLocal
+from app.repos.redis_cart_repo import get_cart_store, write_back
+from app.utils.logging import get_logger
+from app.utils.settings import CART_FLUSH_BATCH_SIZE, CART_STORAGE
+
+logger = get_logger(__name__)
+
+
+def flush_dirty_carts(batch_size: int = CART_FLUSH_BATCH_SIZE, max_batches: int | None = None) -> int:
+    """
+    Zapisuje koszyki z carts:dirty do bazy, batchami (jedna transakcja na batch),
+    wpisy zdejmowane dopiero po commicie. Uzywane przez task i przez CLI (flush-carts) do replay
+    zaleglych zmian, np. przed przelaczeniem CART_STORAGE z powrotem na postgres.
+    """
+    store = get_cart_store()
+    flushed_total = 0
+    batches = 0
+
+    db = SessionLocal()
+    try:
+        while max_batches is None or batches < max_batches:
+            cart_ids = store.dirty_ids(limit=batch_size)
+            if not cart_ids:
+                break
+            views = store.load_many(cart_ids)
+
+            flushed: dict[int, int] = {}
+            stale: list[int] = []
+            for cart_id in cart_ids:
+                view = views.get(cart_id)
+                if view is None:
+                    #koszyk zniknal z redisa (TTL, eviction), nie ma czego zapisac
+                    flushed[cart_id] = 0
+                elif write_back(db, view):
+                    flushed[cart_id] = view["version"]
+                else:
+                    #w bazie koszyk juz zamkniety (np. expiry), stan z redisa jest nieaktualny
+                    stale.append(cart_id)
+                    flushed[cart_id] = view["version"]
+            db.commit()
+
+            store.evict(stale)
+            store.mark_clean(flushed)
+            flushed_total += len(flushed)
+            batches += 1
+
+            if len(cart_ids) < batch_size:
+                break
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return flushed_total
+
+
+@celery_app.task(name="app.tasks.cart_flush.flush_carts_task")
+def flush_carts_task():
+    #odpalane z beat co CART_FLUSH_INTERVAL_SECONDS, w trybie postgres nic nie robi
+    if CART_STORAGE != "redis":
+        return {"flushed": 0}
+    #ograniczenie batchy, zeby przebieg nie trwal dluzej niz interwal przy ciaglych zmianach
+    flushed = flush_dirty_carts(max_batches=20)
+    if flushed:
+        logger.info("Flushed %s carts from redis to postgres", flushed)
+    return {"flushed": flushed}
@@ -1,56 +1,215 @@
 # app/tasks/expire.py
+import json
+import time
+import uuid
 from datetime import datetime, timezone
 
+from celery import chord
+from sqlalchemy import select, update
+
 from app.celery_worker import celery_app
 from app.data.database import SessionLocal
 from app.data.models.cart import CartModel
 from app.data.models.cart_item import CartItemModel
+from app.repos.redis_cart_repo import get_cart_store
+from app.services.cart_events import CartEventPublisher, cart_event
 from app.services.lock_service import LockService
+from app.services.stats_service import StatsService
 from app.utils.logging import get_logger
+from app.utils.resources import per_process
+from app.utils.settings import (
+    CART_STORAGE,
+    EXPIRE_BATCH_SIZE,
+    EXPIRE_LEASE_SECONDS,
+    EXPIRE_SHARDS,
+)
 
 logger = get_logger(__name__)
-lock_service = LockService()
+
+#pule redisa tworzone leniwie w procesie workera (po forku), nie przy imporcie
+get_lock_service = per_process(LockService)
+get_stats_service = per_process(StatsService)
+get_event_publisher = per_process(CartEventPublisher)
+
+LEASE_NAME = "expire-carts"
+#postep per shard (hash shard -> json) i podsumowanie ostatniego przebiegu
+PROGRESS_KEY = "expire:progress"
+LAST_RUN_KEY = "expire:last_run"
+
 
 @celery_app.task(name="app.tasks.expire.expire_carts_task")
 def expire_carts_task():
-    logger.info("Expire carts task started")
+    """
+    Odpalane z beat co minute.
+    1 bierze lease w redisie, jesli poprzedni przebieg jeszcze trwa to nic nie robi
+    2 rozdziela prace na EXPIRE_SHARDS subtaskow (cart_id % shards), rownolegle na workerach,
+      shardy przedluzaja lease po kazdym batchu (dlugi przebieg nie traci go w trakcie)
+    3 expire_carts_done_task (callback chorda) zbiera raporty i zwalnia lease,
+      przy bledzie sharda expire_carts_failed_task (errback) zwalnia go od razu
+    """
+    lock_service = get_lock_service()
+    token = uuid.uuid4().hex
+    if not lock_service.acquire_lease(LEASE_NAME, token, EXPIRE_LEASE_SECONDS):
+        logger.info("Expire carts: previous sweep still running, skipping")
+        return {"skipped": True}
+
+    logger.info("Expire carts task started, %s shards", EXPIRE_SHARDS)
+    try:
+        lock_service.redis.delete(PROGRESS_KEY)
+        chord(
+            expire_carts_shard_task.s(shard, EXPIRE_SHARDS, token)
+            for shard in range(EXPIRE_SHARDS)
+        )(
+            expire_carts_done_task.s(token, time.time())
+            .on_error(expire_carts_failed_task.s(token))
+        )
+    except Exception:
+        lock_service.release_lease(LEASE_NAME, token)
+        raise
+
+    return {"skipped": False, "shards": EXPIRE_SHARDS}
+
+
+def _report_progress(shard: int, expired: int, started: float, done: bool) -> None:
+    progress = {
+        "expired": expired,
+        "duration_s": round(time.monotonic() - started, 3),
+        "done": done,
+    }
+    try:
+        get_lock_service().redis.hset(PROGRESS_KEY, str(shard), json.dumps(progress))
+    except Exception as e:
+        logger.warning("Failed to report expire progress for shard %s: %s", shard, e)
+
+
+@celery_app.task(name="app.tasks.expire.expire_carts_shard_task")
+def expire_carts_shard_task(shard: int, shards: int, token: str | None = None):
+    """
+    Wygasza koszyki z jednego sharda, batchami po EXPIRE_BATCH_SIZE:
+    UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED LIMIT n) RETURNING id, version
+    SKIP LOCKED pomija koszyki modyfikowane wlasnie przez api (i inne workery).
+    Locki produktow zwalniane po commicie, jednym pipeline na batch.
+    """
+    lock_service = get_lock_service()
+    stats_service = get_stats_service()
+    event_publisher = get_event_publisher()
+    started = time.monotonic()
+    expired = 0
+
+    #CART_STORAGE=redis: koszyki z niezapisanymi zmianami (carts:dirty) maja w bazie nieaktualne
+    #expires_at, pomijane do czasu flusha; pozostale w redisie maja ten sam stan co w bazie.
+    #kandydaci z batcha sprawdzani w carts:dirty (ZMSCORE), a nie caly zbior w NOT IN w SQL
+    cart_store = get_cart_store() if CART_STORAGE == "redis" else None
+    #keyset po id: pominiete (dirty) koszyki nie wracaja w kolejnym batchu tego przebiegu
+    after = 0
 
     db = SessionLocal()
     try:
-        now = datetime.now(timezone.utc)
+        while True:
+            now = datetime.now(timezone.utc)
 
-        carts = (
-            db.query(CartModel)
-            .filter(
-                CartModel.status == "ACTIVE",
-                CartModel.expires_at < now,
+            batch = (
+                select(CartModel.id)
+                .where(
+                    CartModel.status == "ACTIVE",
+                    CartModel.expires_at < now,
+                    CartModel.id % shards == shard,
+                    CartModel.id > after,
+                )
+                .order_by(CartModel.id)
+                .limit(EXPIRE_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
             )
-            .all()
-        )
+            if cart_store is None:
+                #jeden statement: UPDATE ... WHERE id IN (SELECT ... SKIP LOCKED)
+                targets = batch.scalar_subquery()
+                scanned = None
+            else:
+                candidates = db.execute(batch).scalars().all()
+                scanned = len(candidates)
+                if candidates:
+                    after = candidates[-1]
+                dirty = cart_store.dirty_among(candidates)
+                targets = [i for i in candidates if i not in dirty]
+
+            expired_rows = []
+            if scanned is None or targets:
+                expired_rows = db.execute(
+                    update(CartModel)
+                    .where(CartModel.id.in_(targets))
+                    .values(status="EXPIRED", version=CartModel.version + 1)
+                    .returning(CartModel.id, CartModel.version)
+                    .execution_options(synchronize_session=False)
+                ).all()
+            cart_ids = [r.id for r in expired_rows]
+
+            if not cart_ids:
+                db.commit()
+                if scanned is None or scanned < EXPIRE_BATCH_SIZE:
+                    break
+                continue
+
+            items = db.execute(
+                select(CartItemModel.product_id, CartItemModel.cart_id, CartItemModel.quantity)
+                .where(CartItemModel.cart_id.in_(cart_ids))
+            ).all()
+
+            db.commit()
 
-        logger.info(f"Found {len(carts)} carts to expire")
+            if cart_store is not None:
+                cart_store.evict(cart_ids)
 
-        for cart in carts:
-            cart.status = "EXPIRED"
-            db.add(cart)
+            try:
+                lock_service.release_product_locks([(i.product_id, i.cart_id) for i in items])
+            except Exception as e:
+                #locki i tak wygasna same (TTL)
+                logger.warning("Failed to release locks for shard %s: %s", shard, e)
 
-            items = (
-                db.query(CartItemModel)
-                .filter(CartItemModel.cart_id == cart.id)
-                .all()
+            stats_service.cart_status_changed("ACTIVE", "EXPIRED", len(cart_ids))
+            stats_service.reservations_released([(i.product_id, i.quantity) for i in items])
+            event_publisher.publish_many(
+                [cart_event(r.id, r.version, "expired", "EXPIRED") for r in expired_rows]
             )
 
-            for item in items:
-                try:
-                    lock_service.release_product_lock(
-                        product_id=item.product_id,
-                        cart_id=cart.id,
-                    )
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to release lock for product {item.product_id}: {e}"
-                    )
-        db.commit()
+            expired += len(cart_ids)
+            _report_progress(shard, expired, started, done=False)
 
+            if token is not None and not lock_service.renew_lease(LEASE_NAME, token, EXPIRE_LEASE_SECONDS):
+                #lease wygasl i mogl go wziac nastepny przebieg, nie nakladamy sie na niego
+                logger.warning("Expire shard %s: lease lost, stopping", shard)
+                break
+
+            if (len(cart_ids) if scanned is None else scanned) < EXPIRE_BATCH_SIZE:
+                break
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+    _report_progress(shard, expired, started, done=True)
+    duration = time.monotonic() - started
+    logger.info("Expire shard %s/%s: %s carts in %.3fs", shard, shards, expired, duration)
+    return {"shard": shard, "expired": expired, "duration_s": round(duration, 3)}
+
+
+@celery_app.task(name="app.tasks.expire.expire_carts_failed_task")
+def expire_carts_failed_task(request, exc, traceback, token: str):
+    #errback chorda: shard sie wywalil, callback nie ruszy, lease zwalniany od razu
+    #(inaczej kolejny przebieg czekalby caly EXPIRE_LEASE_SECONDS)
+    logger.error("Expire carts failed in %s: %s", request.id, exc)
+    get_lock_service().release_lease(LEASE_NAME, token)
+
+
+@celery_app.task(name="app.tasks.expire.expire_carts_done_task")
+def expire_carts_done_task(results: list[dict], token: str, started_at: float):
+    total = sum(r["expired"] for r in results)
+    duration = time.time() - started_at
+    summary = {
+        "expired": total,
+        "duration_s": round(duration, 3),
+        "shards": results,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }
+    lock_service = get_lock_service()
+    lock_service.redis.set(LAST_RUN_KEY, json.dumps(summary))
+    lock_service.release_lease(LEASE_NAME, token)
+    logger.info("Expire carts finished: %s carts in %.3fs", total, duration)
+    return summary
@@ -0,0 +1,51 @@
+# app/tasks/fulfillment.py
+from app.celery_worker import celery_app
+from app.data.database import SessionLocal
+from app.domain.order_state import COMPLETED, PENDING, PROCESSING
+from app.services.order_service import OrderService
+from app.utils.logging import get_logger
+from app.utils.settings import (
+    FULFILLMENT_AUTO_COMPLETE,
+    FULFILLMENT_BATCH_SIZE,
+    FULFILLMENT_MAX_BATCHES,
+)
+
+logger = get_logger(__name__)
+
+#nowe zamowienie (PENDING) idzie do realizacji (PROCESSING); PROCESSING -> COMPLETED robi realizacja
+#przez POST /admin/orders/transition, automatycznie tylko z FULFILLMENT_AUTO_COMPLETE.
+#kolejnosc krokow: najpierw PROCESSING -> COMPLETED, potem PENDING -> PROCESSING,
+#wiec zamowienie przechodzi co najwyzej jeden krok na przebieg
+PIPELINE = (
+    ((PROCESSING, COMPLETED),) if FULFILLMENT_AUTO_COMPLETE else ()
+) + (
+    (PENDING, PROCESSING),
+)
+
+
+@celery_app.task(name="app.tasks.fulfillment.advance_orders_task")
+def advance_orders_task(
+    batch_size: int = FULFILLMENT_BATCH_SIZE,
+    max_batches: int = FULFILLMENT_MAX_BATCHES,
+):
+    """
+    Przesuwa zamowienia do przodu w maszynie stanow, batchami:
+    jeden UPDATE ... RETURNING i jeden task z powiadomieniami na batch.
+    """
+    report = {}
+    db = SessionLocal()
+    try:
+        svc = OrderService(db)
+        for from_status, to_status in PIPELINE:
+            moved = 0
+            for _ in range(max_batches):
+                updated = svc.advance_batch(from_status, to_status, batch_size)
+                moved += len(updated)
+                if len(updated) < batch_size:
+                    break
+            report[f"{from_status}->{to_status}"] = moved
+    finally:
+        db.close()
+
+    logger.info("Fulfillment run: %s", report)
+    return report
@@ -0,0 +1,34 @@
+# app/tasks/stats.py
+#okresowe przeliczenie licznikow statystyk z bazy, patrz StatsService.rebuild
+from app.celery_worker import celery_app
+from app.data.database import SessionLocal
+from app.services.stats_service import StatsService
+from app.tasks.cart_flush import flush_dirty_carts
+from app.utils.logging import get_logger
+from app.utils.resources import per_process
+from app.utils.settings import CART_STORAGE
+
+logger = get_logger(__name__)
+
+get_stats_service = per_process(StatsService)
+
+
+@celery_app.task(name="app.tasks.stats.rebuild_stats_task")
+def rebuild_stats_task():
+    """
+    Odpalane z beat co STATS_REBUILD_INTERVAL_SECONDS.
+    Zeruje rozjazd licznikow rezerwacji, glownie od koszykow FINALIZED ktore nigdy nie staly sie
+    zamowieniem (zadne przejscie statusu ich nie zwalnia). W trybie CART_STORAGE=redis najpierw
+    flush zaleglych zmian, rebuild liczy z bazy.
+    """
+    if CART_STORAGE == "redis":
+        flush_dirty_carts(max_batches=20)
+
+    db = SessionLocal()
+    try:
+        snapshot = get_stats_service().rebuild(db)
+    finally:
+        db.close()
+
+    logger.info("Stats rebuilt: %s products reserved", len(snapshot["reservations"]))
+    return {"products_reserved": len(snapshot["reservations"])}
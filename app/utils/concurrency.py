@@ -0,0 +1,107 @@
+#budzet wspolbieznosci procesu api: limiter threadpoola anyio, pula db i pula redisa z jednej konfiguracji
+from dataclasses import asdict, dataclass
+
+from app.utils.load import load_monitor
+from app.utils.logging import get_logger
+from app.utils.settings import (
+    API_THREADS,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    PRICE_CHECK_PER_REQUEST,
+    PRICE_CHECK_THREADS,
+    QUEUE_BUDGET_SECONDS,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+)
+
+logger = get_logger(__name__)
+
+
+class QueueBudgetExceeded(RuntimeError):
+    #request czekal w kolejce (na watek albo polaczenie) dluzej niz pozwala budzet -> 503
+    def __init__(self, layer: str, waited: float):
+        super().__init__(f"Przekroczony budzet czekania w kolejce {layer}: {waited:.3f}s")
+        self.layer = layer
+        self.waited = waited
+
+
+@dataclass(frozen=True)
+class ConcurrencyBudget:
+    threads: int = API_THREADS
+    db_pool_size: int = DB_POOL_SIZE
+    db_max_overflow: int = DB_MAX_OVERFLOW
+    db_pool_timeout: float = DB_POOL_TIMEOUT
+    redis_max_connections: int = REDIS_MAX_CONNECTIONS
+    redis_pool_timeout: float = REDIS_POOL_TIMEOUT
+    queue_budget_s: float = QUEUE_BUDGET_SECONDS
+    #pula watkow do product-service (ceny przy finalize) i pula polaczen http tej samej wielkosci
+    price_check_threads: int = PRICE_CHECK_THREADS
+
+    def engine_options(self) -> dict:
+        return {
+            "pool_size": self.db_pool_size,
+            "max_overflow": self.db_max_overflow,
+            "pool_timeout": self.db_pool_timeout,
+        }
+
+    def warnings(self) -> list[str]:
+        #kazdy watek trzyma co najwyzej jedno polaczenie db (sesja per request)
+        found = []
+        if self.db_pool_size + self.db_max_overflow < self.threads:
+            found.append("pula db mniejsza niz liczba watkow, watki beda czekac na polaczenie")
+        if self.redis_max_connections < self.threads:
+            found.append("pula redisa mniejsza niz liczba watkow")
+        if self.price_check_threads < PRICE_CHECK_PER_REQUEST:
+            found.append("pula price check mniejsza niz limit zapytan jednego finalize")
+        return found
+
+
+budget = ConcurrencyBudget()
+
+
+def check_queue_budget(layer: str, waited: float) -> None:
+    if waited > budget.queue_budget_s:
+        raise QueueBudgetExceeded(layer, waited)
+
+
+async def configure_threadpool() -> None:
+    #startup api: limiter domyslnego threadpoola anyio (sync route, run_in_threadpool) = API_THREADS
+    import anyio.to_thread
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = budget.threads
+    for warning in budget.warnings():
+        logger.warning("Concurrency budget: %s", warning)
+    logger.info("Concurrency budget: %s", asdict(budget))
+
+
+def snapshot() -> dict:
+    #konfiguracja + biezace wykorzystanie i czekanie per warstwa (/admin/concurrency)
+    import anyio.to_thread
+
+    from app.data import database
+    from app.utils.redis_client import get_redis_pool
+
+    limiter = anyio.to_thread.current_default_thread_limiter().statistics()
+    pool = database.engine.pool
+    redis_pool = get_redis_pool()
+    return {
+        "budget": asdict(budget),
+        "warnings": budget.warnings(),
+        "threadpool": {
+            "total": limiter.total_tokens,
+            "in_use": limiter.borrowed_tokens,
+            "waiting": limiter.tasks_waiting,
+        },
+        "db_pool": {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+        },
+        "redis_pool": {
+            "max_connections": redis_pool.max_connections,
+            "in_use": redis_pool.in_use,
+        },
+        "wait": load_monitor.snapshot(),
+    }
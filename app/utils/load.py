@@ -0,0 +1,58 @@
+#pomiar czasu czekania w kolejkach (threadpool, pula polaczen db) dla admission control
+import threading
+import time
+from contextvars import ContextVar
+
+#kiedy middleware przyjal request (perf_counter), ustawiane w middleware,
+#odczytywane w watku z threadpoola zeby policzyc ile request czekal na watek
+request_started_at: ContextVar[float | None] = ContextVar("request_started_at", default=None)
+
+
+class LoadMonitor:
+    """
+    EWMA czasu czekania per warstwa (np. "threadpool", "db_pool").
+    Pomiar starszy niz `stale_after` sekund jest ignorowany, inaczej po odcieciu ruchu
+    (503) nie byloby nowych pomiarow i serwis odrzucalby requesty w nieskonczonosc.
+    """
+
+    def __init__(self, alpha: float = 0.3, stale_after: float = 2.0):
+        self.alpha = alpha
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._ewma: dict[str, float] = {}
+        self._last: dict[str, float] = {}
+        self._max: dict[str, float] = {}
+
+    def observe(self, layer: str, seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            prev = self._ewma.get(layer)
+            fresh = prev is not None and now - self._last[layer] <= self.stale_after
+            self._ewma[layer] = seconds if not fresh else prev + self.alpha * (seconds - prev)
+            self._last[layer] = now
+            self._max[layer] = max(self._max.get(layer, 0.0), seconds)
+
+    def wait(self, layer: str) -> float:
+        last = self._last.get(layer)
+        if last is None or time.monotonic() - last > self.stale_after:
+            return 0.0
+        return self._ewma.get(layer, 0.0)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        return {
+            layer: {"wait_ewma_s": self.wait(layer), "wait_max_s": self._max.get(layer, 0.0)}
+            for layer in list(self._ewma)
+        }
+
+
+load_monitor = LoadMonitor()
+
+
+def observe_threadpool_wait() -> float:
+    #wolane na poczatku pracy w watku (get_db), zwraca ile request czekal na watek
+    started = request_started_at.get()
+    if started is None:
+        return 0.0
+    waited = time.perf_counter() - started
+    load_monitor.observe("threadpool", waited)
+    return waited
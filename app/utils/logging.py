@@ -1,11 +1,122 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import sys
+from contextvars import ContextVar
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+#json (domyslnie) albo text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+#sampling per logger dla logow ponizej WARNING, np "app.services.lock_service=0.1,app.foo=0.5"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "app.services.lock_service=0.1")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+#request id, ustawiany w middleware (api) albo w task_prerun (celery)
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+
+def get_request_id() -> str | None:
+    return request_id_var.get()
+
+
+def set_request_id(request_id: str | None):
+    return request_id_var.set(request_id)
+
+
+def parse_sampling(raw: str) -> dict[str, float]:
+    rates = {}
+    for entry in filter(None, (e.strip() for e in raw.split(","))):
+        name, rate = entry.split("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    #przepuszcza `rate` czesc logow ponizej WARNING, ostrzezenia i bledy zawsze
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    W watku requestu tylko doklejamy request_id i wrzucamy record do kolejki.
+    Formatowanie (msg % args, json) i zapis na stderr robi watek QueueListener.
+    Domyslne QueueHandler.prepare formatuje w watku wywolujacym, tego unikamy.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        #pelna kolejka = gubimy log zamiast blokowac request
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def _setup() -> logging.handlers.QueueListener:
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s [%(levelname)s] %(name)s [%(request_id)s]: %(message)s"
+        ))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+_listener = _setup()
+
+
+def _restart_after_fork() -> None:
+    #watek QueueListenera nie przezywa forka (celery prefork), w dziecku stawiamy nowy
+    global _listener
+    _listener = _setup()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+_sampling = parse_sampling(LOG_SAMPLING)
+
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-)
 def get_logger(name: str):
-    return logging.getLogger(name)
+    logger = logging.getLogger(name)
+    rate = _sampling.get(name)
+    if rate is not None and not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        logger.addFilter(SamplingFilter(rate))
+    return logger
@@ -0,0 +1,126 @@
+#sampling profiler bez zaleznosci: watek co `interval` czyta sys._current_frames() i zlicza stosy
+#wynik w formacie collapsed stacks ("a;b;c 12"), wprost do flamegraph.pl / speedscope / inferno
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.utils.settings import PROFILE_INTERVAL_MS
+
+#probki z takim lisciem to watek czekajacy (pusta pula, petla zdarzen bez pracy), pomijane
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+#tylko jeden profiler na proces naraz (kazdy to dodatkowy watek probkujacy wszystkie watki)
+_active = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    marker = path.rfind("site-packages" + os.sep)
+    if marker >= 0:
+        path = path[marker + len("site-packages") + 1:]
+    else:
+        path = os.path.relpath(path) if os.path.isabs(path) else path
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Narzut: jeden watek budzacy sie co interval (domyslnie PROFILE_INTERVAL_MS) i przejscie
+    po ramkach wszystkich watkow (albo tylko thread_ids), kod profilowany nie jest instrumentowany.
+    Uzycie: with SamplingProfiler() as p: ...; p.samples -> Counter(collapsed stack -> liczba probek)
+    """
+
+    def __init__(
+        self,
+        interval: float = PROFILE_INTERVAL_MS / 1000,
+        thread_ids: set[int] | None = None,
+        exclude_ids: set[int] | None = None,
+        max_depth: int = 128,
+        skip_idle: bool = True,
+    ):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.exclude_ids = exclude_ids or set()
+        self.max_depth = max_depth
+        self.skip_idle = skip_idle
+        self.samples: Counter = Counter()
+        self.ticks = 0
+        self.started_at: float | None = None
+        self.duration = 0.0
+        self._labels: dict = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, blocking: bool = False) -> "SamplingProfiler":
+        if not _active.acquire(blocking=blocking):
+            raise ProfilerBusy("Profiler juz dziala w tym procesie")
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        if self._thread is None:
+            return self.samples
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self.started_at
+        _active.release()
+        return self.samples
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self) -> None:
+        skip = self.exclude_ids | {threading.get_ident()}
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skip or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                code = frame.f_code
+                if self.skip_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[";".join(stack)] += 1
+
+
+def profile_for(seconds: float, interval: float = PROFILE_INTERVAL_MS / 1000) -> SamplingProfiler:
+    #blokuje wywolujacy watek na `seconds`, probkuje caly proces (bez tego watku)
+    profiler = SamplingProfiler(interval=interval, exclude_ids={threading.get_ident()}).start()
+    try:
+        time.sleep(seconds)
+    finally:
+        profiler.stop()
+    return profiler
+
+
+def collapse(samples: Counter) -> str:
+    #format collapsed stacks, najczestsze stosy pierwsze
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
@@ -0,0 +1,76 @@
+#wspolna, ograniczona pula polaczen redisa na proces (zamiast osobnej nieograniczonej puli per serwis)
+import threading
+import time
+
+import redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import RedisError
+
+from app.utils.concurrency import QueueBudgetExceeded
+from app.utils.load import load_monitor
+from app.utils.resources import per_process
+from app.utils.settings import REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT, REDIS_URL
+from app.utils.tracing import TracedRedis
+
+
+class RedisPoolExhausted(QueueBudgetExceeded, RedisError):
+    """
+    Brak wolnego polaczenia w puli redisa po `timeout` -> 503 + Retry-After jak dla puli db.
+    Nadal RedisError, wiec zapisy best-effort (statystyki, zdarzenia) po cichu go pomijaja,
+    redis_retry go nie ponawia (przeciazenie, ponawianie tylko dolozy czekania).
+    """
+
+    def __init__(self, waited: float):
+        super().__init__("redis_pool", waited)
+
+
+class TimedBlockingConnectionPool(redis.BlockingConnectionPool):
+    """
+    Pula z limitem polaczen: po wyczerpaniu watek czeka max `timeout` sekund
+    (potem RedisPoolExhausted) zamiast otwierac kolejne polaczenia bez konca.
+    Czas czekania trafia do load_monitor jako warstwa "redis_pool".
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+
+    def get_connection(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except RedisConnectionError as e:
+            #BlockingConnectionPool: pusta kolejka po timeout, inne bledy (connect) bez zmian
+            if str(e) == "No connection available.":
+                raise RedisPoolExhausted(time.perf_counter() - started) from e
+            raise
+        finally:
+            load_monitor.observe("redis_pool", time.perf_counter() - started)
+        with self._stats_lock:
+            self.in_use += 1
+        return connection
+
+    def release(self, connection):
+        with self._stats_lock:
+            self.in_use = max(0, self.in_use - 1)
+        super().release(connection)
+
+
+def _make_pool() -> TimedBlockingConnectionPool:
+    return TimedBlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        decode_responses=True,
+    )
+
+
+get_redis_pool = per_process(_make_pool)
+
+
+def redis_client(url: str | None = None) -> TracedRedis:
+    #bez url: klient na wspolnej puli procesu; z url (skrypty, benchmarki) osobny klient
+    if url:
+        return TracedRedis.from_url(url, decode_responses=True)
+    return TracedRedis(connection_pool=get_redis_pool())
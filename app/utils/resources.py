@@ -0,0 +1,39 @@
+#zasoby per proces (pule polaczen redis itd), bezpieczne przy forku (celery prefork)
+import os
+import threading
+from functools import wraps
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+_registry: list[dict] = []
+
+
+def per_process(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Leniwy singleton per PID: po forku dziecko dostaje wlasna instancje
+    (nowa pula polaczen) zamiast odziedziczonych socketow rodzica.
+    """
+    cache: dict[int, T] = {}
+    lock = threading.Lock()
+    _registry.append(cache)
+
+    @wraps(factory)
+    def get() -> T:
+        pid = os.getpid()
+        instance = cache.get(pid)
+        if instance is None:
+            with lock:
+                instance = cache.get(pid)
+                if instance is None:
+                    cache.clear()
+                    instance = cache[pid] = factory()
+        return instance
+
+    return get
+
+
+def reset_process_resources() -> None:
+    #wymus utworzenie zasobow od nowa (np. w worker_process_init)
+    for cache in _registry:
+        cache.clear()
@@ -0,0 +1,296 @@
+#wbudowany, minimalny tracing zgodny z W3C traceparent (bez opentelemetry)
+#spany: route (middleware), SQL (eventy engine), komendy i pipeline'y redisa (TracedRedis),
+#http do product-service (ProductClient), taski celery (sygnaly w celery_worker)
+import importlib
+import json
+import random
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+import redis
+from redis.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.utils.logging import get_logger
+from app.utils.settings import TRACE_EXPORTER, TRACE_SAMPLE_RATIO, TRACING_ENABLED
+
+logger = get_logger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: str | None) -> SpanContext | None:
+    #00-<32 hex trace id>-<16 hex span id>-<flags>
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+@dataclass
+class Span:
+    name: str
+    context: SpanContext
+    parent_id: str | None
+    start: float = field(default_factory=time.time)
+    end_time: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+    _token: Token | None = None
+    _tracer: "Tracer | None" = None
+
+    @property
+    def duration_ms(self) -> float | None:
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start) * 1000
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def end(self, error: BaseException | None = None) -> None:
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.error = repr(error)
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        if self.context.sampled and self._tracer is not None:
+            self._tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+class SpanExporter(ABC):
+    #interfejs eksportera, nadpisz export() (np. wysylka do collectora)
+    @abstractmethod
+    def export(self, span: Span) -> None:
+        ...
+
+
+class NoopExporter(SpanExporter):
+    def export(self, span: Span) -> None:
+        pass
+
+
+class LoggingExporter(SpanExporter):
+    #span jako linia json w logach (logi ida przez kolejke, nie blokuje requestu)
+    def export(self, span: Span) -> None:
+        logger.info("span %s", json.dumps(span.to_dict(), default=str))
+
+
+class InMemoryExporter(SpanExporter):
+    #do testow, zbiera zakonczone spany
+    def __init__(self):
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+def load_exporter(name: str) -> SpanExporter:
+    if name == "log":
+        return LoggingExporter()
+    if name == "memory":
+        return InMemoryExporter()
+    if name == "none":
+        return NoopExporter()
+    module, cls = name.split(":")
+    return getattr(importlib.import_module(module), cls)()
+
+
+class Tracer:
+    """
+    Sampling decydowany w korzeniu trace'a (TRACE_SAMPLE_RATIO), dzieci dziedzicza decyzje.
+    Niesamplowane spany tylko propaguja kontekst (bez atrybutow i bez eksportu).
+    """
+
+    def __init__(self, exporter: SpanExporter, sample_ratio: float, enabled: bool = True):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.enabled = enabled
+
+    def export(self, span: Span) -> None:
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            logger.warning("Span export failed: %s", e)
+
+    def start(
+        self,
+        name: str,
+        parent: SpanContext | None = None,
+        attributes: dict[str, Any] | None = None,
+        activate: bool = True,
+    ) -> Span | None:
+        if not self.enabled:
+            return None
+
+        if parent is None:
+            cur = _current_span.get()
+            parent = cur.context if cur is not None else None
+
+        if parent is None:
+            ctx = SpanContext(_new_id(128), _new_id(64), random.random() < self.sample_ratio)
+            parent_id = None
+        else:
+            ctx = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+            parent_id = parent.span_id
+
+        span = Span(name=name, context=ctx, parent_id=parent_id, _tracer=self)
+        if attributes and ctx.sampled:
+            span.attributes.update(attributes)
+        if activate:
+            span._token = _current_span.set(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **kwargs) -> Iterator[Span | None]:
+        span = self.start(name, **kwargs)
+        try:
+            yield span
+        except BaseException as e:
+            if span is not None:
+                span.end(error=e)
+            raise
+        else:
+            if span is not None:
+                span.end()
+
+
+tracer = Tracer(load_exporter(TRACE_EXPORTER), TRACE_SAMPLE_RATIO, TRACING_ENABLED)
+
+
+def set_exporter(exporter: SpanExporter) -> None:
+    tracer.exporter = exporter
+
+
+def inject(headers: dict) -> dict:
+    #dopisz traceparent biezacego spanu do naglowkow (http, celery)
+    span = _current_span.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = span.context.to_traceparent()
+    return headers
+
+
+def _leaf_span(name: str) -> Span | None:
+    #spany-liscie (sql, redis) tylko w samplowanym trace, inaczej zero narzutu
+    cur = _current_span.get()
+    if cur is None or not cur.context.sampled:
+        return None
+    return tracer.start(name, activate=False)
+
+
+#SQL: span na kazde wykonanie statementu, dla wszystkich engine'ow
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_span_start(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    span = _leaf_span("db.query")
+    if span is not None:
+        span.set_attribute("db.statement", statement[:300])
+        context._trace_span = span
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_span_end(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, "_trace_span", None)
+    if span is not None:
+        span.set_attribute("db.rowcount", cursor.rowcount)
+        span.end()
+
+
+@event.listens_for(Engine, "handle_error")
+def _sql_span_error(exception_context):
+    span = getattr(exception_context.execution_context, "_trace_span", None)
+    if span is not None:
+        span.end(error=exception_context.original_exception)
+
+
+class TracedRedis(redis.Redis):
+    #redis.Redis ze spanem na kazda komende (GET/SET/EVALSHA ...)
+    def execute_command(self, *args, **options):
+        span = _leaf_span(f"redis.{args[0]}")
+        if span is None:
+            return super().execute_command(*args, **options)
+        try:
+            result = super().execute_command(*args, **options)
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        span.end()
+        return result
+
+    def pipeline(self, transaction=True, shard_hint=None) -> "TracedPipeline":
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TracedPipeline(Pipeline):
+    #jeden span na execute() (jeden round trip), komendy z kolejki jako atrybut
+    def execute(self, raise_on_error: bool = True):
+        span = _leaf_span("redis.pipeline")
+        if span is None:
+            return super().execute(raise_on_error)
+        commands = [str(args[0]) for args, _ in self.command_stack]
+        span.set_attribute("redis.commands", commands[:20])
+        span.set_attribute("redis.pipeline.length", len(commands))
+        span.set_attribute("redis.transaction", self.transaction)
+        try:
+            result = super().execute(raise_on_error)
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        span.end()
+        return result
@@ -0,0 +1,66 @@
+# bench/cart_conflicts.py
+#benchmark wspolbieznosci na jednym koszyku: N watkow dodaje produkty do tego samego koszyka
+#odpalac na dzialajacym stacku (docker compose up), np:
+#   python bench/cart_conflicts.py --base-url http://localhost:8000 --threads 8 --requests 200
+#wynik: rozklad kodow odpowiedzi i conflict rate (odpowiedzi 400 z "Konflikt")
+#mierzy konflikty, nie rate limit: api odpalac z RATE_LIMIT_ENABLED=0 (domyslnie),
+#429 liczone osobno i wykluczone z conflict rate
+import argparse
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def setup_cart(base_url: str, user_id: int) -> int:
+    requests.post(f"{base_url}/users/", json={"id": user_id, "name": f"bench-{user_id}"}).raise_for_status()
+    resp = requests.post(f"{base_url}/carts/", json={"user_id": user_id})
+    resp.raise_for_status()
+    return resp.json()["cart_id"]
+
+
+def run(base_url: str, threads: int, total: int, products: list[int]) -> None:
+    user_id = random.randint(100_000, 10_000_000)
+    cart_id = setup_cart(base_url, user_id)
+    session = requests.Session()
+
+    def add_one(i: int) -> tuple[int, bool]:
+        resp = session.post(
+            f"{base_url}/carts/{cart_id}/items",
+            params={"user_id": user_id},
+            json={"product_id": products[i % len(products)], "quantity": 1},
+        )
+        conflict = resp.status_code >= 400 and "Konflikt" in resp.text
+        return resp.status_code, conflict
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(add_one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    codes = Counter(code for code, _ in results)
+    conflicts = sum(1 for _, c in results if c)
+    limited = codes.get(429, 0)
+    print(f"cart={cart_id} threads={threads} requests={total} time={elapsed:.2f}s rps={total / elapsed:.1f}")
+    print(f"status codes: {dict(codes)}")
+    if limited:
+        print(f"UWAGA: {limited} odpowiedzi 429, api dziala z rate limitem (RATE_LIMIT_ENABLED=1)")
+    measured = total - limited
+    print(f"conflict rate: {conflicts / measured:.2%}" if measured else "conflict rate: n/a")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--products", default="1,2,3")
+    args = parser.parse_args()
+    run(
+        args.base_url.rstrip("/"),
+        args.threads,
+        args.requests,
+        [int(p) for p in args.products.split(",")],
+    )
@@ -0,0 +1,45 @@
+#testy skryptow lua na prawdziwym redisie (TEST_REDIS_URL, np. redis://localhost:6379/15, baza czyszczona
+#przed kazdym testem), bez niego na fakeredis z lua (pip install "fakeredis[lua]"), inaczej skip
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.tracing import TracedRedis
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+@pytest.fixture
+def redis_backend():
+    if TEST_REDIS_URL:
+        import redis.asyncio as aioredis
+
+        client = TracedRedis.from_url(TEST_REDIS_URL, decode_responses=True)
+        client.flushdb()
+        yield SimpleNamespace(
+            sync=client,
+            make_async=lambda: aioredis.Redis.from_url(TEST_REDIS_URL, decode_responses=True),
+        )
+        client.flushdb()
+        return
+
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+
+    server = fakeredis.FakeServer()
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=server, decode_responses=True)
+    yield SimpleNamespace(
+        sync=TracedRedis(connection_pool=pool),
+        make_async=lambda: fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+    )
+
+
+@pytest.fixture
+def redis_conn(redis_backend, monkeypatch):
+    #serwisy biora klienta z redis_client(url), tu podmieniany na klienta testowego
+    client = redis_backend.sync
+    for module in ("app.services.idempotency_service", "app.repos.redis_cart_repo"):
+        monkeypatch.setattr(f"{module}.redis_client", lambda url=None: client)
+    return client
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from app.services.idempotency_service import (
+    IdempotencyConflict,
+    IdempotencyKeyReused,
+    IdempotencyService,
+    fingerprint,
+)
+
+
+@pytest.fixture
+def service(redis_conn):
+    return IdempotencyService(ttl=60, lock_ttl=30, wait_timeout=0.2)
+
+
+def test_second_call_is_replayed(service):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    assert service.run("orders", "k1", {"a": 1}, fn, encode=dict) == ({"id": 1}, False)
+    assert service.run("orders", "k1", {"a": 1}, fn, encode=dict) == ({"id": 1}, True)
+    assert len(calls) == 1
+
+
+def test_key_reused_with_other_payload(service):
+    service.run("orders", "k1", {"a": 1}, lambda: 1, encode=int)
+    with pytest.raises(IdempotencyKeyReused):
+        service.run("orders", "k1", {"a": 2}, lambda: 2, encode=int)
+
+
+def test_failed_call_releases_claim(service, redis_conn):
+    def boom():
+        raise RuntimeError("x")
+
+    with pytest.raises(RuntimeError):
+        service.run("orders", "k1", {}, boom, encode=int)
+    assert redis_conn.get("idem:orders:k1") is None
+    assert service.run("orders", "k1", {}, lambda: 7, encode=int) == (7, False)
+
+
+def test_pending_claim_of_other_request_conflicts(service, redis_conn):
+    pending = {"state": "pending", "fp": fingerprint({}), "token": "other"}
+    redis_conn.set("idem:orders:k1", json.dumps(pending))
+    with pytest.raises(IdempotencyConflict):
+        service.run("orders", "k1", {}, lambda: 1, encode=int)
+
+
+def test_complete_never_overwrites_foreign_claim(service, redis_conn):
+    #claim wygasl w trakcie fn() i przejal go ponowiony request: wynik nie nadpisuje jego claimu
+    foreign = json.dumps({"state": "pending", "fp": fingerprint({}), "token": "other"})
+
+    def fn():
+        redis_conn.set("idem:orders:k1", foreign)
+        return 1
+
+    assert service.run("orders", "k1", {}, fn, encode=int) == (1, False)
+    assert redis_conn.get("idem:orders:k1") == foreign
+
+
+def test_complete_stores_result_when_claim_expired(service, redis_conn):
+    def fn():
+        redis_conn.delete("idem:orders:k1")
+        return 3
+
+    service.run("orders", "k1", {}, fn, encode=int)
+    record = json.loads(redis_conn.get("idem:orders:k1"))
+    assert record["state"] == "done" and record["body"] == 3
+    assert 0 < redis_conn.ttl("idem:orders:k1") <= 60
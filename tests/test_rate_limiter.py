@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import rate_limiter
+from app.services.rate_limiter import (
+    RateLimiter,
+    client_ip,
+    parse_limit,
+    parse_networks,
+    route_key,
+)
+
+
+def test_parse_limit_rejects_unusable_limits():
+    assert parse_limit("10:2.5") == rate_limiter.Limit(10.0, 2.5)
+    for raw in ("0:1", "5:0", "5:-1", "5"):
+        with pytest.raises(ValueError):
+            parse_limit(raw)
+
+
+def test_route_key_collapses_ids():
+    assert route_key("POST", "/carts/12/items") == "POST /carts/{id}/items"
+    assert route_key("GET", "/carts/12") == "GET /carts/{id}"
+
+
+def test_client_ip_trusts_forwarded_for_only_from_proxy():
+    proxies = parse_networks("10.0.0.0/8")
+    assert client_ip("1.2.3.4", "9.9.9.9", proxies) == "1.2.3.4"
+    assert client_ip("10.0.0.1", "6.6.6.6, 5.5.5.5", proxies) == "5.5.5.5"
+    assert client_ip("10.0.0.1", "5.5.5.5, 10.0.0.2", proxies) == "5.5.5.5"
+    assert client_ip("10.0.0.1", None, proxies) == "10.0.0.1"
+
+
+@pytest.fixture
+def make_limiter(redis_backend, monkeypatch):
+    #klient async tworzony w petli testu (asyncio.run), nie przy fixture
+    def make(**limits):
+        client = redis_backend.make_async()
+        monkeypatch.setattr(
+            rate_limiter, "aioredis", SimpleNamespace(Redis=SimpleNamespace(from_url=lambda *a, **kw: client))
+        )
+        limits.setdefault("route_default", "100:100")
+        limits.setdefault("route_limits", "")
+        return RateLimiter(**limits)
+    return make
+
+
+def test_bucket_denies_after_capacity(make_limiter):
+    async def scenario():
+        limiter = make_limiter(ip_limit="2:0.01", user_limit="100:100")
+        results = [await limiter.check("1.1.1.1", None, "GET /x") for _ in range(3)]
+        other_ip = await limiter.check("2.2.2.2", None, "GET /x")
+        return results, other_ip
+
+    results, other_ip = asyncio.run(scenario())
+    assert [allowed for allowed, _ in results] == [True, True, False]
+    assert results[-1][1] > 0
+    assert other_ip[0]
+
+
+def test_token_taken_only_when_all_buckets_allow(make_limiter):
+    async def scenario():
+        limiter = make_limiter(ip_limit="3:0.01", user_limit="1:0.01")
+        first = await limiter.check("1.1.1.1", "u1", "GET /x")
+        #kubelek usera pusty: odmowa nie zabiera tokenu z kubelka IP
+        denied = await limiter.check("1.1.1.1", "u1", "GET /x")
+        #inny user_id nie omija kubelka IP (zostaly 2 tokeny)
+        rest = [await limiter.check("1.1.1.1", f"u{i}", "GET /x") for i in range(2, 5)]
+        return first, denied, rest
+
+    first, denied, rest = asyncio.run(scenario())
+    assert first[0] and not denied[0]
+    assert [allowed for allowed, _ in rest] == [True, True, False]
+
+
+def test_route_limit_is_separate_bucket(make_limiter):
+    async def scenario():
+        limiter = make_limiter(ip_limit="100:100", user_limit="100:100", route_limits="POST /orders/=1:0.01")
+        orders = [await limiter.check("1.1.1.1", None, "POST /orders/") for _ in range(2)]
+        other = await limiter.check("1.1.1.1", None, "GET /x")
+        return orders, other
+
+    orders, other = asyncio.run(scenario())
+    assert [allowed for allowed, _ in orders] == [True, False]
+    assert other[0]
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.repos.redis_cart_repo import DIRTY_KEY, RedisCartRepo, RedisCartStore, cart_key
+
+CART_ID = 7
+
+
+def _view(status="ACTIVE", version=1, items=(), expires_in=600):
+    return {
+        "cart_id": CART_ID,
+        "user_id": 1,
+        "status": status,
+        "version": version,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=expires_in),
+        "items": list(items),
+    }
+
+
+def _item(product_id, quantity, price_minor=1000, currency="PLN"):
+    return {"product_id": product_id, "quantity": quantity, "price_minor": price_minor, "currency": currency}
+
+
+@pytest.fixture
+def store(redis_conn):
+    return RedisCartStore()
+
+
+def _add(store, product_id, quantity=1, currency="PLN", cart_id=CART_ID):
+    expires = datetime.now(timezone.utc) + timedelta(minutes=10)
+    return store.add_item(cart_id, product_id, quantity, 1000, currency, expires)
+
+
+def test_add_requires_reservation_and_active_cart(store, redis_conn):
+    assert _add(store, 1) == -1
+
+    store.seed(_view())
+    assert _add(store, 1) == -2
+
+    redis_conn.set("product:1:lock", str(CART_ID))
+    assert _add(store, 1, quantity=2) == 2
+    assert _add(store, 1, quantity=3) == 3
+    assert store.load(CART_ID)["items"] == [_item(1, 5)]
+    assert redis_conn.zscore(DIRTY_KEY, str(CART_ID)) is not None
+
+
+def test_add_rejects_other_currency(store, redis_conn):
+    store.seed(_view(items=[_item(1, 1)]))
+    redis_conn.set("product:2:lock", str(CART_ID))
+    assert _add(store, 2, currency="EUR") == -3
+    assert store.load(CART_ID)["version"] == 1
+
+
+def test_add_to_expired_or_closed_cart(store, redis_conn):
+    redis_conn.set("product:1:lock", str(CART_ID))
+    store.seed(_view(expires_in=-1))
+    assert _add(store, 1) == 0
+
+    redis_conn.delete(cart_key(CART_ID))
+    store.seed(_view(status="FINALIZED"))
+    assert _add(store, 1) == 0
+
+
+def test_remove_returns_removed_quantity(store, redis_conn):
+    assert store.remove_item(CART_ID, 1) == (-1, 0)
+
+    store.seed(_view(items=[_item(1, 4), _item(2, 1)]))
+    assert store.remove_item(CART_ID, 1) == (2, 4)
+    assert store.remove_item(CART_ID, 1) == (3, 0)
+    assert [i["product_id"] for i in store.load(CART_ID)["items"]] == [2]
+    assert redis_conn.zscore(DIRTY_KEY, str(CART_ID)) is not None
+
+
+def test_compare_and_set(store):
+    assert store.compare_and_set(CART_ID, 1, {"status": "FINALIZED"}) == -1
+
+    store.seed(_view(version=3))
+    assert store.compare_and_set(CART_ID, 2, {"status": "FINALIZED", "version": 4}) == 0
+    assert store.compare_and_set(CART_ID, 3, {"status": "FINALIZED", "version": 4}) == 1
+    view = store.load(CART_ID)
+    assert (view["status"], view["version"]) == ("FINALIZED", 4)
+
+
+def test_mark_clean_keeps_newer_changes(store, redis_conn):
+    store.seed(_view())
+    redis_conn.set("product:1:lock", str(CART_ID))
+    _add(store, 1)
+
+    store.mark_clean({CART_ID: 1})
+    assert store.dirty_ids() == [CART_ID]
+
+    store.mark_clean({CART_ID: 2})
+    assert store.dirty_ids() == []
+    assert store.load(CART_ID) is not None
+
+    store.compare_and_set(CART_ID, 2, {"status": "FINALIZED", "version": 3})
+    store.mark_clean({CART_ID: 3})
+    assert store.load(CART_ID) is None
+
+
+@pytest.fixture
+def repo(store):
+    #sesja tylko jako atrapa: write_back dostaje "zaktualizowany" wiersz, commit/rollback sa sprawdzane
+    return RedisCartRepo(MagicMock(), store=store)
+
+
+def _finalize(repo):
+    return repo.update_cart_version(CART_ID, 1, {"status": "FINALIZED", "version": 2})
+
+
+def test_finalize_rollback_reopens_cart(repo, store):
+    store.seed(_view(items=[_item(1, 2)]))
+    assert _finalize(repo) == 1
+    assert store.load(CART_ID)["status"] == "FINALIZED"
+
+    repo.rollback()
+    view = store.load(CART_ID)
+    assert (view["status"], view["version"]) == ("ACTIVE", 3)
+
+
+def test_finalize_failed_commit_reopens_cart(repo, store):
+    store.seed(_view(items=[_item(1, 2)]))
+    repo.db.commit.side_effect = RuntimeError("commit failed")
+    _finalize(repo)
+
+    with pytest.raises(RuntimeError):
+        repo.commit()
+    assert store.load(CART_ID)["status"] == "ACTIVE"
+
+
+def test_finalize_commit_drops_cart_with_new_prices(repo, store):
+    store.seed(_view(items=[_item(1, 2)]))
+    _finalize(repo)
+    repo.update_item_prices(CART_ID, [{"product_id": 1, "new_price_minor": 1200, "currency": "PLN"}])
+    assert store.load(CART_ID)["items"] == [_item(1, 2, price_minor=1200)]
+
+    repo.commit()
+    assert store.load(CART_ID) is None
+    assert store.dirty_ids() == []
@@ -0,0 +1,123 @@
+import pytest
+
+from app.utils import tracing
+from app.utils.tracing import (
+    InMemoryExporter,
+    SpanContext,
+    Tracer,
+    inject,
+    parse_traceparent,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+
+
+def test_traceparent_round_trip():
+    ctx = parse_traceparent(f"00-{TRACE_ID}-{SPAN_ID}-01")
+    assert ctx == SpanContext(TRACE_ID, SPAN_ID, True)
+    assert parse_traceparent(ctx.to_traceparent()) == ctx
+
+    unsampled = parse_traceparent(f"00-{TRACE_ID}-{SPAN_ID}-00")
+    assert unsampled.sampled is False
+    assert unsampled.to_traceparent() == f"00-{TRACE_ID}-{SPAN_ID}-00"
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    "",
+    "garbage",
+    f"00-{TRACE_ID}-{SPAN_ID}",
+    f"00-{TRACE_ID[:-1]}-{SPAN_ID}-01",
+    f"00-{TRACE_ID}-{SPAN_ID}-zz",
+    f"00-{'x' * 32}-{SPAN_ID}-01",
+    f"00-{'0' * 32}-{SPAN_ID}-01",
+    f"00-{TRACE_ID}-{'0' * 16}-01",
+])
+def test_invalid_traceparent_is_ignored(value):
+    assert parse_traceparent(value) is None
+
+
+def test_inject_propagates_current_span():
+    t = Tracer(InMemoryExporter(), sample_ratio=1.0)
+    with t.span("root") as span:
+        headers = inject({})
+    assert parse_traceparent(headers["traceparent"]) == span.context
+    assert inject({}) == {}
+
+
+def test_root_sampling_follows_ratio():
+    exporter = InMemoryExporter()
+
+    with Tracer(exporter, sample_ratio=1.0).span("sampled") as span:
+        span.set_attribute("k", "v")
+    assert span.context.sampled
+    assert [s.name for s in exporter.spans] == ["sampled"]
+    assert exporter.spans[0].attributes == {"k": "v"}
+
+    exporter.clear()
+    with Tracer(exporter, sample_ratio=0.0).span("dropped") as span:
+        span.set_attribute("k", "v")
+    assert not span.context.sampled
+    assert span.attributes == {}
+    assert exporter.spans == []
+
+
+def test_children_inherit_remote_decision():
+    exporter = InMemoryExporter()
+    #ratio 0, ale rodzic z traceparent jest samplowany: decyzja korzenia wygrywa
+    t = Tracer(exporter, sample_ratio=0.0)
+    remote = SpanContext(TRACE_ID, SPAN_ID, True)
+    with t.span("server", parent=remote) as server:
+        with t.span("child") as child:
+            pass
+    assert server.context.trace_id == child.context.trace_id == TRACE_ID
+    assert server.parent_id == SPAN_ID
+    assert child.parent_id == server.context.span_id
+    assert [s.name for s in exporter.spans] == ["child", "server"]
+
+    exporter.clear()
+    t = Tracer(exporter, sample_ratio=1.0)
+    with t.span("server", parent=SpanContext(TRACE_ID, SPAN_ID, False)):
+        with t.span("child") as child:
+            pass
+    assert not child.context.sampled
+    assert exporter.spans == []
+
+
+def test_disabled_tracer_creates_no_spans():
+    with Tracer(InMemoryExporter(), sample_ratio=1.0, enabled=False).span("x") as span:
+        assert span is None
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    exporter = InMemoryExporter()
+    monkeypatch.setattr(tracing.tracer, "exporter", exporter)
+    monkeypatch.setattr(tracing.tracer, "enabled", True)
+    return exporter
+
+
+def test_redis_commands_and_pipelines_produce_spans(redis_conn, traced):
+    with tracing.tracer.span("root", parent=SpanContext(TRACE_ID, SPAN_ID, True)):
+        redis_conn.set("k", "1")
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.hset("h", "f", "v")
+        pipe.get("k")
+        assert pipe.execute() == [1, "1"]
+
+    spans = {s.name: s for s in traced.spans}
+    assert set(spans) == {"redis.SET", "redis.pipeline", "root"}
+    pipeline = spans["redis.pipeline"]
+    assert pipeline.attributes["redis.commands"] == ["HSET", "GET"]
+    assert pipeline.attributes["redis.pipeline.length"] == 2
+    assert pipeline.parent_id == spans["root"].context.span_id
+
+
+def test_redis_spans_only_in_sampled_trace(redis_conn, traced):
+    with tracing.tracer.span("root", parent=SpanContext(TRACE_ID, SPAN_ID, False)):
+        redis_conn.set("k", "1")
+        with redis_conn.pipeline() as pipe:
+            pipe.get("k").execute()
+    redis_conn.get("k")
+    assert traced.spans == []